@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 02 Introduction to Image Data
+
+## Remove near-duplicate images before splitting the dataset
+
+Training sets built from user photos often hold the same picture several times
+(re-saved, resized or slightly edited). The copies make every epoch longer, and
+when one copy lands in the training set and another in the validation set the
+validation accuracy is too optimistic. Here near-duplicates are found with
+perceptual hashes and collapsed to one image before train_test_split.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from sklearn.model_selection import train_test_split # data splitting
+import numpy as np # arrays
+import time # track run time
+from icwithcnn_dedup import deduplicate # near-duplicate detection
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+# load the data
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames associated with each CIFAR-10 label
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# CIFAR-10 has few duplicates, so add 10,000 re-saved copies of training images:
+# slightly brighter or darker and with a little noise, like photos uploaded twice
+rng = np.random.default_rng(42)
+copy_ids = rng.integers(0, train_images.shape[0], size=10000)
+copies = train_images[copy_ids].astype(np.int16)
+copies = copies + rng.integers(-6, 7, size=(10000, 1, 1, 1)) + rng.integers(-3, 4, size=copies.shape)
+copies = np.clip(copies, 0, 255).astype(np.uint8)
+
+images = np.concatenate([train_images, copies])
+labels = np.concatenate([train_labels, train_labels[copy_ids]])
+print('Images with copies:', images.shape[0])
+
+#%%
+
+### Find and collapse the near-duplicates
+
+dedup_start = time.time()
+keep, groups, summary = deduplicate(images, labels, radius=4)
+print('Deduplication took', round(time.time() - dedup_start, 2), 'seconds')
+print(summary)
+
+# share of the added copies that were found
+print('Copies found:', round(np.mean(groups[train_images.shape[0]:] != np.arange(train_images.shape[0], images.shape[0])), 3))
+
+#%%
+
+# function to count the validation images with a near-duplicate in the training set
+
+def count_leaks(groups, train_ids, val_ids):
+
+    return int(np.isin(groups[val_ids], groups[train_ids]).sum())
+
+#%%
+
+### Split before and after deduplication
+
+# splitting positions instead of images keeps track of the groups
+all_ids = np.arange(images.shape[0])
+train_ids, val_ids = train_test_split(all_ids, test_size = 0.2, random_state=42)
+print('Validation images with a copy in training, without dedup:', count_leaks(groups, train_ids, val_ids))
+
+dedup_train_ids, dedup_val_ids = train_test_split(keep, test_size = 0.2, random_state=42)
+print('Validation images with a copy in training, with dedup:', count_leaks(groups, dedup_train_ids, dedup_val_ids))
+
+#%%
+
+### Time one training epoch on each training set
+
+# function to define the introduction model
+
+def create_model_intro():
+
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_intro = keras.Input(shape=images.shape[1:])
+    # Convolutional and pooling layers
+    x_intro = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_intro)
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    x_intro = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_intro)
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Flatten layer and Dense layer with 64 neurons
+    x_intro = keras.layers.Flatten()(x_intro)
+    x_intro = keras.layers.Dense(units=64, activation='relu')(x_intro)
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_intro = keras.layers.Dense(units=10, activation='softmax')(x_intro)
+
+    model_intro = keras.Model(inputs = inputs_intro,
+                              outputs = outputs_intro,
+                              name = "cifar_model_intro")
+
+    return model_intro
+
+epoch_seconds = {}
+for name, ids in [('without dedup', train_ids), ('with dedup', dedup_train_ids)]:
+    model_intro = create_model_intro()
+    model_intro.compile(optimizer = keras.optimizers.Adam(),
+                        loss = keras.losses.CategoricalCrossentropy(),
+                        metrics = keras.metrics.CategoricalAccuracy())
+
+    epoch_images = images[ids] / 255.0
+    epoch_labels = keras.utils.to_categorical(labels[ids], len(class_names))
+
+    epoch_start = time.time()
+    model_intro.fit(x = epoch_images, y = epoch_labels, batch_size = 32, epochs = 1, verbose = 0)
+    epoch_seconds[name] = time.time() - epoch_start
+    print('One epoch', name + ':', len(ids), 'images,', round(epoch_seconds[name], 1), 'seconds')
+
+print('Epoch time saved:', round(1 - epoch_seconds['with dedup'] / epoch_seconds['without dedup'], 3))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
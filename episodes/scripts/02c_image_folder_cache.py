@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 02 Introduction to Image Data
+
+## Cache the preprocessed images of a folder that changes every day
+
+Every image in a folder is decoded and resized with load_img(..., target_size=(32,32))
+once and kept as uint8 in one contiguous file. Each later run only decodes
+new and changed files and drops deleted ones, and the training images are
+opened as a memmap instead of being decoded again.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+import numpy as np # arrays
+import pandas as pd # handles dataframes
+import os # file paths
+import shutil # remove the full rebuild cache
+import time # track run time
+from icwithcnn_image_cache import ImageFolderCache, labels_from_folders # incremental image cache
+
+#%%
+
+# start timer
+start = time.time()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# folder of images, one sub folder per class, and the folder the cache is kept in
+image_folder = 'fit_outputs/custom_images'
+cache_folder = 'fit_outputs/custom_images_cache'
+
+#%%
+
+# a folder of JPEG files to cache: the CIFAR-10 test images, written once
+if not os.path.exists(image_folder):
+    (train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+    for number, (image, label) in enumerate(zip(test_images, test_labels[:, 0])):
+        os.makedirs(os.path.join(image_folder, class_names[label]), exist_ok=True)
+        keras.utils.save_img(os.path.join(image_folder, class_names[label], '%05d.jpg' % number), image)
+
+#%%
+
+### First run: every file is decoded
+
+cache = ImageFolderCache(image_folder, cache_folder)
+
+runs = []
+images, paths, summary = cache.update()
+runs.append(dict(summary, run='first'))
+
+#%%
+
+### Rerun over the unchanged folder: nothing is decoded
+
+# close the memmap of the last update first: an update can resize images.u8,
+# which fails on Windows while the file is still mapped
+del images
+images, paths, summary = cache.update()
+runs.append(dict(summary, run='unchanged'))
+
+#%%
+
+### A day of changes: some files deleted, some replaced, some added
+
+rng = np.random.default_rng(42)
+changes = rng.choice(len(paths), size=300, replace=False)
+
+# delete 100 files
+for path in paths[changes[:100]]:
+    os.remove(os.path.join(image_folder, path))
+
+# replace 100 files with a flipped copy
+for row in changes[100:200]:
+    keras.utils.save_img(os.path.join(image_folder, paths[row]), np.asarray(images[row])[:, ::-1])
+
+# add 100 new files, upside down copies in the same class
+for number, row in enumerate(changes[200:]):
+    class_name = paths[row].replace('\\', '/').split('/')[0]
+    keras.utils.save_img(os.path.join(image_folder, class_name, 'new_%05d.jpg' % number), np.asarray(images[row])[::-1])
+
+# close the memmap before the update resizes images.u8
+del images
+images, paths, summary = cache.update()
+runs.append(dict(summary, run='after changes'))
+
+#%%
+
+# the incremental cache must hold the same images as a cache built from scratch
+shutil.rmtree(cache_folder + '_rebuild', ignore_errors=True)
+rebuild_images, rebuild_paths, summary = ImageFolderCache(image_folder, cache_folder + '_rebuild').update()
+runs.append(dict(summary, run='full rebuild'))
+
+rebuild_order = {path: row for row, path in enumerate(rebuild_paths)}
+same = len(paths) == len(rebuild_paths) and all((images[row] == rebuild_images[rebuild_order[path]]).all()
+                                                 for row, path in enumerate(paths))
+print('Incremental cache matches a full rebuild:', same)
+
+print(pd.DataFrame(runs).set_index('run').round(3).to_string())
+
+#%%
+
+### Use the cache for training
+
+# the images are a memmap, so nothing is read until a batch needs it
+train_labels = keras.utils.to_categorical(labels_from_folders(paths, class_names), len(class_names))
+print('Training images:', images.shape, images.dtype, type(images).__name__)
+print('Number of images in each class:\n', train_labels.sum(axis=0))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 03 Build a Convolutional Neural Network
+
+## Static cost model: parameters, multiply-accumulates, activation memory and estimated run time
+
+model.summary() only lists the number of parameters in each layer. This script
+also counts the multiply-accumulate operations (MACs), the bytes needed to store
+the parameters and the largest amount of activation memory alive at any point,
+and turns them into a run time estimate. Architectures that are too big can be
+rejected before spending hours training them.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # neural network
+import numpy as np # array sizes
+import pandas as pd # handles dataframes
+import json # throughput table file
+import os # file paths
+import time # calibration timing
+
+# shape of the CIFAR-10 images
+input_shape = (32, 32, 3)
+
+# bytes per value for float32 parameters and activations
+bytes_per_value = 4
+
+# file the calibrated throughput table is saved in
+throughput_path = 'fit_outputs/cost_model_throughput.json'
+
+# throughput used until calibrate_throughput() has been run on this machine
+# macs_per_sec: multiply-accumulates per second for Conv2D and Dense layers
+# elementwise_per_sec: values per second for pooling, activations and other cheap layers
+# seconds_per_layer: fixed overhead for launching each layer
+default_throughput = {'conv_macs_per_sec': 20e9,
+                      'dense_macs_per_sec': 20e9,
+                      'elementwise_per_sec': 2e9,
+                      'seconds_per_layer': 20e-6}
+
+#%%
+
+# function to get the shape of a tensor without the batch dimension
+
+def tensor_shape(tensor):
+
+    return tuple(int(dim) for dim in tuple(tensor.shape)[1:])
+
+#%%
+
+# function to count the per-image multiply-accumulates and elementwise operations of a layer
+
+def layer_operations(layer):
+
+    macs = 0
+    elementwise = 0
+
+    # layers with no output tensor of their own (e.g. the input layer) cost nothing
+    if isinstance(layer, keras.layers.InputLayer):
+        return macs, elementwise
+
+    output_shape = tensor_shape(layer.output)
+    output_size = int(np.prod(output_shape))
+
+    if isinstance(layer, keras.layers.DepthwiseConv2D):
+        # one kernel per input channel (and depth multiplier)
+        kernel_h, kernel_w = layer.kernel_size
+        macs = output_size * kernel_h * kernel_w
+
+    elif isinstance(layer, keras.layers.SeparableConv2D):
+        # depthwise kernel followed by a 1x1 pointwise convolution
+        kernel_h, kernel_w = layer.kernel_size
+        input_channels = tensor_shape(layer.input)[-1]
+        depthwise_channels = input_channels * layer.depth_multiplier
+        spatial_size = output_size // layer.filters
+        macs = spatial_size * depthwise_channels * (kernel_h * kernel_w + layer.filters)
+
+    elif isinstance(layer, keras.layers.Conv2D):
+        # every output value is a dot product over kernel height x width x input channels
+        kernel_h, kernel_w = layer.kernel_size
+        input_channels = tensor_shape(layer.input)[-1] // getattr(layer, 'groups', 1)
+        macs = output_size * kernel_h * kernel_w * input_channels
+
+    elif isinstance(layer, keras.layers.Dense):
+        # every output value is a dot product over the input features
+        macs = output_size * tensor_shape(layer.input)[-1]
+
+    elif isinstance(layer, (keras.layers.MaxPooling2D, keras.layers.AveragePooling2D)):
+        # every output value looks at a pool_size window
+        pool_h, pool_w = layer.pool_size
+        elementwise = output_size * pool_h * pool_w
+
+    elif isinstance(layer, (keras.layers.Flatten, keras.layers.Reshape)):
+        # only changes the shape, no data is touched
+        elementwise = 0
+
+    else:
+        # activations, dropout, normalisation, rescaling and so on touch each value once
+        elementwise = output_size
+
+    # Conv2D and Dense layers apply their activation function to every output value
+    activation = getattr(layer, 'activation', None)
+    if activation is not None and getattr(activation, '__name__', '') != 'linear' and macs > 0:
+        elementwise += output_size
+
+    return macs, elementwise
+
+#%%
+
+# function to estimate the run time of a layer for a batch from a throughput table
+
+def layer_seconds(layer, macs, elementwise, batch_size, throughput):
+
+    if isinstance(layer, keras.layers.InputLayer):
+        return 0.0
+
+    if isinstance(layer, keras.layers.Dense):
+        macs_per_sec = throughput['dense_macs_per_sec']
+    else:
+        macs_per_sec = throughput['conv_macs_per_sec']
+
+    return (throughput['seconds_per_layer']
+            + batch_size * macs / macs_per_sec
+            + batch_size * elementwise / throughput['elementwise_per_sec'])
+
+#%%
+
+# function to find the peak activation memory of a model for one image
+# layers are visited in the order keras runs them; an output stays in memory
+# until the last layer that reads it has run, and model outputs stay until the end
+
+def peak_activation_values(model):
+
+    # map each output tensor to the layer that produced it
+    producers = {id(layer.output): layer.name for layer in model.layers}
+    order = {layer.name: index for index, layer in enumerate(model.layers)}
+    sizes = {layer.name: int(np.prod(tensor_shape(layer.output))) for layer in model.layers}
+
+    # the last position each layer's output is read at
+    last_use = {layer.name: order[layer.name] for layer in model.layers}
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.InputLayer):
+            continue
+        try:
+            inputs = layer.input if isinstance(layer.input, list) else [layer.input]
+        except (AttributeError, RuntimeError, ValueError):
+            # shared layers have several inputs; keep everything alive to be safe
+            return sum(sizes.values())
+        for tensor in inputs:
+            producer = producers.get(id(tensor))
+            if producer is not None:
+                last_use[producer] = max(last_use[producer], order[layer.name])
+
+    for output in model.outputs:
+        producer = producers.get(id(output))
+        if producer is not None:
+            last_use[producer] = len(model.layers)
+
+    live = 0
+    peak = 0
+    for index, layer in enumerate(model.layers):
+        live += sizes[layer.name]
+        peak = max(peak, live)
+        # free the outputs nobody reads after this layer
+        for name, position in last_use.items():
+            if position == index:
+                live -= sizes[name]
+
+    return peak
+
+#%%
+
+# function to analyse the cost of a model at a given batch size
+# returns a dataframe with one row per layer and a dictionary of totals
+
+def analyse_model_cost(model, batch_size=32, throughput=None):
+
+    if throughput is None:
+        throughput = load_throughput()
+
+    rows = []
+    for layer in model.layers:
+        macs, elementwise = layer_operations(layer)
+        params = layer.count_params()
+        rows.append({'layer': layer.name,
+                     'type': layer.__class__.__name__,
+                     'output_shape': tensor_shape(layer.output),
+                     'params': params,
+                     'param_bytes': params * bytes_per_value,
+                     'macs': macs,
+                     'activation_bytes': batch_size * int(np.prod(tensor_shape(layer.output))) * bytes_per_value,
+                     'est_seconds': layer_seconds(layer, macs, elementwise, batch_size, throughput)})
+
+    cost_df = pd.DataFrame(rows)
+
+    forward_seconds = cost_df['est_seconds'].sum()
+    totals = {'model': model.name,
+              'batch_size': batch_size,
+              'params': int(cost_df['params'].sum()),
+              'param_mb': cost_df['param_bytes'].sum() / 1024**2,
+              'macs_per_image': int(cost_df['macs'].sum()),
+              'peak_activation_mb': batch_size * peak_activation_values(model) * bytes_per_value / 1024**2,
+              'est_forward_seconds': forward_seconds,
+              # a training step is roughly one forward and two backward passes
+              'est_train_step_seconds': 3 * forward_seconds}
+
+    return cost_df, totals
+
+#%%
+
+# function to estimate the time of one training epoch
+
+def estimate_epoch_seconds(totals, num_train_images):
+
+    steps_per_epoch = int(np.ceil(num_train_images / totals['batch_size']))
+
+    return steps_per_epoch * totals['est_train_step_seconds']
+
+#%%
+
+# function to reject an architecture that goes over a budget
+# any limit left as None is not checked
+
+def check_budget(totals, max_params=None, max_peak_activation_mb=None, max_epoch_seconds=None, num_train_images=40000):
+
+    problems = []
+    if max_params is not None and totals['params'] > max_params:
+        problems.append('%d parameters > %d' % (totals['params'], max_params))
+    if max_peak_activation_mb is not None and totals['peak_activation_mb'] > max_peak_activation_mb:
+        problems.append('%.1f MB peak activations > %.1f MB' % (totals['peak_activation_mb'], max_peak_activation_mb))
+    epoch_seconds = estimate_epoch_seconds(totals, num_train_images)
+    if max_epoch_seconds is not None and epoch_seconds > max_epoch_seconds:
+        problems.append('%.1f s estimated per epoch > %.1f s' % (epoch_seconds, max_epoch_seconds))
+
+    if problems:
+        raise ValueError(totals['model'] + ' is over budget: ' + '; '.join(problems))
+
+#%%
+
+# function to load the throughput table for this machine
+
+def load_throughput():
+
+    if os.path.exists(throughput_path):
+        with open(throughput_path) as throughput_file:
+            return json.load(throughput_file)
+
+    return dict(default_throughput)
+
+#%%
+
+# function to time a single layer forward pass and return the best time in seconds
+
+def time_layer(layer, inputs, repeats=10):
+
+    # the first call builds the layer and traces the kernel
+    layer(inputs)
+
+    best = float('inf')
+    for _ in range(repeats):
+        layer_start = time.perf_counter()
+        np.asarray(layer(inputs))
+        best = min(best, time.perf_counter() - layer_start)
+
+    return best
+
+#%%
+
+# function to calibrate the throughput table by timing small layers at CIFAR-10 shapes
+
+def calibrate_throughput(batch_size=256):
+
+    rng = np.random.default_rng(42)
+
+    # convolution: 32x32x32 feature maps to 32 filters
+    conv_layer = keras.layers.Conv2D(filters=32, kernel_size=(3,3))
+    conv_inputs = rng.random((batch_size, 32, 32, 32), dtype=np.float32)
+    conv_macs = batch_size * 30 * 30 * 32 * 3 * 3 * 32
+
+    # dense: 1024 features to 1024 units
+    dense_layer = keras.layers.Dense(units=1024)
+    dense_inputs = rng.random((batch_size, 1024), dtype=np.float32)
+    dense_macs = batch_size * 1024 * 1024
+
+    # elementwise: ReLU over the convolution input
+    relu_layer = keras.layers.ReLU()
+    relu_values = conv_inputs.size
+
+    # overhead: ReLU over a single value
+    tiny_inputs = np.ones((1, 1), dtype=np.float32)
+
+    seconds_per_layer = time_layer(relu_layer, tiny_inputs)
+
+    throughput = {'conv_macs_per_sec': conv_macs / time_layer(conv_layer, conv_inputs),
+                  'dense_macs_per_sec': dense_macs / time_layer(dense_layer, dense_inputs),
+                  'elementwise_per_sec': relu_values / time_layer(relu_layer, conv_inputs),
+                  'seconds_per_layer': seconds_per_layer}
+
+    os.makedirs(os.path.dirname(throughput_path), exist_ok=True)
+    with open(throughput_path, 'w') as throughput_file:
+        json.dump(throughput, throughput_file, indent=2)
+
+    return throughput
+
+#%%
+
+# function to define the introduction model
+
+def create_model_intro():
+
+    # CNN Part 1
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_intro = keras.Input(shape=input_shape)
+
+    # CNN Part 2
+    # Convolutional layer with 16 filters, 3x3 kernel size, and ReLU activation
+    x_intro = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_intro)
+    # Pooling layer with input window sized 2x2
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Second Convolutional layer with 32 filters, 3x3 kernel size, and ReLU activation
+    x_intro = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_intro)
+    # Second Pooling layer with input window sized 2x2
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Flatten layer to convert 2D feature maps into a 1D vector
+    x_intro = keras.layers.Flatten()(x_intro)
+    # Dense layer with 64 neurons and ReLU activation
+    x_intro = keras.layers.Dense(units=64, activation='relu')(x_intro)
+
+    # CNN Part 3
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_intro = keras.layers.Dense(units=10, activation='softmax')(x_intro)
+
+    # create the model
+    model_intro = keras.Model(inputs = inputs_intro,
+                              outputs = outputs_intro,
+                              name = "cifar_model_intro")
+
+    return model_intro
+
+#%%
+
+# function to define the network depth challenge model from exercises.py
+# with the extra convolutional layer added
+
+def create_model_cnd():
+
+    inputs_cnd = keras.Input(shape=input_shape)
+    x_cnd = keras.layers.Conv2D(50, (3, 3), activation='relu')(inputs_cnd)
+    x_cnd = keras.layers.MaxPooling2D((2, 2))(x_cnd)
+    x_cnd = keras.layers.Conv2D(50, (3, 3), activation='relu')(x_cnd)
+    x_cnd = keras.layers.MaxPooling2D((2, 2))(x_cnd)
+    x_cnd = keras.layers.Conv2D(50, (3, 3), activation='relu')(x_cnd)
+    x_cnd = keras.layers.Flatten()(x_cnd)
+    x_cnd = keras.layers.Dense(50, activation='relu')(x_cnd)
+    outputs_cnd = keras.layers.Dense(10)(x_cnd)
+
+    model_cnd = keras.Model(inputs = inputs_cnd,
+                            outputs = outputs_cnd,
+                            name = "cifar_model_cnd")
+
+    return model_cnd
+
+#%%
+
+### Calibrate the throughput table for this machine
+
+# only needs to be run once per machine, afterwards load_throughput() reads the file
+if not os.path.exists(throughput_path):
+    print('Calibrated throughput:', calibrate_throughput())
+
+#%%
+
+### Analyse the lesson models
+
+# batch size used for the activation memory and run time estimates
+batch_size = 32
+
+models = [create_model_intro(), create_model_cnd()]
+
+# saved models can be analysed too
+for model_path in ['fit_outputs/model_intro.keras', 'fit_outputs/model_dropout.keras']:
+    if os.path.exists(model_path):
+        models.append(keras.models.load_model(model_path, compile=False))
+
+all_totals = []
+for model in models:
+    cost_df, totals = analyse_model_cost(model, batch_size=batch_size)
+    print()
+    print(model.name)
+    print(cost_df.to_string(index=False))
+    all_totals.append(totals)
+
+# compare the totals across the models
+totals_df = pd.DataFrame(all_totals)
+totals_df['est_epoch_seconds'] = [estimate_epoch_seconds(totals, 40000) for totals in all_totals]
+print()
+print(totals_df.to_string(index=False))
+
+#%%
+
+### Reject architectures that are over budget
+
+for totals in all_totals:
+    try:
+        check_budget(totals, max_params=200000, max_peak_activation_mb=64, max_epoch_seconds=120)
+        print(totals['model'], 'is within budget')
+    except ValueError as error:
+        print(error)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 03 Build a Convolutional Neural Network
+
+## Do architectures rank the same on a small subset as on the full data?
+
+Trying architectures on a 5,000 image subset (CNN_SUBSET=5000, see
+icwithcnn_subset.py) is only useful if the one that does best on the subset
+also does best on all 40,000 training images. Here the network-depth challenge
+variants are each fit on the full training set and on a stratified and a
+k-center subset, all checked on the same validation set, and the orders are
+compared with Spearman and Kendall rank correlations.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from sklearn.model_selection import train_test_split # data splitting
+from scipy.stats import spearmanr, kendalltau # rank correlation
+import pandas as pd # handles dataframes
+import time # track run time
+from icwithcnn_sweep import run_trial # sweep trial lifecycle
+from icwithcnn_run_callback import RunStoreCallback # saved run history
+from icwithcnn_subset import select_subset # fast-dev training subset
+
+#%%
+
+# start timer
+start = time.time()
+
+# subset size and methods to compare with the full training set
+subset_size = 5000
+subset_methods = ['stratified', 'kcenter']
+
+# epochs for every fit
+epochs = 5
+
+#%%
+
+# load the data
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# split before the subset is chosen, so every fit is checked on the same validation images
+train_images, val_images, train_labels, val_labels = train_test_split(
+train_images, train_labels, test_size = 0.2, random_state=42)
+
+# one hot encode the labels and normalise the validation images once
+val_data = (val_images / 255.0, keras.utils.to_categorical(val_labels, len(class_names)))
+
+#%%
+
+# function to define a network-depth challenge variant
+# num_conv Conv2D layers with filters filters each, and an optional Dropout layer
+
+def create_model_depth(num_conv, filters, dropout_rate):
+
+    inputs_cnd = keras.Input(shape=train_images.shape[1:])
+    x_cnd = inputs_cnd
+    for layer in range(num_conv):
+        x_cnd = keras.layers.Conv2D(filters, (3, 3), activation='relu')(x_cnd)
+        # pool after the first two Conv2D layers, the image is too small after that
+        if layer < 2:
+            x_cnd = keras.layers.MaxPooling2D((2, 2))(x_cnd)
+    if dropout_rate:
+        x_cnd = keras.layers.Dropout(rate=dropout_rate)(x_cnd)
+    x_cnd = keras.layers.Flatten()(x_cnd)
+    x_cnd = keras.layers.Dense(50, activation='relu')(x_cnd)
+    outputs_cnd = keras.layers.Dense(10, activation='softmax')(x_cnd)
+
+    model_cnd = keras.Model(inputs = inputs_cnd,
+                            outputs = outputs_cnd,
+                            name = 'cifar_model_depth_%d_%d_%s' % (num_conv, filters, dropout_rate))
+
+    model_cnd.compile(optimizer = keras.optimizers.Adam(),
+                      loss = keras.losses.CategoricalCrossentropy(),
+                      metrics = keras.metrics.CategoricalAccuracy())
+
+    return model_cnd
+
+# the variants to rank: (number of Conv2D layers, filters, dropout rate)
+candidates = [(1, 16, 0), (2, 16, 0), (2, 50, 0), (3, 50, 0), (3, 50, 0.5), (2, 50, 0.5)]
+
+#%%
+
+### Fit every variant on the full training set and on each subset
+
+# the training sets: all images, then one subset per method
+training_sets = {'full': (train_images, train_labels)}
+for method in subset_methods:
+    select_start = time.time()
+    indices = select_subset(train_images, train_labels, subset_size, method)
+    print(method, 'subset chosen in', round(time.time() - select_start, 2), 'seconds')
+    training_sets[method] = (train_images[indices], train_labels[indices])
+
+results = []
+for set_name, (images, labels) in training_sets.items():
+    fit_images = images / 255.0
+    fit_labels = keras.utils.to_categorical(labels, len(class_names))
+    for num_conv, filters, dropout_rate in candidates:
+        settings = {'num_conv': num_conv, 'filters': filters, 'dropout_rate': dropout_rate,
+                    'training_set': set_name, 'train_images': len(images), 'epochs': epochs}
+        trial = run_trial(lambda: create_model_depth(num_conv, filters, dropout_rate),
+                          dict(x = fit_images, y = fit_labels,
+                               batch_size = 32,
+                               epochs = epochs,
+                               validation_data = val_data,
+                               callbacks = [RunStoreCallback(settings = settings, script = '03c_subset_ranking.py')],
+                               verbose = 0),
+                          val_data)
+        results.append(dict(settings, val_acc = trial['val_acc'], fit_seconds = trial['fit_seconds']))
+        print(set_name, (num_conv, filters, dropout_rate), round(trial['val_acc'], 4))
+
+results_df = pd.DataFrame(results)
+results_df['candidate'] = [str((row.num_conv, row.filters, row.dropout_rate)) for row in results_df.itertuples()]
+
+#%%
+
+### Compare the rankings
+
+accuracy = results_df.pivot(index='candidate', columns='training_set', values='val_acc')
+fit_seconds = results_df.groupby('training_set')['fit_seconds'].sum()
+print(accuracy.round(4).to_string())
+
+report = []
+for method in subset_methods:
+    report.append({'subset': method,
+                   'spearman': spearmanr(accuracy['full'], accuracy[method])[0],
+                   'kendall': kendalltau(accuracy['full'], accuracy[method])[0],
+                   # does the subset pick the same best variant as the full data?
+                   'same_best': accuracy[method].idxmax() == accuracy['full'].idxmax(),
+                   # how far the subset's pick is behind the best variant on the full data
+                   'full_accuracy_lost': accuracy['full'].max() - accuracy['full'][accuracy[method].idxmax()],
+                   'fit_seconds': fit_seconds[method],
+                   'speedup': fit_seconds['full'] / fit_seconds[method]})
+
+print(pd.DataFrame(report).set_index('subset').round(3).to_string())
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -12,10 +12,21 @@ Episode 04 Compile and Train (Fit) a Convolutional Neural Network
 
 from tensorflow import keras # data and neural network
 from sklearn.model_selection import train_test_split # data splitting
-import matplotlib.pyplot as plt # plotting
-import seaborn as sns # specialised plotting
-import pandas as pd # handles dataframes
 import time # track run time
+from icwithcnn_autotune import apply_autotune_profile # machine specific settings
+from icwithcnn_run_callback import RunStoreCallback # saved run history
+from icwithcnn_reports import launch_report_rendering # plots drawn in the background
+from icwithcnn_registry import register_model # versioned models
+from icwithcnn_uint8_input import create_model_uint8 # in-graph rescaling
+from icwithcnn_subset import apply_subset, subset_settings # fast-dev training subset
+from icwithcnn_memory import MemoryTracker # stage memory tracking
+from icwithcnn_schedule import TrainingSchedule # adaptive training schedule
+
+#%%
+
+# use the batch size and thread settings tuned for this machine by
+# 06_autotune_batch_threads.py, or a batch size of 32 if it has not been run
+batch_size = apply_autotune_profile('cifar_model_dropout', 'train')
 
 #%%
 
@@ -51,6 +62,10 @@ class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', '
 # prepare the dataset for training
 train_images, val_images, train_labels, val_labels = prepare_dataset(train_images, train_labels)
 
+# a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+# chosen from the training split only, so the validation set is the same as for a full-data run
+train_images, train_labels = apply_subset(train_images, train_labels)
+
 #%%
 
 ### Improve Model Generalization (avoid Overfitting)
@@ -110,26 +125,57 @@ model_dropout.compile(optimizer = keras.optimizers.Adam(),
                       loss = keras.losses.CategoricalCrossentropy(),
                       metrics = keras.metrics.CategoricalAccuracy())
 
+# validate on the full validation set after every epoch, or with CNN_ADAPTIVE_SCHEDULE=1
+# validate every few epochs on a subset, lower the learning rate on a plateau and stop
+# early (icwithcnn_schedule.py)
+training_schedule = TrainingSchedule(val_images, val_labels)
+
+# save each epoch's metrics to the run store (fit_outputs/runs.sqlite)
+# the subset setting, (size, method) or None for every image, keeps quick CNN_SUBSET runs apart from full ones
+run_store_dropout = RunStoreCallback(settings = {'batch_size': batch_size, 'epochs': 10, 'dropout_rate': 0.5, 'subset': subset_settings(),
+                                                 'schedule': training_schedule.name},
+                                     script = '04b_build_fit_dropout_model.py')
+
+# record the memory of every epoch; with the CNN_MEMORY_BUDGET_MB environment
+# variable set, stop with an error naming the epoch when the budget is exceeded
+memory_tracker = MemoryTracker()
+
 # fit the model
 history_dropout = model_dropout.fit(x = train_images, y = train_labels,
-                                  batch_size = 32,
+                                  batch_size = batch_size,
                                   epochs = 10,
-                                  validation_data = (val_images, val_labels))
+                                  validation_data = training_schedule.validation_data(),
+                                  callbacks = training_schedule.callbacks() + [run_store_dropout, memory_tracker.callback()])
 
+# validation accuracy on the full validation set, evaluated once for the adaptive schedule
+val_accuracy_dropout = training_schedule.final_val_accuracy(model_dropout, history_dropout)
 
-# save dropout model
-model_dropout.save('fit_outputs/model_dropout.keras')
+# peak memory of each epoch
+memory_tracker.print_table()
+memory_tracker.stop()
 
-# inspect the training results
 
-# convert the history to a dataframe for plotting 
-history_dropout_df = pd.DataFrame.from_dict(history_dropout.history)
+# a model fit on a CNN_SUBSET subset is only for quick trials, so it is neither
+# saved over the full-data model nor registered
+if subset_settings() is None:
+    # save dropout model
+    model_dropout.save('fit_outputs/model_dropout.keras')
+
+    # add the model to the registry as a new version so other scripts can load it
+    # by name ('latest' or 'best') instead of by file path
+    register_model(model_dropout, val_accuracy = val_accuracy_dropout)
+
+    # also register a copy that rescales its own inputs, so prediction scripts can
+    # pass uint8 images straight in without dividing by 255.0 first
+    register_model(create_model_uint8(model_dropout), val_accuracy = val_accuracy_dropout,
+                   notes = 'uint8 input, rescaled inside the model')
+
+# inspect the training results
 
 # plot the loss and accuracy from the training process
-fig, axes = plt.subplots(1, 2)
-fig.suptitle('cifar_model_dropout')
-sns.lineplot(ax=axes[0], data=history_dropout_df[['loss', 'val_loss']])
-sns.lineplot(ax=axes[1], data=history_dropout_df[['categorical_accuracy', 'val_categorical_accuracy']])
+# the history is already in the run store, so the plot is drawn by a background
+# process (06d_render_reports.py) and saved to fit_outputs/figures
+launch_report_rendering()
 
 ########################################################
 
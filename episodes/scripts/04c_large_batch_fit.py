@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 04 Compile and Train (Fit) a Convolutional Neural Network
+
+## Large-batch training with learning rate scaling, warmup and gradient accumulation
+
+"""
+
+#%%
+
+# load the required packages
+
+import tensorflow as tf # gradient tape and variables
+from tensorflow import keras # data and neural network
+from sklearn.model_selection import train_test_split # data splitting
+import pandas as pd # handles dataframes
+import math # micro-batch count
+import time # track run time
+from icwithcnn_subset import apply_subset # fast-dev training subset
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+# function to prepare the training dataset
+
+def prepare_dataset(train_images, train_labels):
+
+    # normalize the RGB values to be between 0 and 1
+    train_images = train_images / 255.0
+
+    # one hot encode the training labels
+    train_labels = keras.utils.to_categorical(train_labels, len(class_names))
+
+    # split the training data into training and validation set
+    train_images, val_images, train_labels, val_labels = train_test_split(
+    train_images, train_labels, test_size = 0.2, random_state=42)
+
+    return train_images, val_images, train_labels, val_labels
+
+#%%
+
+# function to define the introduction model
+
+def create_model_intro():
+
+    # CNN Part 1
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_intro = keras.Input(shape=train_images.shape[1:])
+
+    # CNN Part 2
+    # Convolutional layer with 16 filters, 3x3 kernel size, and ReLU activation
+    x_intro = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_intro)
+    # Pooling layer with input window sized 2x2
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Second Convolutional layer with 32 filters, 3x3 kernel size, and ReLU activation
+    x_intro = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_intro)
+    # Second Pooling layer with input window sized 2x2
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Flatten layer to convert 2D feature maps into a 1D vector
+    x_intro = keras.layers.Flatten()(x_intro)
+    # Dense layer with 64 neurons and ReLU activation
+    x_intro = keras.layers.Dense(units=64, activation='relu')(x_intro)
+
+    # CNN Part 3
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_intro = keras.layers.Dense(units=10, activation='softmax')(x_intro)
+
+    # create the model
+    model_intro = keras.Model(inputs = inputs_intro,
+                              outputs = outputs_intro,
+                              name = "cifar_model_intro")
+
+    return model_intro
+
+#%%
+
+### Learning rate warmup
+
+# learning rate schedule that ramps up linearly from a small value to the
+# scaled learning rate over the first warmup_steps optimizer updates and then
+# stays constant; large batches are unstable if the full rate is used at once
+
+class LinearWarmup(keras.optimizers.schedules.LearningRateSchedule):
+
+    def __init__(self, target_learning_rate, warmup_steps):
+        self.target_learning_rate = target_learning_rate
+        self.warmup_steps = warmup_steps
+
+    def __call__(self, step):
+        # optimizer steps start at zero so count the current update as step + 1
+        step = tf.cast(step, tf.float32) + 1.0
+        warmup_steps = tf.cast(max(self.warmup_steps, 1), tf.float32)
+        return self.target_learning_rate * tf.minimum(1.0, step / warmup_steps)
+
+    def get_config(self):
+        return {'target_learning_rate': self.target_learning_rate,
+                'warmup_steps': self.warmup_steps}
+
+#%%
+
+### Gradient accumulation
+
+# model that sums the gradients of several micro-batches and only updates the
+# weights once every accumulation_steps batches, so an effective batch that
+# does not fit in memory can be trained as a series of smaller batches
+# each micro-batch counts by its number of images, so a smaller last batch of
+# an epoch is not weighted like a full one
+# the sum is cleared at the start of every epoch (ResetAccumulation below), so an
+# update never mixes two epochs: the last micro-batches of an epoch that do not
+# make a whole effective batch are dropped
+
+class GradientAccumulationModel(keras.Model):
+
+    def __init__(self, *args, accumulation_steps=1, micro_batch_size=32, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accumulation_steps = accumulation_steps
+        self.micro_batch_size = micro_batch_size
+        self.micro_step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.accumulated_gradients = [tf.Variable(tf.zeros_like(variable), trainable=False)
+                                      for variable in self.trainable_variables]
+
+    # drop any micro-batches not yet applied
+    def reset_accumulation(self):
+        self.micro_step.assign(0)
+        for accumulated in self.accumulated_gradients:
+            accumulated.assign(tf.zeros_like(accumulated))
+
+    def train_step(self, data):
+        x, y = data
+
+        # forward and backward pass on the micro-batch
+        with tf.GradientTape() as tape:
+            y_pred = self(x, training=True)
+            loss = self.compute_loss(x=x, y=y, y_pred=y_pred)
+        gradients = tape.gradient(loss, self.trainable_variables)
+
+        # add the micro-batch gradients to the running sum, weighted by the share
+        # of a full effective batch this micro-batch holds
+        weight = tf.cast(tf.shape(x)[0], tf.float32) / (self.micro_batch_size * self.accumulation_steps)
+        for accumulated, gradient in zip(self.accumulated_gradients, gradients):
+            accumulated.assign_add(gradient * weight)
+        self.micro_step.assign_add(1)
+
+        # apply and reset the sum once enough micro-batches have been seen
+        def apply_accumulated():
+            self.optimizer.apply_gradients(zip(self.accumulated_gradients, self.trainable_variables))
+            for accumulated in self.accumulated_gradients:
+                accumulated.assign(tf.zeros_like(accumulated))
+            return tf.constant(True)
+
+        tf.cond(self.micro_step % self.accumulation_steps == 0,
+                apply_accumulated,
+                lambda: tf.constant(False))
+
+        return self.compute_metrics(x, y, y_pred, None)
+
+# callback that clears the accumulated gradients at the start of every epoch
+# does nothing for a model that does not accumulate
+
+class ResetAccumulation(keras.callbacks.Callback):
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if isinstance(self.model, GradientAccumulationModel):
+            self.model.reset_accumulation()
+
+#%%
+
+### Large-batch compile and fit
+
+# batch size and learning rate the lesson models were tuned with
+# (32 images and the keras.optimizers.Adam() default)
+base_batch_size = 32
+base_learning_rate = 0.001
+
+# function to compile a model for a large effective batch size
+# the learning rate is scaled linearly with the batch size and warmed up over
+# the first warmup_epochs; if the effective batch is bigger than
+# max_micro_batch_size the gradients are accumulated over several micro-batches
+
+def compile_large_batch(model, batch_size, num_train_images, warmup_epochs=2, max_micro_batch_size=512):
+
+    # split the effective batch into micro-batches that fit in memory
+    # rounding up, so no micro-batch is bigger than max_micro_batch_size
+    accumulation_steps = max(1, math.ceil(batch_size / max_micro_batch_size))
+    micro_batch_size = batch_size // accumulation_steps
+
+    # scale the learning rate with the effective batch size (linear scaling rule)
+    scaled_learning_rate = base_learning_rate * batch_size / base_batch_size
+
+    # warm up over the first epochs, counted in optimizer updates
+    updates_per_epoch = max(1, num_train_images // batch_size)
+    learning_rate = LinearWarmup(scaled_learning_rate, warmup_epochs * updates_per_epoch)
+
+    # rebuild the model so the train step can accumulate gradients
+    if accumulation_steps > 1:
+        model = GradientAccumulationModel(inputs = model.inputs,
+                                          outputs = model.outputs,
+                                          accumulation_steps = accumulation_steps,
+                                          micro_batch_size = micro_batch_size,
+                                          name = model.name)
+
+    # compile the model
+    model.compile(optimizer = keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss = keras.losses.CategoricalCrossentropy(),
+                  metrics = keras.metrics.CategoricalAccuracy())
+
+    # create the optimizer state up front because it cannot be created inside
+    # the conditional update of the accumulating train step
+    if accumulation_steps > 1 and hasattr(model.optimizer, 'build'):
+        model.optimizer.build(model.trainable_variables)
+
+    return model, micro_batch_size
+
+#%%
+
+# load the data
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# prepare the dataset for training
+train_images, val_images, train_labels, val_labels = prepare_dataset(train_images, train_labels)
+
+# a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+# chosen from the training split only, so the validation set is the same as for a full-data run
+train_images, train_labels = apply_subset(train_images, train_labels)
+
+#%%
+
+# compare throughput and accuracy across effective batch sizes
+
+# specify range of batch sizes
+batch_sizes = [32, 64, 128, 256, 512, 1024, 2048]
+
+# number of epochs for each run
+epochs = 10
+
+# create empty list to hold the results
+results = []
+
+for batch_size in batch_sizes:
+
+    # create and compile the model for this batch size
+    model_large_batch, micro_batch_size = compile_large_batch(create_model_intro(),
+                                                              batch_size,
+                                                              train_images.shape[0])
+
+    # fit the model and time it
+    fit_start = time.time()
+    history_large_batch = model_large_batch.fit(x = train_images, y = train_labels,
+                                                batch_size = micro_batch_size,
+                                                epochs = epochs,
+                                                validation_data = (val_images, val_labels),
+                                                callbacks = [ResetAccumulation()],
+                                                verbose = 0)
+    fit_seconds = time.time() - fit_start
+
+    # save the results for this batch size
+    results.append({'batch_size': batch_size,
+                    'micro_batch_size': micro_batch_size,
+                    'samples_per_sec': round(epochs * train_images.shape[0] / fit_seconds, 1),
+                    'val_categorical_accuracy': round(history_large_batch.history['val_categorical_accuracy'][-1], 4)})
+    print(results[-1])
+
+# convert the results to a dataframe
+results_df = pd.DataFrame(results)
+print(results_df)
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 04 Compile and Train (Fit) a Convolutional Neural Network
+
+## Adaptive training schedule: early stopping, learning rate on plateau and cheaper validation
+
+Instead of a fixed 10 epochs with the full 10,000 image validation set after
+every epoch, the policy below validates every few epochs on a small stratified
+subset, lowers the learning rate when val_loss stops improving, stops early and
+restores the best weights. The full validation set is only used once, at the end.
+The policy is in icwithcnn_schedule.py, where the lesson fit scripts switch it on
+with CNN_ADAPTIVE_SCHEDULE=1.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from sklearn.model_selection import train_test_split # data splitting
+import pandas as pd # handles dataframes
+import time # track run time
+from icwithcnn_subset import apply_subset # fast-dev training subset
+from icwithcnn_schedule import AdaptiveTrainingPolicy, validation_subset # adaptive training schedule
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+# function to prepare the training dataset
+
+def prepare_dataset(train_images, train_labels):
+
+    # normalize the RGB values to be between 0 and 1
+    train_images = train_images / 255.0
+
+    # one hot encode the training labels
+    train_labels = keras.utils.to_categorical(train_labels, len(class_names))
+
+    # split the training data into training and validation set
+    train_images, val_images, train_labels, val_labels = train_test_split(
+    train_images, train_labels, test_size = 0.2, random_state=42)
+
+    return train_images, val_images, train_labels, val_labels
+
+#%%
+
+# function to define the dropout model
+
+def create_model_dropout():
+
+    # CNN Part 1
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_dropout = keras.Input(shape=train_images.shape[1:])
+
+    # CNN Part 2
+    # Convolutional layer with 16 filters, 3x3 kernel size, and ReLU activation
+    x_dropout = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_dropout)
+    # Pooling layer with input window sized 2x2
+    x_dropout = keras.layers.MaxPooling2D(pool_size=(2,2))(x_dropout)
+    # Second Convolutional layer with 32 filters, 3x3 kernel size, and ReLU activation
+    x_dropout = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_dropout)
+    # Second Pooling layer with input window sized 2x2
+    x_dropout = keras.layers.MaxPooling2D(pool_size=(2,2))(x_dropout)
+    # Third Convolutional layer with 64 filters, 3x3 kernel size, and ReLU activation
+    x_dropout = keras.layers.Conv2D(filters=64, kernel_size=(3,3), activation='relu')(x_dropout)
+    # Dropout layer randomly drops 50 per cent of the input units
+    x_dropout = keras.layers.Dropout(rate=0.5)(x_dropout)
+    # Flatten layer to convert 2D feature maps into a 1D vector
+    x_dropout = keras.layers.Flatten()(x_dropout)
+
+    # CNN Part 3
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_dropout = keras.layers.Dense(units=10, activation='softmax')(x_dropout)
+
+    # create the model
+    model_dropout = keras.Model(inputs = inputs_dropout,
+                                outputs = outputs_dropout,
+                                name = "cifar_model_dropout")
+
+    # compile the model
+    model_dropout.compile(optimizer = keras.optimizers.Adam(),
+                          loss = keras.losses.CategoricalCrossentropy(),
+                          metrics = keras.metrics.CategoricalAccuracy())
+
+    return model_dropout
+
+#%%
+
+# load the data
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# prepare the dataset for training
+train_images, val_images, train_labels, val_labels = prepare_dataset(train_images, train_labels)
+
+# a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+# chosen from the training split only, so the validation set is the same as for a full-data run
+train_images, train_labels = apply_subset(train_images, train_labels)
+
+# small validation subset with the same share of each class as the full validation set
+val_images_subset, val_labels_subset = validation_subset(val_images, val_labels, size = 2000)
+
+#%%
+
+# most epochs either run may use
+epochs = 10
+
+#%%
+
+### Fixed schedule: full validation after every epoch
+
+model_fixed = create_model_dropout()
+
+fixed_cpu_start = time.process_time()
+history_fixed = model_fixed.fit(x = train_images, y = train_labels,
+                                batch_size = 32,
+                                epochs = epochs,
+                                validation_data = (val_images, val_labels))
+fixed_cpu_seconds = time.process_time() - fixed_cpu_start
+
+fixed_val_loss, fixed_val_acc = model_fixed.evaluate(val_images, val_labels, verbose=0)
+
+#%%
+
+### Adaptive schedule
+
+model_adaptive = create_model_dropout()
+policy = AdaptiveTrainingPolicy(val_images_subset, val_labels_subset, validate_every=2)
+
+adaptive_cpu_start = time.process_time()
+history_adaptive = model_adaptive.fit(x = train_images, y = train_labels,
+                                      batch_size = 32,
+                                      epochs = epochs,
+                                      callbacks = [policy])
+
+# a single full validation with the restored best weights
+adaptive_val_loss, adaptive_val_acc = model_adaptive.evaluate(val_images, val_labels, verbose=0)
+adaptive_cpu_seconds = time.process_time() - adaptive_cpu_start
+
+#%%
+
+# compare the two schedules
+comparison_df = pd.DataFrame([
+    {'schedule': 'fixed', 'epochs_run': epochs, 'validation_images': epochs * val_images.shape[0],
+     'cpu_seconds': fixed_cpu_seconds, 'val_loss': fixed_val_loss, 'val_categorical_accuracy': fixed_val_acc},
+    {'schedule': 'adaptive', 'epochs_run': policy.epochs_run,
+     'validation_images': policy.validations * val_images_subset.shape[0] + val_images.shape[0],
+     'cpu_seconds': adaptive_cpu_seconds, 'val_loss': adaptive_val_loss, 'val_categorical_accuracy': adaptive_val_acc}])
+print(comparison_df.round(4).to_string(index=False))
+
+print()
+print('Epochs saved:', epochs - policy.epochs_run)
+print('CPU seconds saved:', round(fixed_cpu_seconds - adaptive_cpu_seconds, 1))
+print('Accuracy change:', round(adaptive_val_acc - fixed_val_acc, 4))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
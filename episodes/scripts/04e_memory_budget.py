@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 04 Compile and Train (Fit) a Convolutional Neural Network
+
+## Track peak memory of each stage and enforce a memory budget
+
+The steps of 04_fit_intro_model.py plus evaluation and prediction, each run as
+a named stage of a MemoryTracker. Set a budget (in MB) below, or with the
+CNN_MEMORY_BUDGET_MB environment variable, to stop with an error that names the
+stage instead of the job being killed by the operating system.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from sklearn.model_selection import train_test_split # data splitting
+import numpy as np # array sizes
+import time # track run time
+from icwithcnn_memory import MemoryTracker, MemoryBudgetExceeded, current_rss_bytes # stage memory tracking
+from icwithcnn_subset import apply_subset # fast-dev training subset
+
+#%%
+
+# start timer
+start = time.time()
+
+# memory budget in MB, None records without enforcing a limit
+memory_budget_mb = None
+
+tracker = MemoryTracker(budget_mb=memory_budget_mb)
+
+#%%
+
+# function to prepare the training dataset
+# checks the budget before making the float64 copy and the split copies
+
+def prepare_dataset(train_images, train_labels):
+
+    # dividing uint8 pixels by 255.0 makes a float64 copy, 8 bytes per value
+    tracker.require(train_images.size * 8, 'the float64 normalised images')
+
+    # normalize the RGB values to be between 0 and 1
+    train_images = train_images / 255.0
+
+    # one hot encode the training labels
+    train_labels = keras.utils.to_categorical(train_labels, len(class_names))
+
+    # train_test_split copies every array once more
+    tracker.require(train_images.nbytes + train_labels.nbytes, 'the train/validation split copies')
+
+    # split the training data into training and validation set
+    train_images, val_images, train_labels, val_labels = train_test_split(
+    train_images, train_labels, test_size = 0.2, random_state=42)
+
+    return train_images, val_images, train_labels, val_labels
+
+#%%
+
+# function to define the introduction model
+
+def create_model_intro():
+
+    # CNN Part 1
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_intro = keras.Input(shape=train_images.shape[1:])
+
+    # CNN Part 2
+    # Convolutional layer with 16 filters, 3x3 kernel size, and ReLU activation
+    x_intro = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_intro)
+    # Pooling layer with input window sized 2x2
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Second Convolutional layer with 32 filters, 3x3 kernel size, and ReLU activation
+    x_intro = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_intro)
+    # Second Pooling layer with input window sized 2x2
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Flatten layer to convert 2D feature maps into a 1D vector
+    x_intro = keras.layers.Flatten()(x_intro)
+    # Dense layer with 64 neurons and ReLU activation
+    x_intro = keras.layers.Dense(units=64, activation='relu')(x_intro)
+
+    # CNN Part 3
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_intro = keras.layers.Dense(units=10, activation='softmax')(x_intro)
+
+    # create the model
+    model_intro = keras.Model(inputs = inputs_intro,
+                              outputs = outputs_intro,
+                              name = "cifar_model_intro")
+
+    return model_intro
+
+#%%
+
+### Run each step as a tracked stage
+
+with tracker.stage('load'):
+    # load the data
+    (train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+    # create a list of classnames
+    class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+with tracker.stage('prepare'):
+    # prepare the dataset for training
+    train_images, val_images, train_labels, val_labels = prepare_dataset(train_images, train_labels)
+
+    # a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+    # chosen from the training split only, so the validation set is the same as for a full-data run
+    train_images, train_labels = apply_subset(train_images, train_labels)
+
+with tracker.stage('build'):
+    # create and compile the introduction model
+    model_intro = create_model_intro()
+    model_intro.compile(optimizer = keras.optimizers.Adam(),
+                        loss = keras.losses.CategoricalCrossentropy(),
+                        metrics = keras.metrics.CategoricalAccuracy())
+
+with tracker.stage('fit'):
+    # fit the model, the callback adds a row for every epoch
+    history_intro = model_intro.fit(x = train_images, y = train_labels,
+                                    batch_size = 32,
+                                    epochs = 10,
+                                    validation_data = (val_images, val_labels),
+                                    callbacks = [tracker.callback()])
+
+with tracker.stage('evaluate'):
+    # evaluate the model on the validation set
+    val_loss, val_acc = model_intro.evaluate(val_images, val_labels, callbacks = [tracker.callback()])
+
+with tracker.stage('predict'):
+    # normalize test dataset RGB values to be between 0 and 1
+    tracker.require(test_images.size * 8, 'the float64 normalised test images')
+    test_images = test_images / 255.0
+
+    # predict the test set
+    predictions = model_intro.predict(x = test_images, callbacks = [tracker.callback()])
+    print('Test accuracy:', round(np.mean(predictions.argmax(axis=1) == test_labels[:, 0]), 2))
+
+#%%
+
+# compact table of every stage
+tracker.print_table()
+tracker.stop()
+
+#%%
+
+# check that a stage going over a budget stops with MemoryBudgetExceeded:
+# the budget is 25 MB above what the process uses now, so a stage without a large
+# allocation stays under it and a stage with a 50 MB allocation goes over it
+check_tracker = MemoryTracker(budget_mb=current_rss_bytes() / 1024**2 + 25)
+try:
+    with check_tracker.stage('budget check, no allocation'):
+        check_block = np.ones(1024, dtype=np.uint8)
+
+    try:
+        with check_tracker.stage('budget check, 50 MB allocation'):
+            check_block = np.ones(50 * 1024**2, dtype=np.uint8)
+        raise AssertionError('The memory budget was exceeded but MemoryBudgetExceeded was not raised')
+    except MemoryBudgetExceeded as error:
+        print('Budget breach raised as expected:', error)
+finally:
+    del check_block
+    check_tracker.stop()
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
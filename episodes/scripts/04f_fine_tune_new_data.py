@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 04 Compile and Train (Fit) a Convolutional Neural Network
+
+## Fine-tune a saved model on newly labelled images
+
+Instead of retraining the dropout model from scratch over the whole dataset
+whenever new labelled images arrive, the saved model is trained for a few
+epochs on the new images mixed with a small, class-balanced replay sample of
+the old training images. The replay sample is saved once, so later runs only
+load the sample and the new images. Fine-tuning is timed against a full
+retrain (compare_full_retrain), and the fine-tuned model is only registered if
+it does no worse than the saved model and the best from-scratch model on a
+held-out set. The new images it was tuned on then join the replay sample.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from sklearn.model_selection import train_test_split # data splitting
+import numpy as np # arrays
+import pandas as pd # handles dataframes
+import os # file paths
+import time # track run time
+from icwithcnn_registry import load_registered_model, register_model, resolve_model # versioned models
+from icwithcnn_fine_tune import ReplayBuffer, fine_tune_dataset, prepare_fine_tune_model, TimeToAccuracy, model_accuracy, regression_check, replay_path # fine-tuning
+
+#%%
+
+# start timer
+start = time.time()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# registered model to fine-tune: the latest version, which is the last fine-tuned
+# model once one has passed the regression guard
+model_name = 'cifar_model_dropout'
+model_ref = 'latest'
+
+# fixed baseline every fine-tuned model is also checked against: fine-tuned
+# versions are registered without a validation accuracy, so 'best' stays the
+# best model trained from scratch
+baseline_ref = 'best'
+
+# keep the Conv2D weights and only train the layers after them
+freeze_conv = True
+
+# old images kept for replay, per class
+replay_per_class = 500
+
+# largest accuracy drop on the held-out set before the fine-tuned model is rejected
+tolerance = 0.01
+
+# also retrain from scratch on every old and new image to compare the time taken;
+# without it the old training images are only needed to build the replay sample once
+compare_full_retrain = True
+
+#%%
+
+# load the data
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# stand in for a new batch of labelled images: half of the test set
+# the other half is held out: 2,500 images to time accuracy and 2,500 to check for regression
+new_images, new_labels = test_images[:5000], test_labels[:5000]
+val_images, val_labels = test_images[5000:7500], test_labels[5000:7500]
+guard_images, guard_labels = test_images[7500:], test_labels[7500:]
+
+# the 40,000 training images the saved model was fit on, kept as uint8
+# only split off when the replay sample is built or the full retrain is run
+if compare_full_retrain or not os.path.exists(replay_path):
+    old_images, _, old_labels, _ = train_test_split(train_images, train_labels, test_size = 0.2, random_state=42)
+del train_images, train_labels
+
+#%%
+
+### Replay sample of the old data
+
+# built once by streaming over the old images in chunks, then loaded from fit_outputs/
+if os.path.exists(replay_path):
+    replay = ReplayBuffer.load(replay_path)
+else:
+    replay = ReplayBuffer(replay_per_class, len(class_names), old_images.shape[1:])
+    for chunk_start in range(0, len(old_images), 4096):
+        replay.add(old_images[chunk_start:chunk_start + 4096], old_labels[chunk_start:chunk_start + 4096])
+    replay.save(replay_path)
+
+replay_images, replay_labels = replay.sample()
+print('Replay images in each class:', np.bincount(replay_labels, minlength=len(class_names)))
+
+#%%
+
+### Fine-tune the saved model
+
+model_saved = load_registered_model(model_name, model_ref)
+
+# the held-out accuracy of the saved model is the accuracy both runs have to reach
+target_accuracy = model_accuracy(model_saved, val_images, val_labels)
+print('Saved model held-out accuracy:', round(target_accuracy, 4))
+
+model_tune = prepare_fine_tune_model(model_saved, freeze_conv=freeze_conv)
+
+# new and replay images together, normalised one batch at a time
+tune_dataset = fine_tune_dataset(np.concatenate([new_images, replay_images]),
+                                 np.concatenate([new_labels.ravel(), replay_labels]),
+                                 len(class_names), batch_size = 32)
+val_dataset = fine_tune_dataset(val_images, val_labels, len(class_names), batch_size = 256)
+
+time_tune = TimeToAccuracy(target_accuracy)
+tune_start = time.time()
+history_tune = model_tune.fit(tune_dataset,
+                              epochs = 5,
+                              validation_data = val_dataset,
+                              callbacks = [time_tune])
+tune_seconds = time.time() - tune_start
+
+#%%
+
+### Full retrain for comparison
+
+# function to define the dropout model
+def create_model_dropout():
+
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_dropout = keras.Input(shape=new_images.shape[1:])
+    # Convolutional and pooling layers
+    x_dropout = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_dropout)
+    x_dropout = keras.layers.MaxPooling2D(pool_size=(2,2))(x_dropout)
+    x_dropout = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_dropout)
+    x_dropout = keras.layers.MaxPooling2D(pool_size=(2,2))(x_dropout)
+    x_dropout = keras.layers.Conv2D(64, (3, 3), activation='relu')(x_dropout)
+    # Dropout layer randomly drops 50 per cent of the input units
+    x_dropout = keras.layers.Dropout(rate=0.5)(x_dropout)
+    # Flatten layer and output layer with 10 units (one for each class)
+    x_dropout = keras.layers.Flatten()(x_dropout)
+    outputs_dropout = keras.layers.Dense(units=10, activation='softmax')(x_dropout)
+
+    model_dropout = keras.Model(inputs = inputs_dropout,
+                              outputs = outputs_dropout,
+                              name = "cifar_model_dropout")
+
+    return model_dropout
+
+# only with compare_full_retrain; the old images are otherwise not loaded
+if compare_full_retrain:
+    model_full = create_model_dropout()
+    model_full.compile(optimizer = keras.optimizers.Adam(),
+                       loss = keras.losses.CategoricalCrossentropy(),
+                       metrics = keras.metrics.CategoricalAccuracy())
+
+    # every old image and every new image, as the retrain is done today
+    full_dataset = fine_tune_dataset(np.concatenate([old_images, new_images]),
+                                     np.concatenate([old_labels.ravel(), new_labels.ravel()]),
+                                     len(class_names), batch_size = 32)
+
+    time_full = TimeToAccuracy(target_accuracy)
+    full_start = time.time()
+    history_full = model_full.fit(full_dataset,
+                                  epochs = 10,
+                                  validation_data = val_dataset,
+                                  callbacks = [time_full])
+    full_seconds = time.time() - full_start
+
+#%%
+
+### Compare
+
+runs = [{'run': 'fine-tune', 'train_images': len(new_images) + len(replay_images),
+         'seconds_to_target': time_tune.seconds, 'epochs_to_target': time_tune.epoch,
+         'total_seconds': tune_seconds,
+         'final_val_accuracy': history_tune.history['val_categorical_accuracy'][-1]}]
+if compare_full_retrain:
+    runs.append({'run': 'full retrain', 'train_images': len(old_images) + len(new_images),
+                 'seconds_to_target': time_full.seconds, 'epochs_to_target': time_full.epoch,
+                 'total_seconds': full_seconds,
+                 'final_val_accuracy': history_full.history['val_categorical_accuracy'][-1]})
+
+print('Target held-out accuracy:', round(target_accuracy, 4))
+print(pd.DataFrame(runs).set_index('run').round(3).to_string())
+
+#%%
+
+### Regression guard
+
+# the fine-tuned model must not do worse than the saved model, nor than the fixed
+# baseline, on images neither run has seen; without the baseline each round
+# could lose up to tolerance on the round before
+if resolve_model(model_name, baseline_ref)['version'] != resolve_model(model_name, model_ref)['version']:
+    model_baseline = load_registered_model(model_name, baseline_ref)
+else:
+    # the saved model is the baseline, so it is only checked once
+    model_baseline = None
+guard = regression_check(model_saved, model_tune, guard_images, guard_labels, tolerance=tolerance,
+                         baseline_model=model_baseline)
+print(guard)
+
+if guard['passed']:
+    # the guard accuracy is on other images than the validation accuracy of the
+    # other versions, so it is kept in the notes and 'best' is left as it is
+    register_model(model_tune, notes = 'fine-tuned on 5,000 new images with replay; held-out accuracy '
+                   + str(round(guard['accuracy_before'], 4)) + ' -> ' + str(round(guard['accuracy_after'], 4)))
+
+    # the new images are old data for the next round, so they join the replay sample
+    if replay.add_batch(new_images, new_labels):
+        replay.save(replay_path)
+    else:
+        print('These new images are already in the replay sample')
+else:
+    print('Fine-tuned model not registered: held-out accuracy dropped by more than', tolerance)
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
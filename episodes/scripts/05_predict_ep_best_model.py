@@ -10,11 +10,26 @@ Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classif
 # load the required packages
 
 from tensorflow import keras # data and neural network
-import seaborn as sns # specialised plotting
 import pandas as pd # handles dataframes
 import numpy as np # for argmax
 from sklearn.metrics import accuracy_score
 from sklearn.metrics import confusion_matrix
+from icwithcnn_autotune import apply_autotune_profile # machine specific settings
+from icwithcnn_reports import save_confusion_matrix, launch_report_rendering # plots drawn in the background
+from icwithcnn_registry import load_registered_model # versioned models
+from icwithcnn_tta import create_model_tta # test-time augmentation
+
+#%%
+
+# use the batch size and thread settings tuned for this machine by
+# 06_autotune_batch_threads.py, or a batch size of 32 if it has not been run
+predict_batch_size = apply_autotune_profile('cifar_model_dropout', 'predict')
+
+# test-time augmentation: set to True to predict on flipped and shifted views of
+# every image in one forward pass and average them (see 05b_predict_tta.py for
+# the accuracy gain and speed cost of each number of views)
+use_tta = False
+tta_views = 4
 
 #%%
 
@@ -50,18 +65,28 @@ print('Test: Images=%s, Labels=%s' % (test_images.shape, test_labels.shape))
 
 ## SOLUTION
 
-# load preferred model
-model_best = keras.models.load_model('fit_outputs/model_dropout.keras')
+# load preferred model: the dropout model version with the best validation accuracy
+model_best = load_registered_model('cifar_model_dropout', 'best')
 print('We are using', model_best.name)
 
+# with test-time augmentation, wrap the model so each batch of images becomes
+# one batch of tta_views times as many views, and the views are averaged
+if use_tta:
+    model_predict = create_model_tta(model_best, tta_views, reduction='mean')
+    print('Averaging', tta_views, 'views of every image')
+else:
+    model_predict = model_best
+
 # use preferred model to predict probability of each class on new test set
-predictions = model_best.predict(x=test_images)
+predictions = model_predict.predict(x=test_images, batch_size=predict_batch_size)
 
 print(predictions)
 
 #%%
 
 # convert probability predictions to table using class names for column names
+# the whole table is held in memory; for millions of images use
+# 05d_batch_predict_to_file.py, which streams it to Parquet batch by batch
 prediction_df = pd.DataFrame(data=predictions, columns=class_names)
 
 # inspect 
@@ -89,12 +114,9 @@ print(conf_matrix)
 
 #%%
 
-# Convert confustion matrix to a pandas dataframe
-confusion_df = pd.DataFrame(data=conf_matrix, index=class_names, columns=class_names)
-
-# Set the names of the x and y axis, this helps with the readability of the heatmap
-confusion_df.index.name = 'True Label'
-confusion_df.columns.name = 'Predicted Label'
+# save the confusion matrix for the reporting stage
+save_confusion_matrix(conf_matrix, class_names, model_best.name)
 
 # heatmap visualization of the confusion matrix
-sns.heatmap(data=confusion_df, annot=True, fmt='3g')
\ No newline at end of file
+# drawn by a background process (06d_render_reports.py) and saved to fit_outputs/figures
+launch_report_rendering()
\ No newline at end of file
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+# Step 9. Tune hyperparameters
+
+## Check that a long sweep keeps memory and build time flat
+
+Runs 50 short dropout trials three ways and records the memory (RSS) and build
+time of each trial:
+- 'keep history': the old loop, a new model every trial and every History kept
+- 'run_trial': a new model every trial, the session cleared and only metrics kept
+- 'reused model': one model reset between trials, traced functions reused
+The check at the end fails if memory keeps growing with the sweep lifecycle.
+
+"""
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+import numpy as np # for the memory trend
+import pandas as pd # handles dataframes
+import time # track run time
+from icwithcnn_memory import current_rss_bytes # process memory
+from icwithcnn_sweep import VariableRateDropout, run_trial, snapshot_state, run_reused_trial # sweep trial lifecycle
+
+#%%
+
+# start timer
+start = time.time()
+
+# number of trials in each sweep
+num_trials = 50
+
+# most memory growth in MB allowed from trial 10 to the last trial
+max_growth_mb = 50
+
+#%%
+
+# load a small part of the data, enough to exercise every step of a trial
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+train_images = train_images[:2000] / 255.0
+train_labels = keras.utils.to_categorical(train_labels[:2000], 10)
+val_images = test_images[:500] / 255.0
+val_labels = keras.utils.to_categorical(test_labels[:500], 10)
+
+fit_kwargs = dict(x = train_images, y = train_labels,
+                  batch_size = 64,
+                  epochs = 1,
+                  validation_data = (val_images, val_labels),
+                  verbose = 0)
+
+#%%
+
+# function to define and compile the dropout model with a given dropout rate
+
+def create_model_dropout_vary(dropout_rate, variable_rate=False):
+
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_vary = keras.Input(shape=train_images.shape[1:])
+    # Convolutional and pooling layers as in the dropout model
+    x_vary = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_vary)
+    x_vary = keras.layers.MaxPooling2D(pool_size=(2,2))(x_vary)
+    x_vary = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_vary)
+    x_vary = keras.layers.MaxPooling2D(pool_size=(2,2))(x_vary)
+    x_vary = keras.layers.Conv2D(filters=64, kernel_size=(3,3), activation='relu')(x_vary)
+    # Dropout layer, with the rate in a variable for the reused model
+    if variable_rate:
+        x_vary = VariableRateDropout(rate=dropout_rate, name='dropout_vary')(x_vary)
+    else:
+        x_vary = keras.layers.Dropout(rate=dropout_rate)(x_vary)
+    # Flatten layer and output layer
+    x_vary = keras.layers.Flatten()(x_vary)
+    outputs_vary = keras.layers.Dense(units=10, activation='softmax')(x_vary)
+
+    model_vary = keras.Model(inputs = inputs_vary,
+                             outputs = outputs_vary,
+                             name ="cifar_model_dropout_vary")
+
+    model_vary.compile(optimizer = keras.optimizers.Adam(),
+                       loss = keras.losses.CategoricalCrossentropy(),
+                       metrics = keras.metrics.CategoricalAccuracy())
+
+    return model_vary
+
+#%%
+
+# dropout rates cycled through by the trials
+dropout_rates = [0.15, 0.3, 0.45, 0.6, 0.75]
+
+# create empty list to hold one row per trial
+results = []
+
+#%%
+
+### Sweep lifecycle: new model per trial, session cleared, only metrics kept
+
+for trial_number in range(num_trials):
+    dropout_rate = dropout_rates[trial_number % len(dropout_rates)]
+    trial = run_trial(lambda: create_model_dropout_vary(dropout_rate), fit_kwargs, (val_images, val_labels))
+    results.append({'lifecycle': 'run_trial', 'trial': trial_number,
+                    'rss_mb': trial['rss_mb'], 'build_seconds': trial['build_seconds'], 'fit_seconds': trial['fit_seconds']})
+
+#%%
+
+### Sweep lifecycle: one model reset between trials
+
+model_vary = create_model_dropout_vary(dropout_rates[0], variable_rate=True)
+initial_state = snapshot_state(model_vary)
+
+for trial_number in range(num_trials):
+    dropout_rate = dropout_rates[trial_number % len(dropout_rates)]
+    trial = run_reused_trial(model_vary, initial_state,
+                             lambda model: model.get_layer('dropout_vary').rate.assign(dropout_rate),
+                             fit_kwargs, (val_images, val_labels))
+    results.append({'lifecycle': 'reused model', 'trial': trial_number,
+                    'rss_mb': trial['rss_mb'], 'build_seconds': trial['build_seconds'], 'fit_seconds': trial['fit_seconds']})
+
+del model_vary
+keras.backend.clear_session()
+
+#%%
+
+### The old loop: new model per trial and every History kept
+
+history_data = {}
+
+for trial_number in range(num_trials):
+    dropout_rate = dropout_rates[trial_number % len(dropout_rates)]
+
+    build_start = time.perf_counter()
+    model = create_model_dropout_vary(dropout_rate)
+    build_seconds = time.perf_counter() - build_start
+
+    fit_start = time.perf_counter()
+    history_data[trial_number] = model.fit(**fit_kwargs)
+    fit_seconds = time.perf_counter() - fit_start
+
+    results.append({'lifecycle': 'keep history', 'trial': trial_number,
+                    'rss_mb': current_rss_bytes() / 1024**2, 'build_seconds': build_seconds, 'fit_seconds': fit_seconds})
+
+#%%
+
+### Compare memory and build time from the start to the end of each sweep
+
+results_df = pd.DataFrame(results)
+
+summary = []
+for lifecycle, trials in results_df.groupby('lifecycle', sort=False):
+    # leave out the first 10 trials, which include one-off start up costs
+    settled = trials[trials['trial'] >= 10]
+    summary.append({'lifecycle': lifecycle,
+                    'rss_growth_mb': settled['rss_mb'].iloc[-1] - settled['rss_mb'].iloc[0],
+                    'rss_mb_per_trial': np.polyfit(settled['trial'], settled['rss_mb'], 1)[0],
+                    'first_build_seconds': settled['build_seconds'].iloc[0],
+                    'last_build_seconds': settled['build_seconds'].iloc[-1],
+                    'mean_fit_seconds': settled['fit_seconds'].mean()})
+
+summary_df = pd.DataFrame(summary).set_index('lifecycle')
+print(summary_df.round(3).to_string())
+
+#%%
+
+# the check: with the sweep lifecycle memory must stay flat
+for lifecycle in ['run_trial', 'reused model']:
+    growth = summary_df.loc[lifecycle, 'rss_growth_mb']
+    assert growth < max_growth_mb, lifecycle + ' grew by ' + str(round(growth)) + ' MB over the sweep'
+print('Memory stayed flat over', num_trials, 'trials')
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -17,6 +17,10 @@ from tensorflow import keras # data and neural network
 from sklearn.model_selection import train_test_split # data splitting
 import matplotlib.pyplot as plt # plotting
 import time # track run time
+from icwithcnn_run_callback import RunStoreCallback # saved run history
+from icwithcnn_sweep import run_trial # sweep trial lifecycle
+from icwithcnn_memory import MemoryTracker # stage memory tracking
+from icwithcnn_subset import apply_subset # fast-dev training subset
 
 #%%
 
@@ -52,6 +56,10 @@ class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', '
 # prepare the dataset for training
 train_images, val_images, train_labels, val_labels = prepare_dataset(train_images, train_labels)
 
+# a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+# chosen from the training split only, so the validation set is the same as for a full-data run
+train_images, train_labels = apply_subset(train_images, train_labels)
+
 #%%
 
 ### Step 9. Tune hyperparameters
@@ -103,26 +111,39 @@ activations = ['relu', 'sigmoid', 'tanh', 'selu', keras.layers.LeakyReLU()]
 # create a dictionary object to store the training history
 history_data = {} # dictionary
 
+# record the memory of every trial; with the CNN_MEMORY_BUDGET_MB environment
+# variable set, stop with an error naming the trial when the budget is exceeded
+memory_tracker = MemoryTracker()
+
 # train the model with each activation function and store the history
+# each activation needs a new model, so every trial clears the Keras session
+# first and only its metrics are kept, not the History object and its model
 for activation in activations:
     
-    # create the model
-    model = create_model_act(activation)
-    
-    # fit the model
-    history = model.fit(x = train_images, y = train_labels,
-                        batch_size = 32,
-                        epochs = 10, 
-                        validation_data = (val_images, val_labels))
+    # create the model and fit it, saving each epoch to the run store (fit_outputs/runs.sqlite)
+    with memory_tracker.stage('activation ' + str(activation)):
+        trial = run_trial(lambda: create_model_act(activation),
+                          fit_kwargs = dict(x = train_images, y = train_labels,
+                                            batch_size = 32,
+                                            epochs = 10, 
+                                            validation_data = (val_images, val_labels),
+                                            callbacks = [RunStoreCallback(settings = {'activation': str(activation)},
+                                                                          script = '05_step_9_tune_activation.py'),
+                                                         memory_tracker.callback()]),
+                          evaluate_data = (val_images, val_labels))
     
     # add training history to dictionary
-    history_data[str(activation)] = history
+    history_data[str(activation)] = trial['history']
+
+# peak memory of each trial and its epochs
+memory_tracker.print_table()
+memory_tracker.stop()
 
 # plot the validation accuracy for each activation function
 plt.figure(figsize=(12, 6))
 
 for activation, history in history_data.items():
-    plt.plot(history.history['val_categorical_accuracy'], label=activation)
+    plt.plot(history['val_categorical_accuracy'], label=activation)
 
 plt.title('Validation accuracy for different activation functions')
 plt.xlabel('Epochs')
@@ -18,6 +18,10 @@ from sklearn.model_selection import train_test_split # data splitting
 import seaborn as sns # specialised plotting
 import pandas as pd # handles dataframes
 import time # track run time
+from icwithcnn_run_callback import RunStoreCallback # saved run history
+from icwithcnn_sweep import run_trial # sweep trial lifecycle
+from icwithcnn_subset import apply_subset # fast-dev training subset
+from icwithcnn_memory import MemoryTracker # stage memory tracking
 
 #%%
 
@@ -53,6 +57,10 @@ class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', '
 # prepare the dataset for training
 train_images, val_images, train_labels, val_labels = prepare_dataset(train_images, train_labels)
 
+# a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+# chosen from the training split only, so the validation set is the same as for a full-data run
+train_images, train_labels = apply_subset(train_images, train_labels)
+
 # prepare test dataset
 # normalize the RGB values to be between 0 and 1
 test_images = test_images / 255.0
@@ -106,28 +114,49 @@ dropout_rates = [0.15, 0.3, 0.45, 0.6, 0.75]
 # create empty list to hold losses
 val_losses_vary = [] 
 
-# use for loop to explore varying the dropout rate
-for dropout_rate in dropout_rates:
-    
+# record the memory of every trial; with the CNN_MEMORY_BUDGET_MB environment
+# variable set, stop with an error naming the trial when the budget is exceeded
+memory_tracker = MemoryTracker()
+
+# function to create and compile the model for one dropout rate
+
+def create_compiled_model_vary(dropout_rate):
+
     # create the model
     model_vary = create_model_dropout_vary(dropout_rate)
-    
+
     # compile the model
     model_vary.compile(optimizer = keras.optimizers.Adam(),
                       loss = keras.losses.CategoricalCrossentropy(),
                       metrics = keras.metrics.CategoricalAccuracy())
 
-    # fit the model
-    model_vary.fit(x = train_images, y = train_labels,
-                   batch_size = 32,
-                   epochs = 10,
-                   validation_data = (val_images, val_labels))
+    return model_vary
+
+# use for loop to explore varying the dropout rate
+# each rate needs a new model, so every trial clears the Keras session first
+# and only its metrics are kept, not the History object and its model
+# (05_step_9_tune_dropout_reused.py reuses one model for every rate instead)
+for dropout_rate in dropout_rates:
+
+    # fit the model, saving each epoch to the run store (fit_outputs/runs.sqlite)
+    # and evaluate it on the validation set
+    with memory_tracker.stage('dropout rate ' + str(dropout_rate)):
+        trial = run_trial(lambda: create_compiled_model_vary(dropout_rate),
+                          fit_kwargs = dict(x = train_images, y = train_labels,
+                                            batch_size = 32,
+                                            epochs = 10,
+                                            validation_data = (val_images, val_labels),
+                                            callbacks = [RunStoreCallback(settings = {'dropout_rate': dropout_rate},
+                                                                          script = '05_step_9_tune_dropout.py'),
+                                                         memory_tracker.callback()]),
+                          evaluate_data = (val_images, val_labels))
 
-    # evaluate the model on the test data set
-    val_loss_vary, val_acc_vary = model_vary.evaluate(val_images, val_labels)
-    
     # save the evaulation metrics
-    val_losses_vary.append(val_loss_vary)
+    val_losses_vary.append(trial['val_loss'])
+
+# peak memory of each trial and its epochs
+memory_tracker.print_table()
+memory_tracker.stop()
 
 # convert rates and metrics to dataframe for plotting
 loss_df = pd.DataFrame({'dropout_rate': dropout_rates, 'val_loss_vary': val_losses_vary})
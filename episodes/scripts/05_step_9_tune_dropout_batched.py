@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+# Step 9. Tune hyperparameters
+
+## Tune Dropout Rate by training every rate in one model
+
+The five dropout models share the data, the batch order and the architecture
+and only differ in the rate. Instead of five fits, one model holds a copy of
+the architecture for every rate and a single fit trains them all. Each rate
+gets its own history, in the same form as a separate fit, and the time of the
+whole sweep is compared with fitting the rates one after another.
+
+"""
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from sklearn.model_selection import train_test_split # data splitting
+import pandas as pd # handles dataframes
+import time # track run time
+from icwithcnn_model_batching import create_model_batched, compile_batched, batched_labels, split_history # model-batched training
+from icwithcnn_run_store import open_run_store, start_run, add_epoch, finish_run # saved run history
+from icwithcnn_sweep import run_trial # sweep trial lifecycle
+from icwithcnn_subset import apply_subset # fast-dev training subset
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+# function to prepare the training dataset
+
+def prepare_dataset(train_images, train_labels):
+
+    # normalize the RGB values to be between 0 and 1
+    train_images = train_images / 255.0
+
+    # one hot encode the training labels
+    train_labels = keras.utils.to_categorical(train_labels, len(class_names))
+
+    # split the training data into training and validation set
+    train_images, val_images, train_labels, val_labels = train_test_split(
+    train_images, train_labels, test_size = 0.2, random_state=42)
+
+    return train_images, val_images, train_labels, val_labels
+
+#%%
+
+# load the data
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# prepare the dataset for training
+train_images, val_images, train_labels, val_labels = prepare_dataset(train_images, train_labels)
+
+# a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+# chosen from the training split only, so the validation set is the same as for a full-data run
+train_images, train_labels = apply_subset(train_images, train_labels)
+
+#%%
+
+# define new dropout function that accepts a dropout rate and a model name
+
+def create_model_dropout_vary(dropout_rate, name="cifar_model_dropout_vary"):
+
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_vary = keras.Input(shape=train_images.shape[1:])
+
+    # CNN Part 2
+    # Convolutional layer with 16 filters, 3x3 kernel size, and ReLU activation
+    x_vary = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_vary)
+    # Pooling layer with input window sized 2x2
+    x_vary = keras.layers.MaxPooling2D(pool_size=(2,2))(x_vary)
+    # Second Convolutional layer with 32 filters, 3x3 kernel size, and ReLU activation
+    x_vary = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_vary)
+    # Second Pooling layer with input window sized 2x2
+    x_vary = keras.layers.MaxPooling2D(pool_size=(2,2))(x_vary)
+    # Third Convolutional layer with 64 filters, 3x3 kernel size, and ReLU activation
+    x_vary = keras.layers.Conv2D(filters=64, kernel_size=(3,3), activation='relu')(x_vary)
+    # Dropout layer randomly drops x% of the input units
+    x_vary = keras.layers.Dropout(rate=dropout_rate)(x_vary)
+    # Flatten layer to convert 2D feature maps into a 1D vector
+    x_vary = keras.layers.Flatten()(x_vary)
+
+    # CNN Part 3
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_vary = keras.layers.Dense(units=10, activation='softmax')(x_vary)
+
+    model_vary = keras.Model(inputs = inputs_vary,
+                             outputs = outputs_vary,
+                             name = name)
+
+    return model_vary
+
+#%%
+
+# specify range of dropout rates
+dropout_rates = [0.15, 0.3, 0.45, 0.6, 0.75]
+
+# settings shared by both ways of running the sweep
+batch_size = 32
+epochs = 10
+
+#%%
+
+### Sequential sweep: one fit per dropout rate
+
+# function to create and compile the model for one rate
+
+def create_compiled_model(dropout_rate):
+
+    model_vary = create_model_dropout_vary(dropout_rate)
+    model_vary.compile(optimizer = keras.optimizers.Adam(),
+                       loss = keras.losses.CategoricalCrossentropy(),
+                       metrics = keras.metrics.CategoricalAccuracy())
+
+    return model_vary
+
+sequential_start = time.time()
+sequential_histories = {}
+for dropout_rate in dropout_rates:
+    trial = run_trial(lambda: create_compiled_model(dropout_rate),
+                      fit_kwargs = dict(x = train_images, y = train_labels,
+                                        batch_size = batch_size,
+                                        epochs = epochs,
+                                        validation_data = (val_images, val_labels)),
+                      evaluate_data = (val_images, val_labels))
+    sequential_histories[dropout_rate] = trial['history']
+sequential_seconds = time.time() - sequential_start
+
+keras.backend.clear_session()
+
+#%%
+
+### Model-batched sweep: every dropout rate in one model and one fit
+
+batched_start = time.time()
+
+# one copy of the architecture per dropout rate, with a shared input
+model_batched, variant_names = create_model_batched(create_model_dropout_vary, dropout_rates,
+                                                    prefix = 'dropout', input_shape = train_images.shape[1:])
+compile_batched(model_batched, variant_names)
+
+# every variant learns from the same labels, given once per output
+history_batched = model_batched.fit(x = train_images, y = batched_labels(train_labels, variant_names),
+                                    batch_size = batch_size,
+                                    epochs = epochs,
+                                    validation_data = (val_images, batched_labels(val_labels, variant_names)))
+
+batched_seconds = time.time() - batched_start
+
+# one history per dropout rate, with the keys of a separate fit
+batched_histories = dict(zip(dropout_rates, split_history(history_batched, variant_names).values()))
+
+#%%
+
+# save each rate's epochs to the run store (fit_outputs/runs.sqlite) as a run of its own
+connection = open_run_store()
+for dropout_rate, history in batched_histories.items():
+    run_id = start_run(connection, 'cifar_model_dropout_vary', {'dropout_rate': dropout_rate, 'training': 'model_batched'},
+                       script = '05_step_9_tune_dropout_batched.py')
+    for epoch in range(epochs):
+        add_epoch(connection, run_id, epoch, {metric: values[epoch] for metric, values in history.items()})
+    finish_run(connection, run_id)
+connection.close()
+
+#%%
+
+### Compare the two sweeps
+
+comparison_df = pd.DataFrame({'dropout_rate': dropout_rates,
+                              'sequential_val_loss': [sequential_histories[rate]['val_loss'][-1] for rate in dropout_rates],
+                              'batched_val_loss': [batched_histories[rate]['val_loss'][-1] for rate in dropout_rates],
+                              'sequential_val_acc': [sequential_histories[rate]['val_categorical_accuracy'][-1] for rate in dropout_rates],
+                              'batched_val_acc': [batched_histories[rate]['val_categorical_accuracy'][-1] for rate in dropout_rates]})
+print(comparison_df.round(4).to_string(index=False))
+
+print('Sequential sweep:', round(sequential_seconds, 1), 'seconds')
+print('Model-batched sweep:', round(batched_seconds, 1), 'seconds')
+print('Speed up:', round(sequential_seconds / batched_seconds, 2))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+# Step 9. Tune hyperparameters
+
+## Tune Dropout Rate with parallel workers writing to the run store
+
+Each worker process trains one dropout rate and writes its per-epoch metrics to
+fit_outputs/runs.sqlite. The sweep is compared afterwards by querying the store,
+so nothing has to be kept in memory or passed back from the workers.
+
+"""
+#%%
+
+# load the required packages
+
+from concurrent.futures import ProcessPoolExecutor # parallel sweep workers
+import multiprocessing # start method for the workers
+import os # thread budget per worker
+import time # track run time
+from icwithcnn_run_store import best_by_setting, list_runs, load_history_df # saved run history
+
+#%%
+
+# function to train one dropout rate in a worker process
+# the data is loaded inside the worker so only the dropout rate is sent to it
+
+def train_dropout_rate(dropout_rate, threads_per_worker):
+
+    from tensorflow import keras # data and neural network
+    import tensorflow as tf # thread settings
+    from sklearn.model_selection import train_test_split # data splitting
+    from icwithcnn_subset import apply_subset # fast-dev training subset
+    from icwithcnn_run_callback import RunStoreCallback # saved run history
+
+    # share the cores between the workers instead of every worker using all of them
+    tf.config.threading.set_intra_op_parallelism_threads(threads_per_worker)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    # load the data
+    (train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+    # normalize the RGB values to be between 0 and 1
+    train_images = train_images / 255.0
+
+    # one hot encode the training labels
+    train_labels = keras.utils.to_categorical(train_labels, 10)
+
+    # split the training data into training and validation set
+    train_images, val_images, train_labels, val_labels = train_test_split(
+    train_images, train_labels, test_size = 0.2, random_state=42)
+
+    # a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+    # chosen from the training split only, so the validation set is the same as for a full-data run
+    train_images, train_labels = apply_subset(train_images, train_labels)
+
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_vary = keras.Input(shape=train_images.shape[1:])
+    # Convolutional layer with 16 filters, 3x3 kernel size, and ReLU activation
+    x_vary = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_vary)
+    # Pooling layer with input window sized 2x2
+    x_vary = keras.layers.MaxPooling2D(pool_size=(2,2))(x_vary)
+    # Second Convolutional layer with 32 filters, 3x3 kernel size, and ReLU activation
+    x_vary = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_vary)
+    # Second Pooling layer with input window sized 2x2
+    x_vary = keras.layers.MaxPooling2D(pool_size=(2,2))(x_vary)
+    # Third Convolutional layer with 64 filters, 3x3 kernel size, and ReLU activation
+    x_vary = keras.layers.Conv2D(filters=64, kernel_size=(3,3), activation='relu')(x_vary)
+    # Dropout layer randomly drops x% of the input units
+    x_vary = keras.layers.Dropout(rate=dropout_rate)(x_vary)
+    # Flatten layer to convert 2D feature maps into a 1D vector
+    x_vary = keras.layers.Flatten()(x_vary)
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_vary = keras.layers.Dense(units=10, activation='softmax')(x_vary)
+
+    model_vary = keras.Model(inputs = inputs_vary,
+                             outputs = outputs_vary,
+                             name ="cifar_model_dropout_vary")
+
+    # compile the model
+    model_vary.compile(optimizer = keras.optimizers.Adam(),
+                       loss = keras.losses.CategoricalCrossentropy(),
+                       metrics = keras.metrics.CategoricalAccuracy())
+
+    # fit the model, saving each epoch to the run store
+    run_store = RunStoreCallback(settings = {'dropout_rate': dropout_rate},
+                                 script = '05_step_9_tune_dropout_parallel.py')
+    model_vary.fit(x = train_images, y = train_labels,
+                   batch_size = 32,
+                   epochs = 10,
+                   validation_data = (val_images, val_labels),
+                   callbacks = [run_store],
+                   verbose = 0)
+
+    return run_store.run_id
+
+#%%
+
+if __name__ == '__main__':
+
+    # start timer
+    start = time.time()
+
+    # specify range of dropout rates
+    dropout_rates = [0.15, 0.3, 0.45, 0.6, 0.75]
+
+    # number of worker processes and the threads each may use
+    num_workers = 3
+    threads_per_worker = max(1, os.cpu_count() // num_workers)
+
+    # spawn fresh processes so each worker starts its own TensorFlow runtime
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        run_ids = list(executor.map(train_dropout_rate, dropout_rates, [threads_per_worker] * len(dropout_rates)))
+
+    print('Finished runs:', run_ids)
+
+    #%%
+
+    # query the store for the best val_loss of each dropout rate, over every run so far
+    loss_df = best_by_setting('dropout_rate', 'val_loss', model_name='cifar_model_dropout_vary')
+    print(loss_df)
+
+    # list the runs of this sweep
+    print(list_runs(model_name='cifar_model_dropout_vary').tail(len(dropout_rates)))
+
+    #%%
+
+    # plotting is only imported once the sweep has finished
+    import seaborn as sns # specialised plotting
+    import matplotlib.pyplot as plt # plotting
+
+    # plot the best validation loss for each dropout rate
+    sns.lineplot(data=loss_df, x='dropout_rate', y='val_loss')
+    plt.show()
+
+    # the full history of any run can be read back lazily for the usual plots
+    history_df = load_history_df(run_ids[0])
+    sns.lineplot(data=history_df[['loss', 'val_loss']])
+    plt.show()
+
+    #%%
+
+    end = time.time()
+
+    print()
+    print()
+    print("Time taken to run program was:", end - start, "seconds")
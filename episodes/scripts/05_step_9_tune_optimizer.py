@@ -18,6 +18,7 @@ from sklearn.model_selection import train_test_split # data splitting
 import time # track run time
 from scikeras.wrappers import KerasClassifier # wrapper class for GridSearchCV
 from sklearn.model_selection import GridSearchCV # tune hyperparameters
+from icwithcnn_subset import apply_subset # fast-dev training subset
 
 #%%
 
@@ -93,6 +94,10 @@ class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', '
 # prepare the dataset for training
 train_images, val_images, train_labels, val_labels = prepare_dataset(train_images, train_labels)
 
+# a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+# chosen from the training split only, so the validation set is the same as for a full-data run
+train_images, train_labels = apply_subset(train_images, train_labels)
+
 #%%
 
 ### Step 9. Tune hyperparameters
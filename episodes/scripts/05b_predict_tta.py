@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+## Test-time augmentation (TTA) in a single forward pass
+
+Each test image is shown to the model several times (flipped and shifted) and
+the predictions are averaged or voted on. All views of a batch are stacked into
+one larger batch inside the model, so predict runs the network once per batch
+instead of once per view. The layers are in icwithcnn_tta.py, so
+05_predict_ep_best_model.py can switch the same path on with use_tta.
+
+"""
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+import pandas as pd # handles dataframes
+import numpy as np # for argmax
+from sklearn.metrics import accuracy_score
+import time # track run time
+from icwithcnn_registry import load_registered_model # versioned models
+from icwithcnn_tta import create_model_tta # test-time augmentation
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+#### Prepare test dataset
+
+# load the CIFAR-10 dataset included with the keras library
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# normalize the RGB values to be between 0 and 1
+test_images = test_images / 255.0
+
+#%%
+
+# load preferred model: the dropout model version with the best validation accuracy
+model_best = load_registered_model('cifar_model_dropout', 'best')
+print('We are using', model_best.name)
+
+#%%
+
+### Compare accuracy gain against throughput for each number of views
+
+# batch size of original images; each batch holds num_views times as many views
+batch_size = 32
+
+# create empty list to hold the results
+results = []
+
+for reduction in ['mean', 'vote']:
+    for num_views in [1, 2, 4, 8]:
+
+        # plain prediction for a single view, otherwise wrap the model
+        if num_views == 1:
+            model_tta = model_best
+        else:
+            model_tta = create_model_tta(model_best, num_views, reduction)
+
+        # predict and time it
+        predict_start = time.time()
+        predictions = model_tta.predict(x=test_images, batch_size=batch_size, verbose=0)
+        predict_seconds = time.time() - predict_start
+
+        # convert probability predictions to class labels
+        predicted_labels = np.argmax(a=predictions, axis=1)
+
+        results.append({'reduction': reduction,
+                        'num_views': num_views,
+                        'accuracy': accuracy_score(y_true=test_labels, y_pred=predicted_labels),
+                        'images_per_sec': test_images.shape[0] / predict_seconds})
+
+# compare each setting with plain prediction
+results_df = pd.DataFrame(results)
+baseline = results_df[results_df['num_views'] == 1].iloc[0]
+results_df['accuracy_gain'] = results_df['accuracy'] - baseline['accuracy']
+results_df['relative_cost'] = baseline['images_per_sec'] / results_df['images_per_sec']
+print(results_df.round(4).to_string(index=False))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
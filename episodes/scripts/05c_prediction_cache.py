@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+## Cache predictions for repeated images
+
+"""
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+import numpy as np # for argmax
+import pandas as pd # handles dataframes
+import time # track run time
+from sklearn.metrics import accuracy_score
+from icwithcnn_prediction_cache import PredictionCache # cached predictions
+from icwithcnn_registry import load_registered_model # versioned models
+from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+#### Prepare test dataset
+
+# load the CIFAR-10 dataset included with the keras library
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# simulate traffic with many duplicate uploads: 20,000 requests drawn from 2,000 test images
+# the images stay uint8, the cache normalises the ones it has to predict
+rng = np.random.default_rng(42)
+request_ids = rng.integers(0, 2000, size=20000)
+request_images = test_images[request_ids]
+request_labels = test_labels[request_ids]
+
+#%%
+
+# load preferred model: the dropout model version with the best validation accuracy
+model_best = load_registered_model('cifar_model_dropout', 'best')
+print('We are using', model_best.name)
+
+#%%
+
+### Predict without a cache
+
+uncached_start = time.time()
+uncached_predictions = model_best.predict(x=model_input(model_best, request_images), verbose=0)
+uncached_seconds = time.time() - uncached_start
+
+#%%
+
+### Predict through the cache, 500 requests at a time
+
+cache = PredictionCache(model_best, memory_budget_bytes=16 * 1024**2, disk_folder='fit_outputs/prediction_cache')
+
+cached_start = time.time()
+cached_predictions = np.concatenate([cache.predict(request_images[batch_start:batch_start + 500])
+                                     for batch_start in range(0, request_images.shape[0], 500)])
+cached_seconds = time.time() - cached_start
+
+#%%
+
+# the cache must give the same answers as the model
+print('Same predicted labels:', (np.argmax(cached_predictions, axis=1) == np.argmax(uncached_predictions, axis=1)).all())
+print('Accuracy:', round(accuracy_score(y_true=request_labels, y_pred=np.argmax(cached_predictions, axis=1)), 2))
+
+# compare run times and show the cache counters
+print(pd.DataFrame([{'uncached_seconds': uncached_seconds, 'cached_seconds': cached_seconds}]).round(2))
+print(pd.Series(cache.stats()))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
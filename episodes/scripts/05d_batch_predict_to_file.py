@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+## Stream batch predictions to a Parquet (or CSV) file
+
+Instead of building one DataFrame with a row for every test image, each batch
+of predictions is written to the output file as soon as it is ready, as one
+Parquet row group (CSV is used if pyarrow is not installed). Memory use stays
+the same however many images there are, and a stopped job carries on from the
+input offset of the last part file it finished. A run with another model,
+other images or other settings starts again instead of reusing the old parts.
+
+"""
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+import numpy as np # for argmax
+import glob # find part files
+import hashlib # job fingerprint
+import json # progress file
+import os # file paths
+import time # track run time
+from icwithcnn_registry import load_registered_model # versioned models
+from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+# Parquet output needs pyarrow, otherwise fall back to CSV
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+### Output writers
+
+# writes each batch of rows to one Parquet file as a row group
+
+class ParquetPredictionWriter:
+
+    def __init__(self, path):
+        self.path = path + '.parquet'
+        self.writer = None
+
+    def write(self, columns):
+        table = pa.table(columns)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+# writes each batch of rows to one CSV file, used when pyarrow is not installed
+
+class CSVPredictionWriter:
+
+    def __init__(self, path):
+        self.path = path + '.csv'
+        self.file = open(self.path, 'w', newline='')
+        self.write_header = True
+
+    def write(self, columns):
+        import pandas as pd # handles dataframes
+        pd.DataFrame(columns).to_csv(self.file, header=self.write_header, index=False)
+        self.write_header = False
+
+    def close(self):
+        self.file.close()
+
+#%%
+
+# function to describe a job, so a rerun only carries on from saved progress
+# when the model, the images and the output settings are all the same
+# the model is fingerprinted by its weights and the images by their shape and
+# a sample of rows, so the key is quick to work out for millions of images
+
+def job_key(model, images, class_names, top_k, rows_per_part):
+
+    model_digest = hashlib.sha256()
+    for weights in model.get_weights():
+        model_digest.update(np.ascontiguousarray(weights).tobytes())
+
+    images_digest = hashlib.sha256()
+    images_digest.update(str((np.shape(images), str(np.asarray(images[:1]).dtype))).encode())
+    images_digest.update(np.ascontiguousarray(images[::max(1, len(images) // 256)]).tobytes())
+
+    return {'model': model.name,
+            'model_sha256': model_digest.hexdigest(),
+            'num_images': len(images),
+            'images_sha256': images_digest.hexdigest(),
+            'class_names': list(class_names),
+            'top_k': top_k,
+            'rows_per_part': rows_per_part,
+            'format': 'parquet' if pa is not None else 'csv'}
+
+#%%
+
+# functions to read and save how far a job has got
+# the output is split into part files, and the offset is only saved once a part
+# file is closed, so after a crash the unfinished part is written again from
+# the start and no row is ever lost or written twice
+# progress saved for another job (a different key) is thrown away with its part files
+
+def progress_path(output_path):
+
+    return output_path + '.progress.json'
+
+def read_progress(output_path, key):
+
+    if os.path.exists(progress_path(output_path)):
+        with open(progress_path(output_path)) as progress_file:
+            progress = json.load(progress_file)
+        if progress.get('key') == key:
+            return progress
+        print('Saved progress is for another model, input or settings, starting again:', output_path)
+
+    # no part file of an earlier job may be left to mix with the new ones
+    for part_path in glob.glob(glob.escape(output_path) + '.part*'):
+        os.remove(part_path)
+
+    return {'offset': 0, 'parts': 0, 'key': key}
+
+def save_progress(output_path, progress):
+
+    temp_path = progress_path(output_path) + '.tmp'
+    with open(temp_path, 'w') as progress_file:
+        json.dump(progress, progress_file)
+    os.replace(temp_path, progress_path(output_path))
+
+#%%
+
+# function to get the columns of one batch of predictions
+# each row has the input offset, the predicted label, the top k classes and
+# probabilities, and the probability of every class
+
+def prediction_columns(predictions, batch_start, class_names, top_k):
+
+    class_array = np.array(class_names)
+
+    # classes sorted from most to least likely, keeping the top k
+    top_classes = np.argsort(-predictions, axis=1)[:, :top_k]
+    top_probabilities = np.take_along_axis(predictions, top_classes, axis=1)
+
+    columns = {'offset': np.arange(batch_start, batch_start + predictions.shape[0]),
+               'predicted_label': class_array[top_classes[:, 0]]}
+    for rank in range(top_k):
+        columns['top%d_class' % (rank + 1)] = class_array[top_classes[:, rank]]
+        columns['top%d_probability' % (rank + 1)] = top_probabilities[:, rank]
+    for class_number, class_name in enumerate(class_names):
+        columns[class_name] = predictions[:, class_number]
+
+    return columns
+
+#%%
+
+# function to predict images in batches and stream the results to part files
+# images can be any array-like, including a np.memmap over millions of uint8
+# images; models that take uint8 get the pixels as they are, other models get
+# them normalised one batch at a time
+# only one batch of images and predictions is held in memory at once
+
+def batch_predict_to_file(model, images, class_names, output_path, batch_size=4096, batches_per_part=16, top_k=3):
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+    rows_per_part = batch_size * batches_per_part
+
+    # carry on from the last part file finished by an earlier run of the same job
+    progress = read_progress(output_path, job_key(model, images, class_names, top_k, rows_per_part))
+    if progress['offset'] >= len(images):
+        print('Already finished:', output_path)
+        return progress
+    if progress['offset'] > 0:
+        print('Resuming', output_path, 'from offset', progress['offset'])
+
+    while progress['offset'] < len(images):
+        part_start = progress['offset']
+        part_end = min(part_start + rows_per_part, len(images))
+        part_path = output_path + '.part%05d' % progress['parts']
+
+        if pa is not None:
+            writer = ParquetPredictionWriter(part_path)
+        else:
+            writer = CSVPredictionWriter(part_path)
+
+        try:
+            for batch_start in range(part_start, part_end, batch_size):
+                batch_end = min(batch_start + batch_size, part_end)
+                batch_images = model_input(model, images[batch_start:batch_end])
+                predictions = np.asarray(model.predict_on_batch(batch_images))
+                writer.write(prediction_columns(predictions, batch_start, class_names, top_k))
+        finally:
+            writer.close()
+
+        # the part file is complete, record it
+        progress = {'offset': part_end, 'parts': progress['parts'] + 1, 'key': progress['key']}
+        save_progress(output_path, progress)
+
+    return progress
+
+#%%
+
+#### Prepare test dataset
+
+# load the CIFAR-10 dataset included with the keras library
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# keep the test images as uint8 in a memmap, the way a nightly job would read
+# millions of images without loading them all into memory
+test_images_memmap = np.lib.format.open_memmap('fit_outputs/test_images_uint8.npy', mode='w+',
+                                               dtype=np.uint8, shape=test_images.shape)
+test_images_memmap[:] = test_images
+test_images_memmap.flush()
+test_images_memmap = np.load('fit_outputs/test_images_uint8.npy', mmap_mode='r')
+
+#%%
+
+# load preferred model: the dropout model version with the best validation accuracy
+# the uint8 copy rescales inside the model, so no float copy of a batch is made
+model_best = load_registered_model('cifar_model_dropout_uint8', 'best')
+print('We are using', model_best.name)
+
+#%%
+
+### Stream the predictions
+
+predict_start = time.time()
+progress = batch_predict_to_file(model_best, test_images_memmap, class_names, 'fit_outputs/predictions/test_predictions')
+print('Wrote', progress['offset'], 'rows in', round(time.time() - predict_start, 2), 'seconds')
+
+#%%
+
+# read back only the columns needed to check the accuracy
+if pa is not None:
+    predicted = pq.ParquetDataset(sorted(glob.glob('fit_outputs/predictions/test_predictions.part*.parquet'))).read(columns=['offset', 'predicted_label'])
+    predicted_labels = np.array(predicted.column('predicted_label').to_pylist())
+    offsets = np.array(predicted.column('offset').to_pylist())
+else:
+    import pandas as pd # handles dataframes
+    predicted = pd.concat([pd.read_csv(path, usecols=['offset', 'predicted_label'])
+                           for path in sorted(glob.glob('fit_outputs/predictions/test_predictions.part*.csv'))])
+    predicted_labels = predicted['predicted_label'].to_numpy()
+    offsets = predicted['offset'].to_numpy()
+
+true_labels = np.array(class_names)[test_labels[offsets, 0]]
+print('Accuracy:', round(np.mean(predicted_labels == true_labels), 2))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
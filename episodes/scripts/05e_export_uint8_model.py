@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+## Export a model that takes uint8 images
+
+Adds Rescaling (and optionally Resizing) layers in front of a registered model
+and registers the result as <name>_uint8. The exported model takes the raw
+CIFAR-10 pixels, shape (N, 32, 32, 3) and dtype uint8, so callers skip the
+`test_images / 255.0` float64 copy. The predictions are checked against the
+original model and both ways of predicting are timed.
+
+"""
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+import numpy as np # for argmax
+import pandas as pd # handles dataframes
+import time # track run time
+from icwithcnn_registry import load_registered_model, register_model, resolve_model # versioned models
+from icwithcnn_uint8_input import create_model_uint8 # in-graph rescaling
+
+#%%
+
+# start timer
+start = time.time()
+
+# registered model to export
+model_name = 'cifar_model_dropout'
+
+#%%
+
+#### Prepare test dataset
+
+# load the CIFAR-10 dataset included with the keras library
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+#%%
+
+### Export
+
+# the model version with the best validation accuracy, which expects normalised float images
+metadata = resolve_model(model_name, 'best')
+model_float = load_registered_model(model_name, 'best')
+
+# the same model behind a uint8 input and a Rescaling layer
+model_uint8 = create_model_uint8(model_float)
+model_uint8.summary()
+
+register_model(model_uint8, val_accuracy = metadata['val_accuracy'],
+               notes = 'uint8 input, rescaled inside the model; exported from version ' + str(metadata['version']))
+
+#%%
+
+### Compare with normalising on the host
+
+# usual way: make a float64 copy of the images, then predict
+float_start = time.time()
+test_images_norm = test_images / 255.0
+predictions_float = model_float.predict(x=test_images_norm, batch_size=256, verbose=0)
+float_seconds = time.time() - float_start
+
+# uint8 model: pass the pixels as they are
+uint8_start = time.time()
+predictions_uint8 = model_uint8.predict(x=test_images, batch_size=256, verbose=0)
+uint8_seconds = time.time() - uint8_start
+
+comparison_df = pd.DataFrame([{'input': 'float64, normalised on the host',
+                               'input_MB': test_images_norm.nbytes / 1024**2,
+                               'seconds': float_seconds},
+                              {'input': 'uint8, rescaled in the model',
+                               'input_MB': test_images.nbytes / 1024**2,
+                               'seconds': uint8_seconds}])
+print(comparison_df.round(2).to_string(index=False))
+
+# the two ways must give the same predictions (up to float rounding)
+print('Largest probability difference:', np.abs(predictions_float - predictions_uint8).max())
+print('Same predicted labels:', (predictions_float.argmax(axis=1) == predictions_uint8.argmax(axis=1)).all())
+
+#%%
+
+### Resizing front end
+
+# with resize=True the model also accepts images of any size, for example
+# photos loaded without target_size=(32,32)
+model_resize = create_model_uint8(model_float, resize=True)
+large_images = np.repeat(np.repeat(test_images[:8], 2, axis=1), 2, axis=2)
+print('64x64 uint8 input gives predictions of shape', model_resize.predict(x=large_images, verbose=0).shape)
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+## Cascade prediction: the intro model first, the dropout model when it is unsure
+
+Most images are easy, and the smaller intro model gets them right. The larger
+dropout model is only run on the images where the intro model's highest class
+probability is below a threshold. The threshold is calibrated on the
+validation split of the training images by comparing accuracy with the average
+cost per image, and the cascade is then scored on the test set, which played
+no part in choosing it.
+
+"""
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from sklearn.model_selection import train_test_split # data splitting
+import numpy as np # for argmax
+import time # track run time
+from icwithcnn_cascade import CascadePredictor, seconds_per_image, calibrate_cascade, choose_threshold # cascade prediction
+from icwithcnn_registry import load_registered_model # versioned models
+from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+#### Prepare validation and test datasets
+
+# load the CIFAR-10 dataset included with the keras library
+# the images stay uint8, each model gets the input it expects
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# the same validation split the models were checked on during training,
+# used to calibrate the threshold
+_, val_images, _, val_labels = train_test_split(train_images, train_labels, test_size = 0.2, random_state=42)
+
+#%%
+
+# load the cheap and the strong model: the versions with the best validation accuracy
+model_fast = load_registered_model('cifar_model_intro', 'best')
+model_strong = load_registered_model('cifar_model_dropout', 'best')
+
+#%%
+
+### Calibrate the threshold on the validation set
+
+# time per image of each model on its own
+fast_seconds = seconds_per_image(model_fast, val_images)
+strong_seconds = seconds_per_image(model_strong, val_images)
+print('ms per image, intro model:', round(1000 * fast_seconds, 4), 'dropout model:', round(1000 * strong_seconds, 4))
+
+# probabilities of both models on every validation image
+fast_predictions = model_fast.predict(model_input(model_fast, val_images), batch_size=256, verbose=0)
+strong_predictions = model_strong.predict(model_input(model_strong, val_images), batch_size=256, verbose=0)
+strong_val_accuracy = np.mean(strong_predictions.argmax(axis=1) == val_labels[:, 0])
+
+# accuracy and cost per image for each threshold
+calibration_df = calibrate_cascade(fast_predictions, strong_predictions, val_labels,
+                                   fast_seconds, strong_seconds)
+print(calibration_df.round(4).to_string(index=False))
+
+# the cheapest threshold that loses at most half a percent of accuracy
+threshold = choose_threshold(calibration_df, strong_val_accuracy, max_accuracy_loss=0.005)
+print('Chosen threshold:', threshold)
+
+#%%
+
+### Score on the test set
+
+# the dropout model on every test image, timed the same way as the cascade
+strong_start = time.time()
+strong_test_predictions = model_strong.predict(model_input(model_strong, test_images), batch_size=256, verbose=0)
+strong_test_seconds = time.time() - strong_start
+strong_accuracy = np.mean(strong_test_predictions.argmax(axis=1) == test_labels[:, 0])
+
+cascade = CascadePredictor(model_fast, model_strong, threshold=threshold)
+
+cascade_start = time.time()
+cascade_predictions = np.concatenate([cascade.predict(test_images[batch_start:batch_start + 1000])
+                                      for batch_start in range(0, test_images.shape[0], 1000)])
+cascade_seconds = time.time() - cascade_start
+
+print('Dropout model on every image: accuracy', round(strong_accuracy, 4),
+      'ms per image', round(1000 * strong_test_seconds / test_images.shape[0], 4))
+print('Cascade: accuracy', round(np.mean(cascade_predictions.argmax(axis=1) == test_labels[:, 0]), 4),
+      'ms per image', round(1000 * cascade_seconds / test_images.shape[0], 4),
+      'escalated', round(cascade.escalation_rate(), 3))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+## Fuse several trained models into one ensemble model
+
+The best registered versions of the dropout and intro models are wired into
+one functional model that averages their predictions (or takes a weighted
+vote). The ensemble is saved to the registry as one artifact and its accuracy
+and throughput are compared with predicting each model in turn and averaging.
+
+"""
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+import numpy as np # for argmax
+import pandas as pd # handles dataframes
+import time # track run time
+from icwithcnn_ensemble import create_model_ensemble # fused ensembles
+from icwithcnn_registry import load_registered_model, register_model, resolve_model # versioned models
+
+#%%
+
+# start timer
+start = time.time()
+
+# registered models to combine, as (name, alias or version)
+member_refs = [('cifar_model_dropout', 'best'),
+               ('cifar_model_dropout', 'latest'),
+               ('cifar_model_intro', 'best')]
+
+#%%
+
+#### Prepare test dataset
+
+# load the CIFAR-10 dataset included with the keras library
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# normalize the RGB values to be between 0 and 1
+test_images = test_images / 255.0
+
+#%%
+
+### Load the members
+
+# leave out repeats, e.g. when the best dropout version is also the latest
+member_metadata = []
+members = []
+for name, ref in member_refs:
+    metadata = resolve_model(name, ref)
+    if metadata['path'] not in [item['path'] for item in member_metadata]:
+        member_metadata.append(metadata)
+        members.append(load_registered_model(name, ref))
+
+# weight each member by its validation accuracy
+member_weights = [metadata['val_accuracy'] or 1.0 for metadata in member_metadata]
+
+for metadata, member in zip(member_metadata, members):
+    print(member.name, 'version', metadata['version'], 'val_accuracy', metadata['val_accuracy'])
+
+#%%
+
+### Sequential prediction: one predict per model, averaged in numpy
+
+batch_size = 256
+
+# the first call traces each model, so warm every member up before timing,
+# as the fused ensemble is below
+for member in members:
+    member.predict(x=test_images[:batch_size], batch_size=batch_size, verbose=0)
+
+sequential_start = time.time()
+member_predictions = [member.predict(x=test_images, batch_size=batch_size, verbose=0) for member in members]
+sequential_predictions = np.average(np.stack(member_predictions), axis=0, weights=member_weights)
+sequential_seconds = time.time() - sequential_start
+
+#%%
+
+### Fused ensemble: one predict call
+
+results = []
+for reduction in ['mean', 'vote']:
+    model_ensemble = create_model_ensemble(members, member_weights, reduction)
+
+    # the first call traces the model so leave it out of the timing
+    model_ensemble.predict(x=test_images[:batch_size], batch_size=batch_size, verbose=0)
+
+    ensemble_start = time.time()
+    ensemble_predictions = model_ensemble.predict(x=test_images, batch_size=batch_size, verbose=0)
+    ensemble_seconds = time.time() - ensemble_start
+
+    results.append({'prediction': 'fused ensemble (' + reduction + ')',
+                    'accuracy': np.mean(ensemble_predictions.argmax(axis=1) == test_labels[:, 0]),
+                    'images_per_sec': test_images.shape[0] / ensemble_seconds})
+
+    # the weighted mean must match averaging the members one by one
+    if reduction == 'mean':
+        print('Largest difference from sequential averaging:', np.abs(ensemble_predictions - sequential_predictions).max())
+        model_mean = model_ensemble
+
+#%%
+
+# compare with each member on its own and with sequential averaging
+for member, predictions in zip(members, member_predictions):
+    results.append({'prediction': member.name,
+                    'accuracy': np.mean(predictions.argmax(axis=1) == test_labels[:, 0]),
+                    'images_per_sec': np.nan})
+results.append({'prediction': 'sequential average',
+                'accuracy': np.mean(sequential_predictions.argmax(axis=1) == test_labels[:, 0]),
+                'images_per_sec': test_images.shape[0] / sequential_seconds})
+
+print(pd.DataFrame(results).round(4).to_string(index=False))
+
+#%%
+
+# save the averaging ensemble as one artifact in the registry
+register_model(model_mean, name = 'cifar_model_ensemble',
+               notes = 'weighted mean of ' + ', '.join(metadata['path'] for metadata in member_metadata))
+
+# loading it back needs no member files, only icwithcnn_ensemble for the combining layer
+model_loaded = load_registered_model('cifar_model_ensemble', 'latest')
+print('Reloaded ensemble gives the same labels:',
+      (model_loaded.predict(x=test_images, batch_size=batch_size, verbose=0).argmax(axis=1) == sequential_predictions.argmax(axis=1)).all())
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 05 Evaluate a Convolutional Neural Network and Make Predictions (Classifications)
+
+## Evaluate a large test set with parallel worker processes
+
+`model_best.predict(x=test_images)` followed by accuracy_score and
+confusion_matrix runs in one TensorFlow runtime. Here a test set much larger
+than CIFAR-10's is split into shards, evaluated by several worker processes
+that each have their own threads and their own copy of the model, and the
+per-shard confusion matrices are added up. The merged metrics are checked
+against a single process, and one worker is made to crash to show that only
+its shard is evaluated again.
+
+"""
+#%%
+
+# load the required packages
+
+import numpy as np # arrays
+import pandas as pd # handles dataframes
+import os # file paths
+import shutil # remove the saved shards
+import time # track run time
+from icwithcnn_sharded_eval import write_eval_set, evaluate_sharded # sharded evaluation
+
+#%%
+
+if __name__ == '__main__':
+
+    # start timer
+    start = time.time()
+
+    # create a list of classnames
+    class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+    # registered model to evaluate; the uint8 copy reads the image file without normalising it first
+    model_name = 'cifar_model_dropout_uint8'
+
+    # copies of the CIFAR-10 test set in the large test set, and the sharding
+    repeats = 20
+    shard_size = 20000
+    num_workers = 4
+
+    eval_folder = 'fit_outputs/eval_set'
+    output_folder = 'fit_outputs/eval_shards'
+
+    #%%
+
+    #### Prepare the large test set
+
+    # the test set repeated, every other copy flipped left to right, written once as one uint8 file
+    images_path, labels_path = os.path.join(eval_folder, 'images.u8'), os.path.join(eval_folder, 'labels.npy')
+    if not os.path.exists(labels_path):
+        from tensorflow import keras # data and neural network
+        (train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+        copies = [test_images[:, :, ::-1] if copy % 2 else test_images for copy in range(repeats)]
+        images_path, labels_path = write_eval_set(np.concatenate(copies), np.tile(test_labels.ravel(), repeats), eval_folder)
+
+    labels = np.load(labels_path)
+    images = np.memmap(images_path, dtype=np.uint8, mode='r', shape=(len(labels), 32, 32, 3))
+    print('Test images:', images.shape)
+
+    #%%
+
+    ### One process
+
+    # TensorFlow is only imported here, so the worker processes, which import
+    # this script, start their runtime after their thread budget is set
+    from sklearn.metrics import accuracy_score, confusion_matrix # evaluation
+    from icwithcnn_registry import load_registered_model # versioned models
+    from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+    single_start = time.time()
+    model_best = load_registered_model(model_name, 'best')
+    predicted_labels = model_best.predict(x=model_input(model_best, images), batch_size=1024, verbose=0).argmax(axis=1)
+    single_accuracy = accuracy_score(labels, predicted_labels)
+    single_confusion = confusion_matrix(labels, predicted_labels, labels=range(len(class_names)))
+    single_seconds = time.time() - single_start
+
+    #%%
+
+    ### Shards in parallel workers, with the worker evaluating shard 2 made to crash
+
+    # start from no saved shards, so every shard is evaluated
+    shutil.rmtree(output_folder, ignore_errors=True)
+
+    confusion, metrics, summary = evaluate_sharded(model_name, images_path, labels_path, output_folder,
+                                                   num_classes = len(class_names),
+                                                   shard_size = shard_size,
+                                                   num_workers = num_workers,
+                                                   crash_shards = (2,))
+    print(summary)
+
+    # the merged counts are the same as one process predicting every image
+    print('Confusion matrices match:', (confusion == single_confusion).all())
+    print('Accuracy, one process:', single_accuracy, 'sharded:', metrics['accuracy'])
+    print('Mean log loss:', round(metrics['loss'], 4), 'macro F1:', round(metrics['macro_f1'], 4))
+
+    print(pd.DataFrame({'precision': metrics['precision'], 'recall': metrics['recall'], 'f1': metrics['f1']},
+                       index=class_names).round(3).to_string())
+
+    print(pd.DataFrame([{'run': 'one process', 'seconds': single_seconds, 'images_per_second': len(labels) / single_seconds},
+                        {'run': 'sharded', 'seconds': summary['seconds'], 'images_per_second': summary['images_per_second']}])
+          .set_index('run').round(1).to_string())
+
+    #%%
+
+    # a rerun finds every shard saved and only merges them
+    confusion, metrics, summary = evaluate_sharded(model_name, images_path, labels_path, output_folder,
+                                                   num_classes = len(class_names),
+                                                   shard_size = shard_size,
+                                                   num_workers = num_workers)
+    print('Shards already saved on rerun:', summary['already_saved'], 'of', summary['shards'])
+
+    #%%
+
+    end = time.time()
+
+    print()
+    print()
+    print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 06 Share a Convolutional Neural Network and Next Steps
+
+## Autotune batch size and thread counts for this machine
+
+Each setting is timed in a fresh Python process because TensorFlow and OpenMP
+only read their thread settings once, when the runtime starts. The best
+settings are saved to fit_outputs/autotune_<hostname>.json and picked up
+automatically by the fit and predict scripts.
+
+"""
+
+#%%
+
+# load the required packages
+
+import tensorflow as tf # thread settings
+from tensorflow import keras # neural network
+import numpy as np # synthetic probe data
+import json # pass settings to and from probe processes
+import os # environment variables
+import socket # host name
+import subprocess # run each probe in a fresh process
+import sys # python executable
+import time # track run time
+from icwithcnn_autotune import save_autotune_profile # machine specific settings
+
+# shape of the CIFAR-10 images
+input_shape = (32, 32, 3)
+
+#%%
+
+# function to define the introduction model
+
+def create_model_intro():
+
+    # CNN Part 1
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_intro = keras.Input(shape=input_shape)
+
+    # CNN Part 2
+    # Convolutional layer with 16 filters, 3x3 kernel size, and ReLU activation
+    x_intro = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_intro)
+    # Pooling layer with input window sized 2x2
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Second Convolutional layer with 32 filters, 3x3 kernel size, and ReLU activation
+    x_intro = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_intro)
+    # Second Pooling layer with input window sized 2x2
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Flatten layer to convert 2D feature maps into a 1D vector
+    x_intro = keras.layers.Flatten()(x_intro)
+    # Dense layer with 64 neurons and ReLU activation
+    x_intro = keras.layers.Dense(units=64, activation='relu')(x_intro)
+
+    # CNN Part 3
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_intro = keras.layers.Dense(units=10, activation='softmax')(x_intro)
+
+    # create the model
+    model_intro = keras.Model(inputs = inputs_intro,
+                              outputs = outputs_intro,
+                              name = "cifar_model_intro")
+
+    return model_intro
+
+#%%
+
+# function to define the dropout model
+
+def create_model_dropout():
+
+    # CNN Part 1
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_dropout = keras.Input(shape=input_shape)
+
+    # CNN Part 2
+    # Convolutional layer with 16 filters, 3x3 kernel size, and ReLU activation
+    x_dropout = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_dropout)
+    # Pooling layer with input window sized 2x2
+    x_dropout = keras.layers.MaxPooling2D(pool_size=(2,2))(x_dropout)
+    # Second Convolutional layer with 32 filters, 3x3 kernel size, and ReLU activation
+    x_dropout = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_dropout)
+    # Second Pooling layer with input window sized 2x2
+    x_dropout = keras.layers.MaxPooling2D(pool_size=(2,2))(x_dropout)
+    # Third Convolutional layer with 64 filters, 3x3 kernel size, and ReLU activation
+    x_dropout = keras.layers.Conv2D(filters=64, kernel_size=(3,3), activation='relu')(x_dropout)
+    # Dropout layer randomly drops 50 per cent of the input units
+    x_dropout = keras.layers.Dropout(rate=0.5)(x_dropout)
+    # Flatten layer to convert 2D feature maps into a 1D vector
+    x_dropout = keras.layers.Flatten()(x_dropout)
+
+    # CNN Part 3
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_dropout = keras.layers.Dense(units=10, activation='softmax')(x_dropout)
+
+    # create the model
+    model_dropout = keras.Model(inputs = inputs_dropout,
+                                outputs = outputs_dropout,
+                                name = "cifar_model_dropout")
+
+    return model_dropout
+
+# look up the model builders by model name
+model_builders = {'cifar_model_intro': create_model_intro,
+                  'cifar_model_dropout': create_model_dropout}
+
+#%%
+
+# function to get the peak memory (resident set size) of this process in MB
+
+def peak_rss_mb():
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS reports bytes, Linux reports kilobytes
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        # Windows has no resource module
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024**2
+
+#%%
+
+# function to time a few training steps or predictions with one setting
+# this runs inside its own process, started by launch_probe
+
+def run_probe(settings):
+
+    # thread pools must be sized before the first TensorFlow operation
+    tf.config.threading.set_intra_op_parallelism_threads(settings['intra_op_parallelism_threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(settings['inter_op_parallelism_threads'])
+
+    # random images and labels are enough to time the kernels
+    batch_size = settings['batch_size']
+    rng = np.random.default_rng(42)
+    images = rng.random((batch_size,) + input_shape, dtype=np.float32)
+    labels = keras.utils.to_categorical(rng.integers(0, 10, batch_size), 10)
+
+    # create and compile the model
+    model = model_builders[settings['model_name']]()
+    model.compile(optimizer = keras.optimizers.Adam(),
+                  loss = keras.losses.CategoricalCrossentropy(),
+                  metrics = keras.metrics.CategoricalAccuracy())
+
+    if settings['mode'] == 'train':
+        step = lambda: model.train_on_batch(images, labels)
+    else:
+        step = lambda: model.predict_on_batch(images)
+
+    # the first steps trace the graph so leave them out of the timing
+    for _ in range(settings['warmup_steps']):
+        step()
+
+    probe_start = time.perf_counter()
+    for _ in range(settings['probe_steps']):
+        step()
+    probe_seconds = time.perf_counter() - probe_start
+
+    return {'samples_per_sec': settings['probe_steps'] * batch_size / probe_seconds,
+            'peak_rss_mb': peak_rss_mb()}
+
+#%%
+
+# function to run one probe in a fresh process with its OpenMP settings
+# returns None if the probe crashed or timed out (e.g. ran out of memory)
+
+def launch_probe(settings, timeout=600):
+
+    environment = dict(os.environ,
+                       OMP_NUM_THREADS=str(settings['omp_num_threads']),
+                       KMP_BLOCKTIME=str(settings['kmp_blocktime']),
+                       TF_CPP_MIN_LOG_LEVEL='2')
+
+    try:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--probe', json.dumps(settings)],
+                                   env=environment, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+
+    if completed.returncode != 0:
+        return None
+
+    # the result is printed as json on the last line of the output
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+#%%
+
+# when started by launch_probe run a single probe and exit
+
+if __name__ == '__main__' and len(sys.argv) > 2 and sys.argv[1] == '--probe':
+    print(json.dumps(run_probe(json.loads(sys.argv[2]))))
+    sys.exit(0)
+
+#%%
+
+# function to search thread settings first and then batch sizes for one model and mode
+# batch sizes are tried from small to large and the search stops at the first
+# batch size that goes over the memory ceiling
+
+def autotune(model_name, mode, batch_sizes, memory_ceiling_mb, probe_steps=20, warmup_steps=3):
+
+    cores = os.cpu_count()
+    thread_counts = sorted({cores, max(1, cores // 2)}, reverse=True)
+
+    base_settings = {'model_name': model_name, 'mode': mode,
+                     'probe_steps': probe_steps, 'warmup_steps': warmup_steps}
+
+    # Stage 1: thread settings at a mid-sized batch
+    best = None
+    for intra_op in thread_counts:
+        for inter_op in [1, 2]:
+            for kmp_blocktime in [0, 1]:
+                settings = dict(base_settings,
+                                batch_size=batch_sizes[len(batch_sizes) // 2],
+                                intra_op_parallelism_threads=intra_op,
+                                inter_op_parallelism_threads=inter_op,
+                                omp_num_threads=intra_op,
+                                kmp_blocktime=kmp_blocktime)
+                result = launch_probe(settings)
+                print(model_name, mode, 'threads', intra_op, inter_op, kmp_blocktime, ':', result)
+                if result is None or result['peak_rss_mb'] > memory_ceiling_mb:
+                    continue
+                if best is None or result['samples_per_sec'] > best['samples_per_sec']:
+                    best = dict(settings, **result)
+
+    if best is None:
+        raise RuntimeError('No thread setting for ' + model_name + ' ' + mode + ' fits in ' + str(memory_ceiling_mb) + ' MB')
+
+    # Stage 2: batch sizes with the best thread settings
+    for batch_size in batch_sizes:
+        settings = dict(best, batch_size=batch_size)
+        result = launch_probe(settings)
+        print(model_name, mode, 'batch size', batch_size, ':', result)
+        if result is None or result['peak_rss_mb'] > memory_ceiling_mb:
+            break
+        if result['samples_per_sec'] > best['samples_per_sec']:
+            best = dict(settings, **result)
+
+    # keep only what the fit and predict scripts need plus the measurements
+    return {key: best[key] for key in ['batch_size', 'intra_op_parallelism_threads',
+                                       'inter_op_parallelism_threads', 'omp_num_threads',
+                                       'kmp_blocktime', 'samples_per_sec', 'peak_rss_mb']}
+
+#%%
+
+### Run the autotuner
+
+if __name__ == '__main__':
+
+    # start timer
+    start = time.time()
+
+    # memory ceiling for a single probe process in MB
+    memory_ceiling_mb = 4096
+
+    # batch sizes to try; large training batches also need the learning rate
+    # scaling in 04c_large_batch_fit.py so they are capped lower than prediction
+    train_batch_sizes = [32, 64, 128, 256]
+    predict_batch_sizes = [32, 64, 128, 256, 512, 1024, 2048]
+
+    profile = {'host': socket.gethostname(),
+               'cpu_count': os.cpu_count(),
+               'tensorflow_version': tf.__version__,
+               'memory_ceiling_mb': memory_ceiling_mb,
+               'models': {}}
+
+    for model_name in model_builders:
+        profile['models'][model_name] = {
+            'train': autotune(model_name, 'train', train_batch_sizes, memory_ceiling_mb),
+            'predict': autotune(model_name, 'predict', predict_batch_sizes, memory_ceiling_mb)}
+
+    # save the profile for the fit and predict scripts
+    save_autotune_profile(profile)
+    print(json.dumps(profile, indent=2))
+
+    end = time.time()
+
+    print()
+    print()
+    print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 06 Share a Convolutional Neural Network and Next Steps
+
+## Reverse image search with embeddings from a trained model
+
+The 64 values coming out of the Dense(units=64) layer of the introduction model
+are a compact description (embedding) of an image. Images with similar
+embeddings tend to look alike, so we can search a catalogue for the images
+closest to a query image.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from sklearn.cluster import MiniBatchKMeans # approximate index clusters
+import numpy as np # arrays and memmaps
+import pandas as pd # handles dataframes
+import time # track run time
+from icwithcnn_registry import load_registered_model # versioned models
+
+#%%
+
+# start timer
+start = time.time()
+
+#%%
+
+### Extract embeddings
+
+# function to cut a trained model at a named layer
+# if no layer name is given the layer before the output layer is used
+
+def create_model_embedding(model, layer_name=None):
+
+    if layer_name is None:
+        layer_name = model.layers[-2].name
+
+    model_embedding = keras.Model(inputs = model.input,
+                                  outputs = model.get_layer(layer_name).output,
+                                  name = model.name + "_embedding")
+
+    return model_embedding
+
+#%%
+
+# function to write the embeddings of a whole dataset to a float32 memmap
+# images are uint8 and normalised one batch at a time, so only a batch is
+# ever held in memory as floats
+
+def extract_embeddings(model_embedding, images, memmap_path, batch_size=1024):
+
+    embedding_size = model_embedding.output_shape[-1]
+    embeddings = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.float32,
+                                           shape=(images.shape[0], embedding_size))
+
+    for batch_start in range(0, images.shape[0], batch_size):
+        batch_images = images[batch_start:batch_start + batch_size].astype(np.float32) / 255.0
+        embeddings[batch_start:batch_start + batch_size] = model_embedding.predict_on_batch(batch_images)
+
+    embeddings.flush()
+
+    return embeddings
+
+#%%
+
+### Exact search
+
+# function to scale each embedding to length 1 so a dot product is the cosine similarity
+
+def normalise_rows(vectors):
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return vectors / np.maximum(norms, 1e-12)
+
+#%%
+
+# function to keep the k largest scores of each row, sorted from best to worst
+
+def top_k(scores, ids, k):
+
+    k = min(k, scores.shape[1])
+    ids = np.broadcast_to(ids, scores.shape)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    best_ids = np.take_along_axis(ids, best, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+
+    return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+#%%
+
+# function to find the k most similar catalogue embeddings for each query
+# the catalogue is scored block by block with one matrix multiply per block,
+# so the full queries x catalogue score matrix never has to fit in memory
+
+def search_exact(catalogue, queries, k=10, block_size=65536):
+
+    queries = normalise_rows(queries)
+    best_scores = np.full((queries.shape[0], 0), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((queries.shape[0], 0), dtype=np.int64)
+
+    for block_start in range(0, catalogue.shape[0], block_size):
+        block = normalise_rows(catalogue[block_start:block_start + block_size])
+        block_ids = np.arange(block_start, block_start + block.shape[0])
+
+        # merge this block's candidates with the best found so far
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        ids = np.concatenate([best_ids, np.broadcast_to(block_ids, (queries.shape[0], block.shape[0]))], axis=1)
+        best_scores, best_ids = top_k(scores, ids, k)
+
+    return best_scores, best_ids
+
+#%%
+
+### Approximate search (inverted file index)
+
+# function to build an inverted file (IVF) index
+# the catalogue is grouped into num_lists clusters and each cluster keeps the
+# ids of its members, so a query only has to be compared with a few clusters
+
+def build_ivf_index(catalogue, num_lists=256, random_state=42):
+
+    vectors = normalise_rows(catalogue)
+
+    kmeans = MiniBatchKMeans(n_clusters=num_lists, batch_size=4096, n_init=3, random_state=random_state)
+    assignments = kmeans.fit_predict(vectors)
+
+    # sort the ids by cluster so each list is one contiguous slice
+    order = np.argsort(assignments, kind='stable')
+    list_starts = np.searchsorted(assignments[order], np.arange(num_lists + 1))
+
+    return {'centroids': normalise_rows(kmeans.cluster_centers_),
+            'vectors': vectors[order],
+            'ids': order,
+            'list_starts': list_starts}
+
+#%%
+
+# function to search the num_probes clusters closest to each query
+
+def search_ivf(index, queries, k=10, num_probes=8):
+
+    queries = normalise_rows(queries)
+    _, probe_lists = top_k(queries @ index['centroids'].T, np.arange(index['centroids'].shape[0]), num_probes)
+
+    best_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+    best_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+
+    for query_number, query in enumerate(queries):
+        # gather the members of the probed clusters
+        rows = np.concatenate([np.arange(index['list_starts'][list_number], index['list_starts'][list_number + 1])
+                               for list_number in probe_lists[query_number]])
+        if rows.size == 0:
+            continue
+        scores, ids = top_k((index['vectors'][rows] @ query)[np.newaxis, :], index['ids'][rows], k)
+        best_scores[query_number, :scores.shape[1]] = scores[0]
+        best_ids[query_number, :ids.shape[1]] = ids[0]
+
+    return best_scores, best_ids
+
+#%%
+
+# function to measure the share of the exact top k results an approximate search found
+
+def recall_at_k(exact_ids, approximate_ids):
+
+    found = [len(set(exact_row) & set(approximate_row)) for exact_row, approximate_row in zip(exact_ids, approximate_ids)]
+
+    return np.sum(found) / exact_ids.size
+
+#%%
+
+# load the data
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+#%%
+
+# load the introduction model and cut it at the Dense(units=64) layer
+model_intro = load_registered_model('cifar_model_intro', 'best')
+model_embedding = create_model_embedding(model_intro)
+model_embedding.summary()
+
+#%%
+
+# embed the training images as the catalogue and the test images as queries
+extract_start = time.time()
+catalogue = extract_embeddings(model_embedding, train_images, 'fit_outputs/catalogue_embeddings.npy')
+queries = extract_embeddings(model_embedding, test_images[:1000], 'fit_outputs/query_embeddings.npy')
+print('Embedding extraction took', round(time.time() - extract_start, 2), 'seconds')
+
+#%%
+
+### Build the indexes and compare them
+
+# number of neighbours to return for each query
+k = 10
+
+# exact search needs no index, only the catalogue memmap
+exact_start = time.time()
+exact_scores, exact_ids = search_exact(catalogue, queries, k=k)
+exact_seconds = time.time() - exact_start
+
+results = [{'index': 'exact', 'build_seconds': 0.0,
+            'ms_per_query': 1000 * exact_seconds / queries.shape[0], 'recall_at_k': 1.0}]
+
+build_start = time.time()
+ivf_index = build_ivf_index(catalogue, num_lists=256)
+build_seconds = time.time() - build_start
+
+for num_probes in [1, 4, 16, 64]:
+    query_start = time.time()
+    ivf_scores, ivf_ids = search_ivf(ivf_index, queries, k=k, num_probes=num_probes)
+    query_seconds = time.time() - query_start
+    results.append({'index': 'ivf256 probes=' + str(num_probes), 'build_seconds': build_seconds,
+                    'ms_per_query': 1000 * query_seconds / queries.shape[0],
+                    'recall_at_k': recall_at_k(exact_ids, ivf_ids)})
+
+results_df = pd.DataFrame(results)
+print(results_df.round(4).to_string(index=False))
+
+#%%
+
+# check the search makes sense: how often do the neighbours share the query's class?
+same_class = (train_labels[exact_ids, 0] == test_labels[:1000]).mean()
+print('Share of the', k, 'nearest neighbours with the same class as the query:', round(same_class, 3))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
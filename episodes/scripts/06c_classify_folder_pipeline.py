@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 06 Share a Convolutional Neural Network and Next Steps
+
+## Classify a folder of images with a pipeline
+
+Reading files, decoding and resizing JPEGs, batching and running the model all
+happen at the same time in separate threads joined by bounded queues. A full
+queue makes the stage before it wait (backpressure), so memory use stays flat
+and the whole pipeline runs about as fast as its slowest stage.
+
+"""
+
+#%%
+
+# load the required packages
+
+from tensorflow import keras # data and neural network
+from keras.utils import img_to_array # image processing
+from keras.utils import load_img # image processing
+import numpy as np # arrays
+import pandas as pd # handles dataframes
+import csv # streamed output file
+import io # decode images from bytes
+import os # walk the folder
+import queue # bounded queues between stages
+import threading # pipeline stages
+import time # track run time
+from icwithcnn_registry import load_registered_model # versioned models
+from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+#%%
+
+# start timer
+start = time.time()
+
+# marker sent down a queue when a stage has no more work
+STOP = object()
+
+# image file types to classify
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+#%%
+
+### Pipeline stages
+
+# a stage takes items from its input queue, passes each to process() and puts
+# whatever process() returns on its output queue; process() returns a list so a
+# stage can hold items back (batching) or drop them (unreadable files)
+# flush() is called once the input is finished to hand over anything held back
+# an item that process() raises on is reported, counted in failed and dropped
+
+class Stage:
+
+    def __init__(self, name, process, input_queue, output_queue, num_workers=1, flush=None):
+        self.name = name
+        self.process = process
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.num_workers = num_workers
+        self.flush = flush
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.failed = []
+        self.lock = threading.Lock()
+        self.workers_running = num_workers
+        self.threads = [threading.Thread(target=self.work, name=name + str(number), daemon=True)
+                        for number in range(num_workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+    def put(self, outputs):
+        if self.output_queue is not None:
+            for output in outputs:
+                # blocks while the next stage is behind (backpressure)
+                self.output_queue.put(output)
+
+    def work(self):
+        try:
+            while True:
+                item = self.input_queue.get()
+
+                if item is STOP:
+                    # let the other workers of this stage see the stop marker too
+                    self.input_queue.put(STOP)
+                    return
+
+                stage_start = time.perf_counter()
+                try:
+                    outputs = self.process(item)
+                except Exception as error:
+                    # report the item and carry on, so one deleted file or failed
+                    # batch does not stop the worker and leave the pipeline waiting
+                    print('Stage', self.name, 'failed on', item_name(item), ':', repr(error))
+                    with self.lock:
+                        self.failed.append((item_name(item), repr(error)))
+                    outputs = []
+                with self.lock:
+                    self.busy_seconds += time.perf_counter() - stage_start
+                    self.items += 1
+                self.put(outputs)
+        finally:
+            # runs however the worker ends, so the next stage is always stopped
+            with self.lock:
+                self.workers_running -= 1
+                last_worker = self.workers_running == 0
+            # the last worker out hands over held back items and stops the next stage
+            if last_worker:
+                try:
+                    if self.flush is not None:
+                        self.put(self.flush())
+                finally:
+                    if self.output_queue is not None:
+                        self.output_queue.put(STOP)
+
+#%%
+
+# function to name a queue item in error messages: a path, or the first path of a batch
+
+def item_name(item):
+
+    if isinstance(item, str):
+        return item
+    if isinstance(item, tuple) and isinstance(item[0], str):
+        return item[0]
+    if isinstance(item, tuple) and isinstance(item[0], list):
+        return 'results starting ' + item_name(item[0][0]) if item[0] else 'empty results'
+    if isinstance(item, list):
+        return 'batch of ' + str(len(item)) + ' starting ' + item_name(item[0]) if item else 'empty batch'
+    return repr(item)[:80]
+
+#%%
+
+# function to list the image files in a folder and its sub folders
+
+def list_images(folder):
+
+    for root, _, file_names in os.walk(folder):
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(image_extensions):
+                yield os.path.join(root, file_name)
+
+#%%
+
+# function to read a file into memory (I/O bound)
+
+def read_file(path):
+
+    with open(path, 'rb') as image_file:
+        return [(path, image_file.read())]
+
+#%%
+
+# function to decode and resize an image to 32x32 like the CIFAR-10 images (CPU bound)
+# unreadable files are reported and skipped
+
+def decode_image(item):
+
+    path, data = item
+    try:
+        image = load_img(io.BytesIO(data), target_size=(32,32))
+    except Exception as error:
+        print('Skipping', path, ':', error)
+        return []
+
+    return [(path, img_to_array(image, dtype='uint8'))]
+
+#%%
+
+# function to group decoded images into batches for the model
+
+def create_batcher(batch_size):
+
+    pending = []
+
+    def add(item):
+        pending.append(item)
+        if len(pending) < batch_size:
+            return []
+        batch = list(pending)
+        pending.clear()
+        return [batch]
+
+    def flush():
+        return [list(pending)] if pending else []
+
+    return add, flush
+
+#%%
+
+# function to classify a batch with the model
+
+def create_classifier(model):
+
+    def classify(batch):
+        paths = [path for path, _ in batch]
+        images = model_input(model, np.stack([image for _, image in batch]))
+        return [(paths, model.predict_on_batch(images))]
+
+    return classify
+
+#%%
+
+# function to write a batch of results to the csv file as soon as it is ready
+
+def create_writer(output_file, class_names):
+
+    writer = csv.writer(output_file)
+    writer.writerow(['path', 'predicted_label'] + class_names)
+
+    def write(result):
+        paths, predictions = result
+        for path, prediction in zip(paths, predictions):
+            writer.writerow([path, class_names[int(np.argmax(prediction))]] + [round(float(p), 5) for p in prediction])
+        output_file.flush()
+        return []
+
+    return write
+
+#%%
+
+# function to classify every image in a folder and stream the results to a csv file
+# returns a dataframe with the work done and busy time of each stage
+
+def classify_folder(model, folder, output_path, class_names, batch_size=256,
+                    num_readers=4, num_decoders=4, queue_size=1024):
+
+    # bounded queues between the stages
+    path_queue = queue.Queue(maxsize=queue_size)
+    bytes_queue = queue.Queue(maxsize=queue_size)
+    image_queue = queue.Queue(maxsize=queue_size)
+    batch_queue = queue.Queue(maxsize=4)
+    result_queue = queue.Queue(maxsize=4)
+
+    add_to_batch, flush_batch = create_batcher(batch_size)
+
+    with open(output_path, 'w', newline='') as output_file:
+        stages = [Stage('read', read_file, path_queue, bytes_queue, num_workers=num_readers),
+                  Stage('decode', decode_image, bytes_queue, image_queue, num_workers=num_decoders),
+                  Stage('batch', add_to_batch, image_queue, batch_queue, flush=flush_batch),
+                  Stage('predict', create_classifier(model), batch_queue, result_queue),
+                  Stage('write', create_writer(output_file, class_names), result_queue, None)]
+
+        pipeline_start = time.perf_counter()
+        for stage in stages:
+            stage.start()
+
+        # feed the file names in; this waits whenever the readers fall behind
+        for path in list_images(folder):
+            path_queue.put(path)
+        path_queue.put(STOP)
+
+        for stage in stages:
+            stage.join()
+        pipeline_seconds = time.perf_counter() - pipeline_start
+
+    stage_df = pd.DataFrame([{'stage': stage.name,
+                              'workers': stage.num_workers,
+                              'items': stage.items,
+                              'failed': len(stage.failed),
+                              'busy_seconds': stage.busy_seconds,
+                              # seconds the stage would need on its own with all its workers busy
+                              'stage_seconds': stage.busy_seconds / stage.num_workers}
+                             for stage in stages])
+    stage_df['pipeline_seconds'] = pipeline_seconds
+
+    return stage_df
+
+#%%
+
+# create a list of classnames
+class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer', 'dog', 'frog', 'horse', 'ship', 'truck']
+
+# folder to classify
+image_folder = 'fit_outputs/cifar_test_jpgs'
+
+# write the CIFAR-10 test images out as JPEGs to have a folder to classify
+if not os.path.exists(image_folder):
+    os.makedirs(image_folder)
+    (train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+    for number, image in enumerate(test_images):
+        keras.utils.save_img(os.path.join(image_folder, '%05d.jpg' % number), image)
+
+#%%
+
+# load preferred model: the dropout model version with the best validation accuracy
+# the uint8 copy rescales inside the model, so decoded images go straight in
+model_best = load_registered_model('cifar_model_dropout_uint8', 'best')
+print('We are using', model_best.name)
+
+#%%
+
+### Run the pipeline
+
+stage_df = classify_folder(model_best, image_folder, 'fit_outputs/folder_predictions.csv', class_names)
+print(stage_df.round(2).to_string(index=False))
+
+# the pipeline is as fast as its slowest stage when the stages fully overlap
+num_images = stage_df.loc[stage_df['stage'] == 'batch', 'items'].iloc[0]
+print('End-to-end images/sec:', round(num_images / stage_df['pipeline_seconds'].iloc[0], 1))
+print('Slowest stage images/sec:', round(num_images / stage_df['stage_seconds'].max(), 1))
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 06 Share a Convolutional Neural Network and Next Steps
+
+## Render the training and evaluation figures
+
+Training and evaluation scripts save their results (the run store at
+fit_outputs/runs.sqlite and confusion matrices in fit_outputs/reports) and
+start this script in the background, so they never import matplotlib. It can
+also be run by hand to render every figure of a sweep at once. Figures that are
+already up to date are skipped.
+
+"""
+
+#%%
+
+# load the required packages
+
+from concurrent.futures import ProcessPoolExecutor # render figures in parallel
+import glob # find saved confusion matrices
+import os # file paths
+import time # track run time
+from icwithcnn_reports import report_folder # saved results
+from icwithcnn_run_store import list_runs, load_history_df # saved run history
+
+# folder the figures are written to
+figure_folder = 'fit_outputs/figures'
+
+#%%
+
+# function to import pyplot with the non-interactive Agg backend (no window needed)
+
+def import_pyplot():
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    return plt
+
+#%%
+
+# function to plot the loss and accuracy of one run, as in 04_fit_intro_model.py
+
+def render_history(run_id, model_name, figure_path):
+
+    plt = import_pyplot()
+    import seaborn as sns # specialised plotting
+
+    history_df = load_history_df(run_id)
+
+    # runs without validation data or with other metrics only have some of the
+    # columns: plot the ones there are and leave out a panel with none
+    panels = [[column for column in columns if column in history_df.columns]
+              for columns in (['loss', 'val_loss'], ['categorical_accuracy', 'val_categorical_accuracy'])]
+    panels = [columns for columns in panels if columns]
+    if not panels:
+        raise ValueError('Run ' + str(run_id) + ' has no loss or accuracy metrics to plot')
+
+    # plot the loss and accuracy from the training process
+    fig, axes = plt.subplots(1, len(panels), figsize=(5 * len(panels), 4), squeeze=False)
+    fig.suptitle(model_name + ' (run ' + str(run_id) + ')')
+    for ax, columns in zip(axes[0], panels):
+        sns.lineplot(ax=ax, data=history_df[columns])
+    fig.savefig(figure_path, dpi=100, bbox_inches='tight')
+    plt.close(fig)
+
+    return figure_path
+
+#%%
+
+# function to plot the validation accuracy of every run of a model, one line per run
+
+def render_sweep(model_name, runs, figure_path):
+
+    plt = import_pyplot()
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    for run_id, settings in runs:
+        history_df = load_history_df(run_id)
+        # runs fit without validation data have nothing to add
+        if 'val_categorical_accuracy' in history_df.columns:
+            ax.plot(history_df['val_categorical_accuracy'], label=settings)
+    ax.set_title('Validation accuracy for ' + model_name)
+    ax.set_xlabel('Epochs')
+    ax.set_ylabel('Validation Accuracy')
+    ax.legend()
+    fig.savefig(figure_path, dpi=100, bbox_inches='tight')
+    plt.close(fig)
+
+    return figure_path
+
+#%%
+
+# function to plot a saved confusion matrix as a heatmap, as in 05_predict_ep_best_model.py
+
+def render_confusion(confusion_path, figure_path):
+
+    plt = import_pyplot()
+    import seaborn as sns # specialised plotting
+    import pandas as pd # handles dataframes
+
+    confusion_df = pd.read_csv(confusion_path, index_col=0)
+
+    # Set the names of the x and y axis, this helps with the readability of the heatmap
+    confusion_df.index.name = 'True Label'
+    confusion_df.columns.name = 'Predicted Label'
+
+    # heatmap visualization of the confusion matrix
+    fig, ax = plt.subplots(figsize=(10, 8))
+    sns.heatmap(data=confusion_df, annot=True, fmt='3g', ax=ax)
+    fig.savefig(figure_path, dpi=100, bbox_inches='tight')
+    plt.close(fig)
+
+    return figure_path
+
+#%%
+
+# function to check whether a figure is older than its source
+
+def out_of_date(figure_path, source_time):
+
+    return not os.path.exists(figure_path) or os.path.getmtime(figure_path) < source_time
+
+#%%
+
+# function to list the figures that need to be rendered
+# returns (render function, arguments) pairs
+
+def find_render_jobs():
+
+    jobs = []
+
+    # one figure per finished run and one per model with several runs
+    if os.path.exists('fit_outputs/runs.sqlite'):
+        runs_df = list_runs()
+        runs_df = runs_df[runs_df['finished'].notna()]
+        for run in runs_df.itertuples():
+            figure_path = os.path.join(figure_folder, 'history_run%05d_%s.png' % (run.run_id, run.model_name))
+            if out_of_date(figure_path, run.finished):
+                jobs.append((render_history, (run.run_id, run.model_name, figure_path)))
+
+        for model_name, model_runs_df in runs_df.groupby('model_name'):
+            if len(model_runs_df) < 2:
+                continue
+            figure_path = os.path.join(figure_folder, 'sweep_' + model_name + '.png')
+            if out_of_date(figure_path, model_runs_df['finished'].max()):
+                runs = list(zip(model_runs_df['run_id'], model_runs_df['settings']))
+                jobs.append((render_sweep, (model_name, runs, figure_path)))
+
+    # one figure per saved confusion matrix
+    for confusion_path in glob.glob(os.path.join(report_folder, 'confusion_*.csv')):
+        figure_name = os.path.splitext(os.path.basename(confusion_path))[0] + '.png'
+        figure_path = os.path.join(figure_folder, figure_name)
+        if out_of_date(figure_path, os.path.getmtime(confusion_path)):
+            jobs.append((render_confusion, (confusion_path, figure_path)))
+
+    return jobs
+
+#%%
+
+# function to run a render job in a worker process
+# returns (figure path, None), or (None, error message) if the job failed, so
+# one figure that cannot be drawn does not stop the others
+
+def run_render_job(job):
+
+    render_function, arguments = job
+
+    try:
+        return render_function(*arguments), None
+    except Exception as error:
+        return None, render_function.__name__ + str(arguments[:-1]) + ': ' + repr(error)
+
+#%%
+
+### Render every out of date figure
+
+if __name__ == '__main__':
+
+    # start timer
+    start = time.time()
+
+    os.makedirs(figure_folder, exist_ok=True)
+
+    jobs = find_render_jobs()
+    print('Rendering', len(jobs), 'figures')
+
+    errors = []
+    with ProcessPoolExecutor(max_workers=min(4, os.cpu_count())) as executor:
+        for figure_path, error in executor.map(run_render_job, jobs):
+            if error is None:
+                print('Saved', figure_path)
+            else:
+                errors.append(error)
+                print('Failed', error)
+
+    print('Rendered', len(jobs) - len(errors), 'of', len(jobs), 'figures')
+
+    end = time.time()
+
+    print()
+    print()
+    print("Time taken to run program was:", end - start, "seconds")
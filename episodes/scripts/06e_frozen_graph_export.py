@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Episode 06 Share a Convolutional Neural Network and Next Steps
+
+## Export a frozen inference graph and compare it with load_model
+
+The best registered dropout model is exported as a frozen graph (and ONNX if
+tf2onnx is installed). Each way of serving it, keras.models.load_model +
+predict, the frozen graph runner and onnxruntime, then runs in a fresh process
+so its load time and memory (RSS) are not mixed up with the others. The
+predictions of every runtime are checked against Keras on the CIFAR-10 test set.
+
+"""
+#%%
+
+# load the required packages
+# only light packages here: this file is also run as a probe process, and the
+# probes must not load Keras unless they are measuring it
+
+import numpy as np # arrays
+import json # pass settings to and from probe processes
+import os # file paths
+import subprocess # run each probe in a fresh process
+import sys # python executable
+import time # track run time
+from icwithcnn_memory import current_rss_bytes # process memory
+from icwithcnn_frozen_graph import FrozenGraphRunner, OnnxRunner # Keras-free runners
+
+#%%
+
+# function to load a model with one runtime, predict the test images and
+# report the timings and memory
+# this runs inside its own process, started by launch_probe
+
+def run_probe(settings):
+
+    rss_before_mb = current_rss_bytes() / 1024**2
+
+    load_start = time.perf_counter()
+    if settings['runtime'] == 'keras':
+        from tensorflow import keras
+        model = keras.models.load_model(settings['model_path'])
+        predict = lambda images: model.predict(images, batch_size=settings['batch_size'], verbose=0)
+    elif settings['runtime'] == 'frozen_graph':
+        runner = FrozenGraphRunner(settings['export_folder'])
+        predict = lambda images: runner.predict(images, batch_size=settings['batch_size'])
+    else:
+        runner = OnnxRunner(settings['export_folder'])
+        predict = lambda images: runner.predict(images, batch_size=settings['batch_size'])
+    load_seconds = time.perf_counter() - load_start
+    rss_loaded_mb = current_rss_bytes() / 1024**2
+
+    images = np.load(settings['images_path'], mmap_mode='r')
+
+    # the first call builds and optimises the graph so leave it out of the timing
+    predict(images[:settings['batch_size']])
+
+    predict_start = time.perf_counter()
+    predictions = predict(images)
+    predict_seconds = time.perf_counter() - predict_start
+
+    np.save(settings['predictions_path'], predictions)
+
+    return {'runtime': settings['runtime'],
+            'load_seconds': load_seconds,
+            'start_rss_mb': rss_before_mb,
+            'loaded_rss_mb': rss_loaded_mb,
+            'predicted_rss_mb': current_rss_bytes() / 1024**2,
+            'images_per_sec': len(images) / predict_seconds}
+
+#%%
+
+# function to run one probe in a fresh process
+# returns None if the probe failed (e.g. onnxruntime is not installed)
+
+def launch_probe(settings, timeout=600):
+
+    environment = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='2')
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--probe', json.dumps(settings)],
+                               env=environment, capture_output=True, text=True, timeout=timeout)
+
+    if completed.returncode != 0:
+        print(settings['runtime'], 'probe failed:', completed.stderr.strip().splitlines()[-1:])
+        return None
+
+    # the result is printed as json on the last line of the output
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+#%%
+
+# when started by launch_probe run a single probe and exit
+
+if __name__ == '__main__' and len(sys.argv) > 2 and sys.argv[1] == '--probe':
+    print(json.dumps(run_probe(json.loads(sys.argv[2]))))
+    sys.exit(0)
+
+#%%
+
+# load the packages used to export and report
+
+from tensorflow import keras # data and neural network
+import pandas as pd # handles dataframes
+from icwithcnn_frozen_graph import export_frozen_graph # frozen graph export
+from icwithcnn_registry import load_registered_model, resolve_model # versioned models
+
+#%%
+
+# start timer
+start = time.time()
+
+# folder for the export and the probe files
+export_folder = 'fit_outputs/frozen/cifar_model_dropout'
+
+#%%
+
+#### Prepare test dataset
+
+# load the CIFAR-10 dataset included with the keras library
+(train_images, train_labels), (test_images, test_labels) = keras.datasets.cifar10.load_data()
+
+# normalize the RGB values to be between 0 and 1 and save them for the probes
+test_images = (test_images / 255.0).astype(np.float32)
+np.save('fit_outputs/test_images_float32.npy', test_images)
+
+#%%
+
+### Export
+
+# the dropout model version with the best validation accuracy
+metadata = resolve_model('cifar_model_dropout', 'best')
+model_best = load_registered_model('cifar_model_dropout', 'best')
+
+signature = export_frozen_graph(model_best, export_folder)
+print(json.dumps(signature, indent=2))
+
+#%%
+
+### Load and predict with each runtime in its own process
+
+runtimes = ['keras', 'frozen_graph'] + (['onnx'] if signature['onnx'] else [])
+
+results = []
+predictions = {}
+for runtime in runtimes:
+    settings = {'runtime': runtime,
+                'model_path': metadata['path'],
+                'export_folder': export_folder,
+                'images_path': 'fit_outputs/test_images_float32.npy',
+                'predictions_path': os.path.join(export_folder, 'predictions_' + runtime + '.npy'),
+                'batch_size': 256}
+    result = launch_probe(settings)
+    if result is not None:
+        results.append(result)
+        predictions[runtime] = np.load(settings['predictions_path'])
+    elif runtime == 'keras':
+        # every other runtime is compared with the keras predictions, so stop here
+        raise RuntimeError('The keras reference probe failed, so the exported runtimes cannot be checked; see the error above')
+
+#%%
+
+# numerical parity with Keras on the whole test set
+for result in results:
+    difference = np.abs(predictions[result['runtime']] - predictions['keras'])
+    result['max_abs_difference'] = difference.max()
+    result['label_agreement'] = np.mean(predictions[result['runtime']].argmax(axis=1) == predictions['keras'].argmax(axis=1))
+    result['accuracy'] = np.mean(predictions[result['runtime']].argmax(axis=1) == test_labels[:, 0])
+
+results_df = pd.DataFrame(results).set_index('runtime')
+print(results_df.round(4).to_string())
+
+# the exported graph must give the same answers as the model it came from
+if (results_df['max_abs_difference'] > 1e-4).any():
+    print('WARNING: an exported runtime differs from keras by more than 1e-4')
+
+#%%
+
+end = time.time()
+
+print()
+print()
+print("Time taken to run program was:", end - start, "seconds")
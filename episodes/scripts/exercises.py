@@ -14,8 +14,12 @@ This exercises template file is designed to provide the required initialisation
 # load the cifar dataset included with the keras packages
 from tensorflow import keras
 from icwithcnn_functions import prepare_image_icwithcnn
+from icwithcnn_registry import load_registered_model
+from icwithcnn_subset import apply_subset # fast-dev training subset
 
 (train_images, train_labels), (val_images, val_labels) = keras.datasets.cifar10.load_data()
+# a smaller training set for quick trials when the CNN_SUBSET switch is set (icwithcnn_subset.py)
+train_images, train_labels = apply_subset(train_images, train_labels)
 
 print('Train: Images=%s, Labels=%s' % (train_images.shape, train_labels.shape))
 print('Validate: Images=%s, Labels=%s' % (val_images.shape, val_labels.shape))
@@ -57,10 +61,10 @@ Build a Convolutional Neural Network
 """
 
 # Load the saved the model from the intro
-# The line of code below can be run and uncommented after the intro model
-# has been saved from the "Introduction to Deep Learning" episode.
+# The line of code below can be run after the intro model has been trained
+# and registered by 04_fit_intro_model.py; 'latest' is the newest version.
 
-model_intro = keras.models.load_model('fit_outputs/01_intro_model.h5')
+model_intro = load_registered_model('cifar_model_intro', 'latest')
 
 ### Number of parameters ###
 # https://carpentries-incubator.github.io/intro-image-classification-cnn/03-build-cnn.html#number-of-parameters
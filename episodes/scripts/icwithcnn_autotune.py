@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Helper functions to save and load the per-machine batch size and thread
+settings found by 06_autotune_batch_threads.py
+
+"""
+
+import json # profile file format
+import os # file paths and environment variables
+import socket # host name
+
+# folder the autotuned profiles are saved in
+profile_folder = 'fit_outputs'
+
+#%%
+
+# function to get the profile path for this machine
+
+def autotune_profile_path():
+
+    return os.path.join(profile_folder, 'autotune_' + socket.gethostname() + '.json')
+
+#%%
+
+# function to save an autotuned profile for this machine
+
+def save_autotune_profile(profile):
+
+    os.makedirs(profile_folder, exist_ok=True)
+
+    # write to a temporary file first so a crashed run never leaves half a profile
+    temp_path = autotune_profile_path() + '.tmp'
+    with open(temp_path, 'w') as profile_file:
+        json.dump(profile, profile_file, indent=2)
+    os.replace(temp_path, autotune_profile_path())
+
+#%%
+
+# function to load the autotuned profile for this machine (None if not tuned yet)
+
+def load_autotune_profile():
+
+    if not os.path.exists(autotune_profile_path()):
+        return None
+
+    with open(autotune_profile_path()) as profile_file:
+        return json.load(profile_file)
+
+#%%
+
+# function to apply the tuned thread settings for a model and return its batch size
+# mode is either 'train' or 'predict'
+# this must be called before TensorFlow runs its first operation
+
+def apply_autotune_profile(model_name, mode, default_batch_size=32):
+
+    profile = load_autotune_profile()
+    if profile is None:
+        return default_batch_size
+
+    settings = profile['models'].get(model_name, {}).get(mode)
+    if settings is None:
+        return default_batch_size
+
+    # OpenMP settings are read by the oneDNN/MKL kernels when they first run
+    os.environ['OMP_NUM_THREADS'] = str(settings['omp_num_threads'])
+    os.environ['KMP_BLOCKTIME'] = str(settings['kmp_blocktime'])
+
+    # TensorFlow thread pools can only be sized before the runtime starts
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(settings['intra_op_parallelism_threads'])
+        tf.config.threading.set_inter_op_parallelism_threads(settings['inter_op_parallelism_threads'])
+    except RuntimeError:
+        print('TensorFlow is already running, autotuned thread settings not applied')
+
+    print('Using autotuned', mode, 'settings for', model_name, 'from', autotune_profile_path(), ':', settings)
+
+    return settings['batch_size']
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Cascade prediction: a cheap model answers the easy images and only the images
+it is unsure about are passed on to a stronger, more expensive model
+
+An image is passed on when the highest class probability of the cheap model
+is below a threshold. The threshold trades accuracy against cost, and
+calibrate_cascade shows that trade-off over a labelled set so a threshold can
+be chosen.
+
+"""
+
+import numpy as np # arrays
+import pandas as pd # handles dataframes
+import time # model timing
+from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+#%%
+
+class CascadePredictor:
+
+    # fast_model: cheap model run on every image
+    # strong_model: expensive model run only on the images the fast model is unsure about
+    # threshold: images whose highest fast probability is below this go to the strong model
+
+    def __init__(self, fast_model, strong_model, threshold=0.8, batch_size=256):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.images = 0
+        self.escalated = 0
+
+    # predict a batch of uint8 images, returns the class probabilities of each
+    # image in the order given, from the strong model for the escalated images
+    def predict(self, images):
+        predictions = self.fast_model.predict(model_input(self.fast_model, images), batch_size=self.batch_size, verbose=0)
+
+        # rows the fast model is unsure about
+        unsure = np.flatnonzero(predictions.max(axis=1) < self.threshold)
+        if len(unsure):
+            predictions[unsure] = self.strong_model.predict(model_input(self.strong_model, images[unsure]),
+                                                            batch_size=self.batch_size, verbose=0)
+
+        self.images += len(images)
+        self.escalated += len(unsure)
+
+        return predictions
+
+    # share of images sent to the strong model so far
+    def escalation_rate(self):
+        return self.escalated / self.images if self.images else 0.0
+
+#%%
+
+# function to time a model on a set of uint8 images, returns seconds per image
+
+def seconds_per_image(model, images, batch_size=256):
+
+    inputs = model_input(model, images)
+    # the first call traces the model so leave it out of the timing
+    model.predict(inputs[:batch_size], batch_size=batch_size, verbose=0)
+
+    predict_start = time.perf_counter()
+    model.predict(inputs, batch_size=batch_size, verbose=0)
+
+    return (time.perf_counter() - predict_start) / len(images)
+
+#%%
+
+# function to sweep the threshold over a labelled set
+# fast_predictions and strong_predictions are the probabilities of both models
+# on every image, so each threshold is scored without running the models again
+# the cost of a threshold is the time per image of the fast model plus the
+# share of images escalated times the time per image of the strong model
+
+def calibrate_cascade(fast_predictions, strong_predictions, labels, fast_seconds, strong_seconds,
+                      thresholds=np.linspace(0.0, 1.0, 21)):
+
+    labels = np.asarray(labels).ravel()
+    fast_confidence = fast_predictions.max(axis=1)
+    fast_correct = fast_predictions.argmax(axis=1) == labels
+    strong_correct = strong_predictions.argmax(axis=1) == labels
+
+    rows = []
+    for threshold in thresholds:
+        escalate = fast_confidence < threshold
+        rows.append({'threshold': threshold,
+                     'escalation_rate': escalate.mean(),
+                     'accuracy': np.where(escalate, strong_correct, fast_correct).mean(),
+                     'ms_per_image': 1000 * (fast_seconds + escalate.mean() * strong_seconds)})
+
+    calibration_df = pd.DataFrame(rows)
+    calibration_df['relative_cost'] = calibration_df['ms_per_image'] / (1000 * strong_seconds)
+
+    return calibration_df
+
+#%%
+
+# function to choose the cheapest threshold whose accuracy is within
+# max_accuracy_loss of running the strong model on every image
+
+def choose_threshold(calibration_df, strong_accuracy, max_accuracy_loss=0.005):
+
+    good_enough = calibration_df[calibration_df['accuracy'] >= strong_accuracy - max_accuracy_loss]
+    if good_enough.empty:
+        return 1.0
+
+    return float(good_enough.sort_values(['ms_per_image', 'threshold']).iloc[0]['threshold'])
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Near-duplicate detection with perceptual hashes, to collapse repeated images
+before a dataset is split into training and validation sets
+
+Each 32x32 image gets a 64-bit perceptual hash (pHash): the signs of its low
+frequency DCT coefficients compared with their median. Small changes such as
+re-compression, resizing or slight brightness shifts flip only a few bits, so
+near-duplicates have hashes within a small Hamming distance of each other.
+
+Pairs within the distance are found with multi-index hashing. The 64 bits are
+split into radius + 1 chunks, and two hashes within the radius must agree
+exactly on at least one chunk. Only hashes that share a chunk are compared, so
+the search does not compare every pair of images.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor # parallel hashing
+import os # number of cores
+import numpy as np # arrays
+
+#%%
+
+# function to make the matrix of the 1-D DCT-II of length n
+
+def dct_matrix(n):
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+
+    return matrix
+
+#%%
+
+# function to hash a block of uint8 RGB images of shape (N, height, width, 3)
+# returns one uint64 hash per image
+
+def hash_block(images, hash_size=8):
+
+    # grey scale with the usual luminance weights
+    grey = np.asarray(images, dtype=np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    # 2-D DCT of every image, keeping the hash_size x hash_size lowest frequencies
+    row_dct = dct_matrix(grey.shape[1])[:hash_size].astype(np.float32)
+    column_dct = dct_matrix(grey.shape[2])[:hash_size].astype(np.float32)
+    low_frequencies = row_dct @ grey @ column_dct.T
+
+    # one bit per coefficient: above or below the median, leaving out the DC term
+    # (overall brightness) when the median is taken
+    coefficients = low_frequencies.reshape(len(images), -1)
+    medians = np.median(coefficients[:, 1:], axis=1, keepdims=True)
+    bits = coefficients > medians
+
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+#%%
+
+# function to hash every image, one block of images per worker thread
+# numpy releases the GIL for the matrix products, so the threads run in parallel
+# images can be a np.memmap, only one block per worker is read at a time
+
+def perceptual_hashes(images, block_size=8192, num_workers=None):
+
+    num_workers = num_workers or os.cpu_count()
+    block_starts = range(0, len(images), block_size)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        blocks = list(executor.map(lambda block_start: hash_block(images[block_start:block_start + block_size]),
+                                   block_starts))
+
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.uint64)
+
+#%%
+
+# function to count the bits that differ between two arrays of uint64 hashes
+
+def hamming_distance(hashes_a, hashes_b):
+
+    differences = np.bitwise_xor(hashes_a, hashes_b)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(differences)
+
+    # older numpy: count the bits of each byte with a lookup table
+    byte_counts = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+    return byte_counts[differences.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+#%%
+
+# function to find the pairs within radius bits among the hashes at positions members
+# a bucket of n hashes has n * (n - 1) / 2 pairs, so the distances are worked out
+# a block of rows at a time, at most about block_pairs of them at once
+# returns two arrays of positions into hashes
+
+def bucket_pairs(hashes, members, radius, block_pairs=1 << 22):
+
+    member_hashes = hashes[members]
+    block_rows = max(1, block_pairs // len(members))
+
+    firsts, seconds = [], []
+    for row_start in range(0, len(members) - 1, block_rows):
+        row_stop = min(row_start + block_rows, len(members) - 1)
+        # each row against every member after it
+        left, right = np.broadcast_arrays(member_hashes[row_start:row_stop, None], member_hashes[None, row_start + 1:])
+        distances = hamming_distance(left.ravel(), right.ravel()).reshape(left.shape)
+        upper = np.arange(left.shape[1])[None, :] >= np.arange(left.shape[0])[:, None]
+        rows, columns = np.nonzero((distances <= radius) & upper)
+        firsts.append(members[row_start + rows])
+        seconds.append(members[row_start + 1 + columns])
+
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+#%%
+
+# function to find every pair of distinct hashes within radius bits of each other
+# hashes must be unique (identical hashes are grouped before this is called)
+# returns two arrays of positions into hashes
+
+def near_pairs(hashes, radius, block_pairs=1 << 22):
+
+    num_chunks = radius + 1
+    chunk_bits = [64 // num_chunks + (1 if chunk < 64 % num_chunks else 0) for chunk in range(num_chunks)]
+
+    firsts, seconds = [], []
+    shift = 64
+    for bits in chunk_bits:
+        shift -= bits
+        chunk_values = (hashes >> np.uint64(shift)) & np.uint64((1 << bits) - 1)
+
+        # hashes with the same chunk value are next to each other once sorted
+        order = np.argsort(chunk_values, kind='stable')
+        sorted_values = chunk_values[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+        group_ends = np.r_[group_starts[1:], len(order)]
+
+        for group_start, group_end in zip(group_starts, group_ends):
+            if group_end - group_start < 2:
+                continue
+            first, second = bucket_pairs(hashes, order[group_start:group_end], radius, block_pairs)
+            firsts.append(first)
+            seconds.append(second)
+
+    if not firsts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # a pair that agrees on several chunks is found several times
+    pairs = np.unique(np.sort(np.stack([np.concatenate(firsts), np.concatenate(seconds)], axis=1), axis=1), axis=0)
+
+    return pairs[:, 0], pairs[:, 1]
+
+#%%
+
+# function to group near-duplicate images
+# returns one group number per image: the position of the first image of its group
+
+def duplicate_groups(hashes, radius=4):
+
+    # identical hashes first: each distinct hash is searched once
+    unique_hashes, first_image, hash_of_image = np.unique(hashes, return_index=True, return_inverse=True)
+
+    # union-find over the distinct hashes, joining every close pair
+    parent = np.arange(len(unique_hashes))
+
+    def root(position):
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    for first, second in zip(*near_pairs(unique_hashes, radius)):
+        root_first, root_second = root(first), root(second)
+        if root_first != root_second:
+            parent[max(root_first, root_second)] = min(root_first, root_second)
+
+    # point every hash straight at the root of its group
+    roots = parent
+    while True:
+        next_roots = roots[roots]
+        if (next_roots == roots).all():
+            break
+        roots = next_roots
+
+    # name each group after the first image in it
+    group_first_image = np.full(len(unique_hashes), len(hashes), dtype=np.int64)
+    np.minimum.at(group_first_image, roots, first_image)
+
+    return group_first_image[roots][hash_of_image.ravel()]
+
+#%%
+
+# function to keep one image of every near-duplicate group
+# returns the positions of the images to keep, the group number of every image
+# and a summary of what was found
+# labels (optional) are used to count groups whose images have different labels
+
+def deduplicate(images, labels=None, radius=4, num_workers=None):
+
+    hashes = perceptual_hashes(images, num_workers=num_workers)
+    groups = duplicate_groups(hashes, radius)
+
+    keep = np.flatnonzero(groups == np.arange(len(groups)))
+    group_sizes = np.bincount(groups, minlength=len(groups))
+
+    summary = {'images': len(images),
+               'kept': len(keep),
+               'removed': len(images) - len(keep),
+               'duplicate_groups': int((group_sizes > 1).sum()),
+               'largest_group': int(group_sizes.max()) if len(group_sizes) else 0}
+
+    if labels is not None:
+        labels = np.asarray(labels).ravel()
+        mixed = np.zeros(len(groups), dtype=bool)
+        np.logical_or.at(mixed, groups, labels != labels[groups])
+        summary['groups_with_mixed_labels'] = int(mixed.sum())
+
+    return keep, groups, summary
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Fused ensembles: several trained models wired into one functional model with a
+shared input and a combined output
+
+A single predict call runs every member on each batch inside one graph, instead
+of one Python-level predict loop per model followed by averaging in numpy. The
+ensemble saves and loads as one .keras file; import this module before loading
+it so Keras knows the combining layer.
+
+"""
+
+from tensorflow import keras # data and neural network
+import tensorflow as tf # tensor operations inside the model
+
+#%%
+
+# layer that combines the class probabilities of the members
+# 'mean' takes the weighted mean of the probabilities, 'vote' the weighted share
+# of members that picked each class, with ties broken by the mean probability
+
+@keras.utils.register_keras_serializable(package='icwithcnn')
+class CombineMembers(keras.layers.Layer):
+
+    def __init__(self, member_weights, reduction='mean', **kwargs):
+        super().__init__(**kwargs)
+        self.member_weights = [float(weight) for weight in member_weights]
+        self.reduction = reduction
+
+    def call(self, member_probabilities):
+        # shape (members, batch, classes)
+        stacked = tf.stack(member_probabilities, axis=0)
+        weights = tf.constant(self.member_weights, dtype=stacked.dtype)
+        weights = tf.reshape(weights / tf.reduce_sum(weights), [-1, 1, 1])
+        mean_probabilities = tf.reduce_sum(weights * stacked, axis=0)
+
+        if self.reduction == 'mean':
+            return mean_probabilities
+
+        num_classes = stacked.shape[-1]
+        votes = tf.reduce_sum(weights * tf.one_hot(tf.argmax(stacked, axis=-1), num_classes, dtype=stacked.dtype), axis=0)
+        scores = votes + 1e-3 * mean_probabilities
+        return scores / tf.reduce_sum(scores, axis=-1, keepdims=True)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'member_weights': self.member_weights, 'reduction': self.reduction})
+        return config
+
+#%%
+
+# function to copy a trained model under a new name
+# layer names must be unique in a model, and members are often versions of the
+# same model with the same name
+
+def renamed_copy(model, name):
+
+    config = model.get_config()
+    config['name'] = name
+    model_copy = keras.Model.from_config(config)
+    model_copy.set_weights(model.get_weights())
+
+    return model_copy
+
+#%%
+
+# function to build an ensemble from trained models that take the same input
+# member_weights: one weight per model (e.g. its validation accuracy), or None for equal weights
+
+def create_model_ensemble(models, member_weights=None, reduction='mean', name='cifar_model_ensemble'):
+
+    input_shapes = set(tuple(model.input_shape[1:]) for model in models)
+    input_dtypes = set(model.inputs[0].dtype for model in models)
+    if len(input_shapes) > 1 or len(input_dtypes) > 1:
+        raise ValueError('Ensemble members must take the same input, got shapes ' + str(input_shapes)
+                         + ' and dtypes ' + str(input_dtypes))
+
+    if member_weights is None:
+        member_weights = [1.0] * len(models)
+
+    # one input shared by every member
+    inputs_ensemble = keras.Input(shape=models[0].input_shape[1:], dtype=models[0].inputs[0].dtype)
+    # every member's probabilities for the same batch
+    member_outputs = [renamed_copy(model, name + '_member' + str(number))(inputs_ensemble)
+                      for number, model in enumerate(models)]
+    # combine them into one prediction
+    outputs_ensemble = CombineMembers(member_weights, reduction, name='combine')(member_outputs)
+
+    model_ensemble = keras.Model(inputs = inputs_ensemble,
+                                 outputs = outputs_ensemble,
+                                 name = name)
+
+    return model_ensemble
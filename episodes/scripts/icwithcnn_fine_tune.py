@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Fine-tuning a trained model on newly labelled images instead of retraining
+from scratch on the whole dataset
+
+The new images are mixed with a replay sample of the old data, so the model
+keeps what it learnt before. The sample has the same number of images for every
+class and a fixed size, and it is kept in fit_outputs/ so the original dataset
+does not have to be loaded again. The convolutional layers can be frozen so
+only the dense layers learn. A regression guard compares the model before and
+after on a held-out set, and also with a fixed baseline model, so small drops
+cannot add up over many rounds of fine-tuning. New images that pass the guard
+are added to the replay sample, so later rounds replay them too.
+
+"""
+
+from tensorflow import keras # data and neural network
+import tensorflow as tf # input pipeline
+import numpy as np # arrays
+import hashlib # batch fingerprints
+import os # file paths
+import time # time to accuracy
+from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+# default location of the replay sample
+replay_path = 'fit_outputs/replay_buffer.npz'
+
+#%%
+
+# class-balanced replay sample of old training images
+# each class keeps a reservoir sample of at most max_per_class images, so every
+# image seen has the same chance of being kept however many are added
+# images are kept as uint8, with a fingerprint of every batch added by add_batch
+
+class ReplayBuffer:
+
+    def __init__(self, max_per_class, num_classes, image_shape=(32, 32, 3), seed=42):
+        self.max_per_class = max_per_class
+        self.num_classes = num_classes
+        self.images = np.zeros((num_classes, max_per_class) + tuple(image_shape), dtype=np.uint8)
+        self.counts = np.zeros(num_classes, dtype=np.int64)
+        self.batches = []
+        self.rng = np.random.default_rng(seed)
+
+    # add images of shape (N, 32, 32, 3) with class numbers of shape (N,) or (N, 1)
+    # can be called one chunk at a time over a dataset too large for memory
+    def add(self, images, labels):
+        labels = np.asarray(labels).ravel()
+        for image, label in zip(images, labels):
+            seen = self.counts[label]
+            if seen < self.max_per_class:
+                self.images[label, seen] = image
+            else:
+                slot = self.rng.integers(0, seen + 1)
+                if slot < self.max_per_class:
+                    self.images[label, slot] = image
+            self.counts[label] += 1
+
+    # add a batch of newly labelled images once
+    # returns False, without adding anything, if the same batch was added before
+    def add_batch(self, images, labels):
+        digest = hashlib.sha256()
+        digest.update(np.ascontiguousarray(images).tobytes())
+        digest.update(np.ascontiguousarray(labels).tobytes())
+        if digest.hexdigest() in self.batches:
+            return False
+        self.add(images, labels)
+        self.batches.append(digest.hexdigest())
+        return True
+
+    # the kept images and their class numbers
+    def sample(self):
+        kept = np.minimum(self.counts, self.max_per_class)
+        images = np.concatenate([self.images[label, :kept[label]] for label in range(self.num_classes)])
+        labels = np.concatenate([np.full(kept[label], label) for label in range(self.num_classes)])
+        return images, labels
+
+    def save(self, path=replay_path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, images=self.images, counts=self.counts, max_per_class=self.max_per_class,
+                 batches=np.array(self.batches, dtype=str))
+
+    @classmethod
+    def load(cls, path=replay_path):
+        with np.load(path) as saved:
+            buffer = cls(int(saved['max_per_class']), saved['images'].shape[0], saved['images'].shape[2:])
+            buffer.images[:] = saved['images']
+            buffer.counts[:] = saved['counts']
+            if 'batches' in saved.files:
+                buffer.batches = saved['batches'].tolist()
+        return buffer
+
+#%%
+
+# function to make a shuffled, batched dataset of uint8 images and class numbers
+# images are normalised one batch at a time inside the pipeline unless the
+# model takes uint8 images itself
+
+def fine_tune_dataset(images, labels, num_classes, batch_size=32, normalise=True, seed=42):
+
+    labels = keras.utils.to_categorical(np.asarray(labels).ravel(), num_classes)
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels))
+    dataset = dataset.shuffle(len(images), seed=seed, reshuffle_each_iteration=True).batch(batch_size)
+    if normalise:
+        dataset = dataset.map(lambda batch_images, batch_labels: (tf.cast(batch_images, tf.float32) / 255.0, batch_labels))
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+#%%
+
+# function to prepare a copy of a trained model for fine-tuning
+# with freeze_conv=True the Conv2D layers keep their weights and only the
+# other layers learn; a lower learning rate keeps the updates small
+
+def prepare_fine_tune_model(model, freeze_conv=True, learning_rate=1e-4):
+
+    model_tune = keras.models.clone_model(model)
+    model_tune.set_weights(model.get_weights())
+
+    for layer in model_tune.layers:
+        if freeze_conv and isinstance(layer, keras.layers.Conv2D):
+            layer.trainable = False
+
+    model_tune.compile(optimizer = keras.optimizers.Adam(learning_rate=learning_rate),
+                       loss = keras.losses.CategoricalCrossentropy(),
+                       metrics = keras.metrics.CategoricalAccuracy())
+
+    return model_tune
+
+#%%
+
+# callback that records the time from the start of fit until the validation
+# accuracy first reaches a target
+
+class TimeToAccuracy(keras.callbacks.Callback):
+
+    def __init__(self, target_accuracy, metric='val_categorical_accuracy'):
+        super().__init__()
+        self.target_accuracy = target_accuracy
+        self.metric = metric
+        self.seconds = None
+        self.epoch = None
+
+    def on_train_begin(self, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.seconds is None and (logs or {}).get(self.metric, 0) >= self.target_accuracy:
+            self.seconds = time.perf_counter() - self.start
+            self.epoch = epoch + 1
+
+#%%
+
+# function to get the accuracy of a model on a set of uint8 images
+
+def model_accuracy(model, images, labels, batch_size=256):
+
+    predictions = model.predict(model_input(model, images), batch_size=batch_size, verbose=0)
+
+    return float(np.mean(predictions.argmax(axis=1) == np.asarray(labels).ravel()))
+
+#%%
+
+# function to compare two models on a held-out set of uint8 images
+# baseline_model (optional) is a fixed model the new one must also be within tolerance
+# of, so repeated fine-tuning cannot lose up to tolerance on every round
+# returns the accuracies and whether the new model is within tolerance of the others
+
+def regression_check(model_before, model_after, images, labels, tolerance=0.01, batch_size=256, baseline_model=None):
+
+    accuracy_before = model_accuracy(model_before, images, labels, batch_size=batch_size)
+    accuracy_after = model_accuracy(model_after, images, labels, batch_size=batch_size)
+    result = {'accuracy_before': accuracy_before,
+              'accuracy_after': accuracy_after,
+              'passed': bool(accuracy_after >= accuracy_before - tolerance)}
+
+    if baseline_model is not None:
+        result['accuracy_baseline'] = model_accuracy(baseline_model, images, labels, batch_size=batch_size)
+        result['passed'] = result['passed'] and bool(accuracy_after >= result['accuracy_baseline'] - tolerance)
+
+    return result
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Export a trained model as a frozen inference graph, and run it without Keras
+
+keras.models.load_model rebuilds every Python layer object and the training
+machinery (optimizer, losses, metrics) even when all we want is predictions.
+The export here traces the model once in inference mode, turns its weights
+into constants and saves the resulting GraphDef. The runner imports that graph
+with plain TensorFlow and calls it, so no Keras layer is ever created.
+If tf2onnx is installed the same graph is also saved as ONNX, which
+onnxruntime can run without TensorFlow at all.
+
+TensorFlow is only imported by the functions that need it, so a process that
+only uses OnnxRunner never loads it.
+
+"""
+
+import numpy as np # arrays
+import json # signature file
+import os # file paths
+
+#%%
+
+# function to export a model as a frozen graph (and ONNX if tf2onnx is installed)
+# the graph has one input, 'images', with any batch size and the model's
+# image shape and dtype, and one output with the class probabilities
+# returns the signature that is saved next to the graph
+
+def export_frozen_graph(model, export_folder):
+
+    import tensorflow as tf
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    os.makedirs(export_folder, exist_ok=True)
+
+    input_spec = tf.TensorSpec(shape=(None,) + tuple(model.input_shape[1:]),
+                               dtype=model.inputs[0].dtype, name='images')
+
+    # trace the model once in inference mode (dropout off)
+    inference_function = tf.function(lambda images: model(images, training=False))
+    concrete_function = inference_function.get_concrete_function(input_spec)
+
+    # replace the weight variables with constants; constant folding and the other
+    # graph optimisations then run once when the runner first calls the graph
+    frozen_function = convert_variables_to_constants_v2(concrete_function)
+    graph_def = frozen_function.graph.as_graph_def()
+    tf.io.write_graph(graph_def, export_folder, 'frozen_graph.pb', as_text=False)
+
+    signature = {'model_name': model.name,
+                 'input_name': frozen_function.inputs[0].name,
+                 'input_dtype': input_spec.dtype.name,
+                 'input_shape': list(model.input_shape[1:]),
+                 'output_names': [output.name for output in frozen_function.outputs],
+                 'onnx': False}
+
+    # ONNX export is optional
+    try:
+        import tf2onnx
+        tf2onnx.convert.from_function(inference_function, input_signature=[input_spec],
+                                      output_path=os.path.join(export_folder, 'model.onnx'))
+        signature['onnx'] = True
+    except ImportError:
+        pass
+
+    with open(os.path.join(export_folder, 'signature.json'), 'w') as signature_file:
+        json.dump(signature, signature_file, indent=2)
+
+    return signature
+
+#%%
+
+# function to read the signature of an export
+
+def read_signature(export_folder):
+
+    with open(os.path.join(export_folder, 'signature.json')) as signature_file:
+        return json.load(signature_file)
+
+#%%
+
+# runs a frozen graph with plain TensorFlow
+
+class FrozenGraphRunner:
+
+    def __init__(self, export_folder):
+        import tensorflow as tf
+        self.tf = tf
+        self.signature = read_signature(export_folder)
+
+        graph_def = tf.compat.v1.GraphDef()
+        with open(os.path.join(export_folder, 'frozen_graph.pb'), 'rb') as graph_file:
+            graph_def.ParseFromString(graph_file.read())
+
+        # import the graph into a function and keep only the path from input to output
+        imported = tf.compat.v1.wrap_function(lambda: tf.compat.v1.import_graph_def(graph_def, name=''), [])
+        self.function = imported.prune(imported.graph.as_graph_element(self.signature['input_name']),
+                                       [imported.graph.as_graph_element(name) for name in self.signature['output_names']])
+
+    # predict in batches, returns one array of class probabilities
+    def predict(self, images, batch_size=256):
+        dtype = self.signature['input_dtype']
+        predictions = [self.function(self.tf.constant(np.asarray(images[batch_start:batch_start + batch_size], dtype=dtype)))[0].numpy()
+                       for batch_start in range(0, len(images), batch_size)]
+        return np.concatenate(predictions)
+
+#%%
+
+# runs the ONNX export with onnxruntime, without TensorFlow
+
+class OnnxRunner:
+
+    def __init__(self, export_folder):
+        import onnxruntime
+        self.signature = read_signature(export_folder)
+        self.session = onnxruntime.InferenceSession(os.path.join(export_folder, 'model.onnx'),
+                                                    providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    # predict in batches, returns one array of class probabilities
+    def predict(self, images, batch_size=256):
+        dtype = self.signature['input_dtype']
+        predictions = [self.session.run(None, {self.input_name: np.asarray(images[batch_start:batch_start + batch_size], dtype=dtype)})[0]
+                       for batch_start in range(0, len(images), batch_size)]
+        return np.concatenate(predictions)
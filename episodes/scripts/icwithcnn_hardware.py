@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Hardware probe and micro-benchmarks: what a machine has and how fast it
+actually trains and runs our models
+
+probe_environment reports the CPU model, cores, NUMA layout, SIMD features,
+oneDNN and TensorFlow threading settings and any accelerators.
+run_benchmarks times a matrix multiply (GEMM), Conv2D forward and backward
+passes at CIFAR-10 shapes and training steps of the intro model.
+The report is saved as fit_outputs/hardware_<host>.json so a scheduler can
+compare machines by their score and pick a batch size.
+
+"""
+
+import json # machine-readable report
+import os # cores, environment and /sys
+import platform # operating system and processor
+import socket # host name
+import time # benchmark timing
+
+# folder the reports are saved in
+report_folder = 'fit_outputs'
+
+# SIMD features that matter for TensorFlow CPU kernels
+simd_features = ['sse4_2', 'avx', 'avx2', 'fma', 'f16c', 'avx512f', 'avx512bw', 'avx512_vnni',
+                 'avx512_bf16', 'amx_tile', 'amx_bf16', 'amx_int8', 'asimd', 'sve']
+
+#%%
+
+# function to read /proc/cpuinfo (Linux) as a list of one dictionary per logical cpu
+
+def read_cpuinfo():
+
+    if not os.path.exists('/proc/cpuinfo'):
+        return []
+
+    cpus = [{}]
+    with open('/proc/cpuinfo') as cpuinfo_file:
+        for line in cpuinfo_file:
+            if not line.strip():
+                if cpus[-1]:
+                    cpus.append({})
+                continue
+            key, _, value = line.partition(':')
+            cpus[-1][key.strip()] = value.strip()
+
+    return [cpu for cpu in cpus if cpu]
+
+#%%
+
+# function to read the NUMA nodes and the cpus of each (Linux)
+
+def read_numa_nodes():
+
+    node_folder = '/sys/devices/system/node'
+    if not os.path.isdir(node_folder):
+        return {}
+
+    nodes = {}
+    for node in sorted(os.listdir(node_folder)):
+        cpulist_path = os.path.join(node_folder, node, 'cpulist')
+        if node.startswith('node') and os.path.exists(cpulist_path):
+            with open(cpulist_path) as cpulist_file:
+                nodes[node] = cpulist_file.read().strip()
+
+    return nodes
+
+#%%
+
+# function to describe the CPU, memory and operating system
+
+def probe_cpu():
+
+    cpus = read_cpuinfo()
+    flags = set(cpus[0].get('flags', cpus[0].get('Features', '')).split()) if cpus else set()
+
+    # physical cores are the distinct (socket, core) pairs
+    physical_cores = len(set((cpu.get('physical id'), cpu.get('core id')) for cpu in cpus
+                             if 'core id' in cpu)) or None
+
+    try:
+        usable_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        usable_cpus = os.cpu_count()
+
+    try:
+        memory_gb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024**3
+    except (AttributeError, ValueError):
+        memory_gb = None
+
+    return {'host': socket.gethostname(),
+            'os': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_model': cpus[0].get('model name', platform.processor()) if cpus else platform.processor(),
+            'logical_cpus': os.cpu_count(),
+            'physical_cores': physical_cores,
+            'usable_cpus': usable_cpus,
+            'numa_nodes': read_numa_nodes(),
+            'simd': [feature for feature in simd_features if feature in flags],
+            'memory_gb': memory_gb}
+
+#%%
+
+# function to describe the TensorFlow build, oneDNN, threading and accelerators
+
+def probe_tensorflow():
+
+    import tensorflow as tf
+
+    build_info = dict(tf.sysconfig.get_build_info())
+
+    # oneDNN is on by default for x86 Linux builds since TensorFlow 2.9 and can be
+    # switched with TF_ENABLE_ONEDNN_OPTS
+    onednn = os.environ.get('TF_ENABLE_ONEDNN_OPTS',
+                            'default on' if platform.system() == 'Linux' and platform.machine() in ('x86_64', 'AMD64') else 'default off')
+
+    accelerators = []
+    for device in tf.config.list_physical_devices():
+        if device.device_type == 'CPU':
+            continue
+        details = tf.config.experimental.get_device_details(device)
+        accelerators.append({'name': device.name,
+                             'type': device.device_type,
+                             'model': details.get('device_name'),
+                             'compute_capability': details.get('compute_capability')})
+
+    return {'tensorflow_version': tf.__version__,
+            'cuda_build': bool(build_info.get('is_cuda_build', False)),
+            'cuda_version': build_info.get('cuda_version'),
+            'cudnn_version': build_info.get('cudnn_version'),
+            'onednn': onednn,
+            # 0 means TensorFlow picks the number of threads itself
+            'intra_op_parallelism_threads': tf.config.threading.get_intra_op_parallelism_threads(),
+            'inter_op_parallelism_threads': tf.config.threading.get_inter_op_parallelism_threads(),
+            'omp_num_threads': os.environ.get('OMP_NUM_THREADS'),
+            'accelerators': accelerators}
+
+#%%
+
+# function to describe the whole environment
+
+def probe_environment():
+
+    environment = probe_cpu()
+    environment.update(probe_tensorflow())
+
+    return environment
+
+#%%
+
+# function to time a function, returns the median seconds of one call
+# the first calls trace the function so they are left out
+
+def time_calls(function, repeats=10, warmup=2):
+
+    for _ in range(warmup):
+        function()
+
+    seconds = []
+    for _ in range(repeats):
+        call_start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - call_start)
+
+    return sorted(seconds)[len(seconds) // 2]
+
+#%%
+
+# function to define the introduction model for the training benchmark
+
+def create_model_intro():
+
+    from tensorflow import keras
+
+    # Input layer of 32x32 images with three channels (RGB)
+    inputs_intro = keras.Input(shape=(32, 32, 3))
+    # Convolutional and pooling layers
+    x_intro = keras.layers.Conv2D(filters=16, kernel_size=(3,3), activation='relu')(inputs_intro)
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    x_intro = keras.layers.Conv2D(filters=32, kernel_size=(3,3), activation='relu')(x_intro)
+    x_intro = keras.layers.MaxPooling2D(pool_size=(2,2))(x_intro)
+    # Flatten layer and Dense layer with 64 neurons
+    x_intro = keras.layers.Flatten()(x_intro)
+    x_intro = keras.layers.Dense(units=64, activation='relu')(x_intro)
+    # Output layer with 10 units (one for each class) and softmax activation
+    outputs_intro = keras.layers.Dense(units=10, activation='softmax')(x_intro)
+
+    model_intro = keras.Model(inputs = inputs_intro,
+                              outputs = outputs_intro,
+                              name = "cifar_model_intro")
+
+    return model_intro
+
+#%%
+
+# function to run the micro-benchmarks, returns one dictionary of results
+
+def run_benchmarks(gemm_size=1024, conv_batch_size=128, train_batch_sizes=(32, 128, 512), repeats=10):
+
+    import tensorflow as tf
+    from tensorflow import keras
+    import numpy as np
+
+    results = {}
+
+    # GEMM: float32 matrix multiply, 2 * n^3 floating point operations
+    a = tf.random.uniform((gemm_size, gemm_size))
+    b = tf.random.uniform((gemm_size, gemm_size))
+    matmul = tf.function(lambda: tf.matmul(a, b))
+    seconds = time_calls(lambda: matmul().numpy(), repeats)
+    results['gemm_gflops'] = 2 * gemm_size**3 / seconds / 1e9
+
+    # Conv2D at the shapes of the intro model's two convolutional layers
+    for name, input_shape, filters in [('conv1', (32, 32, 3), 16), ('conv2', (15, 15, 16), 32)]:
+        images = tf.random.uniform((conv_batch_size,) + input_shape)
+        kernel = tf.Variable(tf.random.uniform((3, 3, input_shape[-1], filters)))
+        output_size = (input_shape[0] - 2) * (input_shape[1] - 2)
+        flops = 2 * conv_batch_size * output_size * 9 * input_shape[-1] * filters
+
+        forward = tf.function(lambda: tf.nn.conv2d(images, kernel, strides=1, padding='VALID'))
+
+        @tf.function
+        def backward():
+            with tf.GradientTape() as tape:
+                tape.watch(images)
+                loss = tf.reduce_sum(tf.nn.conv2d(images, kernel, strides=1, padding='VALID'))
+            # the forward pass inside the tape, then the gradients for the input
+            # and the kernel, each about the forward work: about 3 * flops in all
+            return tape.gradient(loss, [images, kernel])
+
+        forward_seconds = time_calls(lambda: forward().numpy(), repeats)
+        backward_seconds = time_calls(lambda: [gradient.numpy() for gradient in backward()], repeats)
+        results[name + '_forward_gflops'] = flops / forward_seconds / 1e9
+        results[name + '_forward_images_per_sec'] = conv_batch_size / forward_seconds
+        results[name + '_backward_gflops'] = 3 * flops / backward_seconds / 1e9
+        results[name + '_backward_images_per_sec'] = conv_batch_size / backward_seconds
+
+    # training steps of the intro model at several batch sizes
+    rng = np.random.default_rng(42)
+    train_images_per_sec = {}
+    for batch_size in train_batch_sizes:
+        keras.backend.clear_session()
+        model = create_model_intro()
+        model.compile(optimizer = keras.optimizers.Adam(),
+                      loss = keras.losses.CategoricalCrossentropy(),
+                      metrics = keras.metrics.CategoricalAccuracy())
+        images = rng.random((batch_size, 32, 32, 3), dtype=np.float32)
+        labels = keras.utils.to_categorical(rng.integers(0, 10, batch_size), 10)
+        seconds = time_calls(lambda: model.train_on_batch(images, labels), repeats)
+        train_images_per_sec[str(batch_size)] = batch_size / seconds
+
+    results['intro_train_images_per_sec'] = train_images_per_sec
+
+    return results
+
+#%%
+
+# function to probe the environment, run the benchmarks and save the report
+# the score is the intro model's training images per second at its fastest
+# batch size, the number a scheduler compares machines by
+
+def hardware_report(save=True, **benchmark_kwargs):
+
+    environment = probe_environment()
+    benchmarks = run_benchmarks(**benchmark_kwargs)
+
+    train_images_per_sec = benchmarks['intro_train_images_per_sec']
+    best_batch_size = max(train_images_per_sec, key=train_images_per_sec.get)
+
+    report = {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'environment': environment,
+              'benchmarks': benchmarks,
+              'score': {'intro_train_images_per_sec': train_images_per_sec[best_batch_size],
+                        'best_train_batch_size': int(best_batch_size),
+                        'gemm_gflops': benchmarks['gemm_gflops']}}
+
+    if save:
+        os.makedirs(report_folder, exist_ok=True)
+        report_path = os.path.join(report_folder, 'hardware_' + environment['host'] + '.json')
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print('Saved', report_path)
+
+    return report
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Incremental cache of preprocessed images: every image file in a folder decoded
+and resized to 32x32x3 uint8 once, and kept in one contiguous file that
+training scripts open as a memmap
+
+Files are keyed by their path, size and modification time. Each update
+decodes only new and changed files, and removes deleted ones by moving the
+last rows into their place. A rerun over an unchanged folder only has to list
+the folder and compare.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor # parallel decoding
+from keras.utils import img_to_array # image processing
+from keras.utils import load_img # image processing
+import numpy as np # arrays
+import os # walk the folder
+import time # update timing
+
+# image file types to cache
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+#%%
+
+# function to list the image files in a folder and its sub folders
+# returns {relative path: (size, modification time in ns)}
+
+def scan_folder(folder):
+
+    files = {}
+    folders = [folder]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.name.lower().endswith(image_extensions):
+                    stat = entry.stat()
+                    files[os.path.relpath(entry.path, folder)] = (stat.st_size, stat.st_mtime_ns)
+
+    return files
+
+#%%
+
+class ImageFolderCache:
+
+    # folder: image folder to cache
+    # cache_folder: where the image file (images.u8) and its index (index.npz) are kept
+    # image_size: (height, width) every image is resized to
+
+    def __init__(self, folder, cache_folder, image_size=(32, 32), num_workers=None):
+        self.folder = folder
+        self.cache_folder = cache_folder
+        self.image_shape = tuple(image_size) + (3,)
+        self.row_bytes = int(np.prod(self.image_shape))
+        self.num_workers = num_workers or os.cpu_count()
+        self.images_path = os.path.join(cache_folder, 'images.u8')
+        self.index_path = os.path.join(cache_folder, 'index.npz')
+        os.makedirs(cache_folder, exist_ok=True)
+
+    # read the index: the path, size and modification time of every row, and
+    # the files that could not be decoded (so they are not tried again unless they change)
+    def read_index(self):
+        if not os.path.exists(self.index_path) or not os.path.exists(self.images_path):
+            return None
+
+        with np.load(self.index_path) as index:
+            # an update that stopped part way leaves the index marked incomplete
+            if not index['complete'] or tuple(index['image_shape']) != self.image_shape:
+                return None
+            return {'paths': index['paths'].tolist(),
+                    'keys': list(zip(index['sizes'].tolist(), index['mtimes'].tolist())),
+                    'failed': dict(zip(index['failed_paths'].tolist(),
+                                       zip(index['failed_sizes'].tolist(), index['failed_mtimes'].tolist())))}
+
+    # write the index in one step, so readers never see half a file
+    def write_index(self, rows, failed, complete):
+        temp_path = self.index_path + '.tmp.npz'
+        np.savez(temp_path,
+                 paths=np.array(rows['paths'], dtype=str),
+                 sizes=np.array([key[0] for key in rows['keys']], dtype=np.int64),
+                 mtimes=np.array([key[1] for key in rows['keys']], dtype=np.int64),
+                 failed_paths=np.array(list(failed), dtype=str),
+                 failed_sizes=np.array([key[0] for key in failed.values()], dtype=np.int64),
+                 failed_mtimes=np.array([key[1] for key in failed.values()], dtype=np.int64),
+                 image_shape=np.array(self.image_shape),
+                 complete=np.array(complete))
+        os.replace(temp_path, self.index_path)
+
+    # decode and resize one file, returns None if it cannot be read
+    def decode(self, path):
+        try:
+            image = load_img(os.path.join(self.folder, path), target_size=self.image_shape[:2])
+            return img_to_array(image, dtype='uint8')
+        except Exception:
+            return None
+
+    # bring the cache up to date with the folder
+    # returns the images as a read-only memmap, the relative path of each row
+    # and a summary of the work done
+    # memmaps returned by an earlier update are invalid afterwards, as rows can move
+    # and the file can be resized; delete them first (on Windows the file cannot be
+    # resized while it is still mapped)
+    def update(self):
+        update_start = time.perf_counter()
+        files = scan_folder(self.folder)
+
+        index = self.read_index()
+        if index is None:
+            # no usable cache: start from an empty one
+            index = {'paths': [], 'keys': [], 'failed': {}}
+            open(self.images_path, 'wb').close()
+
+        rows = {'paths': index['paths'], 'keys': index['keys']}
+        row_of_path = {path: row for row, path in enumerate(rows['paths'])}
+
+        deleted_rows = [row for row, path in enumerate(rows['paths']) if path not in files]
+        changed_rows = [row for row, path in enumerate(rows['paths'])
+                        if path in files and files[path] != rows['keys'][row]]
+        new_paths = [path for path in files if path not in row_of_path
+                     and index['failed'].get(path) != files[path]]
+        failed = {path: key for path, key in index['failed'].items() if files.get(path) == key}
+
+        summary = {'files': len(files), 'new': len(new_paths), 'changed': len(changed_rows),
+                   'deleted': len(deleted_rows), 'unreadable': 0}
+
+        if deleted_rows or changed_rows or new_paths:
+            # mark the cache as being updated until the end
+            self.write_index(rows, failed, complete=False)
+            self.apply_changes(rows, files, deleted_rows, changed_rows, new_paths, failed)
+            self.write_index(rows, failed, complete=True)
+
+        summary['unreadable'] = len(failed)
+        summary['seconds'] = time.perf_counter() - update_start
+
+        return self.open_images(len(rows['paths'])), np.array(rows['paths'], dtype=str), summary
+
+    # remove, re-decode and add rows in place
+    def apply_changes(self, rows, files, deleted_rows, changed_rows, new_paths, failed):
+        # changed files keep their path, but their row can move when others are removed
+        changed_paths = set(rows['paths'][row] for row in changed_rows)
+
+        if deleted_rows:
+            self.remove_rows(rows, deleted_rows)
+
+        # grow the file for the new rows
+        num_kept = len(rows['paths'])
+        os.truncate(self.images_path, (num_kept + len(new_paths)) * self.row_bytes)
+
+        targets = [(row, path) for row, path in enumerate(rows['paths']) if path in changed_paths] + \
+                  [(num_kept + number, path) for number, path in enumerate(new_paths)]
+        rows['paths'].extend(new_paths)
+        rows['keys'].extend(files[path] for path in new_paths)
+
+        # decode in parallel and write each image straight into its row
+        images = self.open_images(len(rows['paths']), mode='r+')
+        unreadable_rows = []
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            for (row, path), image in zip(targets, executor.map(self.decode, [path for _, path in targets])):
+                rows['keys'][row] = files[path]
+                if image is None:
+                    unreadable_rows.append(row)
+                    failed[path] = files[path]
+                else:
+                    images[row] = image
+        if len(images):
+            images.flush()
+        del images
+
+        # drop the rows of files that could not be decoded
+        if unreadable_rows:
+            self.remove_rows(rows, unreadable_rows)
+
+    # remove rows by moving the last rows into their place and shrinking the file
+    def remove_rows(self, rows, removed_rows):
+        num_rows = len(rows['paths'])
+        num_kept = num_rows - len(removed_rows)
+        images = self.open_images(num_rows, mode='r+')
+
+        # fill each hole with one of the last rows
+        removed = set(removed_rows)
+        holes = [row for row in removed_rows if row < num_kept]
+        movers = [row for row in range(num_kept, num_rows) if row not in removed]
+        for hole, mover in zip(holes, movers):
+            images[hole] = images[mover]
+            rows['paths'][hole] = rows['paths'][mover]
+            rows['keys'][hole] = rows['keys'][mover]
+        del rows['paths'][num_kept:], rows['keys'][num_kept:]
+        images.flush()
+        del images
+
+        os.truncate(self.images_path, num_kept * self.row_bytes)
+
+    # open the cached images as a memmap of shape (rows, height, width, 3)
+    def open_images(self, num_rows, mode='r'):
+        if num_rows == 0:
+            return np.zeros((0,) + self.image_shape, dtype=np.uint8)
+        return np.memmap(self.images_path, dtype=np.uint8, mode=mode, shape=(num_rows,) + self.image_shape)
+
+#%%
+
+# function to get the class of each cached image from its first sub folder,
+# e.g. cat/0001.jpg has the class 'cat'
+# returns class numbers in the order of class_names
+
+def labels_from_folders(paths, class_names):
+
+    class_numbers = {class_name: number for number, class_name in enumerate(class_names)}
+
+    return np.array([class_numbers[path.replace('\\', '/').split('/')[0]] for path in paths])
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Peak memory tracking and memory budgets for named stages of a script
+(load, prepare, build, fit per epoch, evaluate, predict)
+
+A background thread samples the resident set size (RSS) of the process while a
+stage runs, and TensorFlow's own allocator peak is read for each GPU. When a
+budget is set (in MB, or with the CNN_MEMORY_BUDGET_MB environment variable)
+the script stops with a MemoryBudgetExceeded error naming the stage, instead of
+being killed by the operating system with no explanation.
+
+"""
+
+from contextlib import contextmanager # stage blocks
+import os # environment variable and /proc
+import sys # platform
+import threading # background sampling
+import time # stage timing
+
+#%%
+
+# error raised when a stage goes over the memory budget
+
+class MemoryBudgetExceeded(MemoryError):
+    pass
+
+#%%
+
+# function to get the current resident set size of this process in bytes
+
+def current_rss_bytes():
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    # Linux without psutil: second field of /proc/self/statm is resident pages
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    # otherwise fall back to the peak so far
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+#%%
+
+# functions to read and reset the TensorFlow allocator peak of every GPU
+# TensorFlow does not report allocator statistics for the CPU, so this is None without a GPU
+
+def tensorflow_devices():
+
+    import tensorflow as tf
+    return [device.name for device in tf.config.list_logical_devices('GPU')]
+
+def reset_tensorflow_peak():
+
+    import tensorflow as tf
+    for device in tensorflow_devices():
+        tf.config.experimental.reset_memory_stats(device)
+
+def tensorflow_peak_bytes():
+
+    import tensorflow as tf
+    devices = tensorflow_devices()
+    if not devices:
+        return None
+    return sum(tf.config.experimental.get_memory_info(device)['peak'] for device in devices)
+
+#%%
+
+class MemoryTracker:
+
+    # budget_mb: most RSS allowed in MB, or None to only record
+    # sample_seconds: how often the background thread reads the RSS
+
+    def __init__(self, budget_mb=None, sample_seconds=0.05):
+        if budget_mb is None and os.environ.get('CNN_MEMORY_BUDGET_MB'):
+            budget_mb = float(os.environ['CNN_MEMORY_BUDGET_MB'])
+        self.budget_bytes = None if budget_mb is None else budget_mb * 1024**2
+        self.sample_seconds = sample_seconds
+
+        self.rows = []
+        self.open_stages = []
+        self.lock = threading.Lock()
+        self.exceeded = None
+        self.running = True
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    # background thread: update the peak of every open stage and note the first budget breach
+    def sample(self):
+        while self.running:
+            rss = current_rss_bytes()
+            with self.lock:
+                for stage in self.open_stages:
+                    stage['peak_rss'] = max(stage['peak_rss'], rss)
+                if self.budget_bytes is not None and rss > self.budget_bytes and self.exceeded is None and self.open_stages:
+                    self.exceeded = (self.open_stages[-1]['stage'], rss)
+            time.sleep(self.sample_seconds)
+
+    # note the TensorFlow peak is reset at the start of every stage, so for
+    # nested stages (fit and its epochs) it covers the innermost stage
+    def start_stage(self, name):
+        reset_tensorflow_peak()
+        rss = current_rss_bytes()
+        with self.lock:
+            self.open_stages.append({'stage': name, 'start_rss': rss, 'peak_rss': rss, 'start_time': time.perf_counter()})
+
+    def end_stage(self):
+        rss = current_rss_bytes()
+        with self.lock:
+            stage = self.open_stages.pop()
+        stage['peak_rss'] = max(stage['peak_rss'], rss)
+        tf_peak = tensorflow_peak_bytes()
+        self.rows.append({'stage': stage['stage'],
+                          'seconds': time.perf_counter() - stage['start_time'],
+                          'start_rss_mb': stage['start_rss'] / 1024**2,
+                          'end_rss_mb': rss / 1024**2,
+                          'peak_rss_mb': stage['peak_rss'] / 1024**2,
+                          'tf_peak_mb': None if tf_peak is None else tf_peak / 1024**2})
+        self.check()
+
+    # block of code measured as a named stage
+    @contextmanager
+    def stage(self, name):
+        self.start_stage(name)
+        body_failed = False
+        try:
+            yield self
+        except BaseException:
+            body_failed = True
+            raise
+        finally:
+            # end the stage even if it failed, but keep the original error
+            try:
+                self.end_stage()
+            except MemoryBudgetExceeded:
+                if not body_failed:
+                    raise
+
+    # raise if the budget has been exceeded since the last check
+    def check(self):
+        if self.budget_bytes is None:
+            return
+        rss = current_rss_bytes()
+        if self.exceeded is None and rss > self.budget_bytes:
+            if self.open_stages:
+                stage = self.open_stages[-1]['stage']
+            elif self.rows:
+                stage = self.rows[-1]['stage']
+            else:
+                stage = 'before first stage'
+            self.exceeded = (stage, rss)
+        if self.exceeded is not None:
+            stage, rss = self.exceeded
+            self.print_table()
+            raise MemoryBudgetExceeded('Stage "%s" used %.0f MB, over the memory budget of %.0f MB'
+                                       % (stage, rss / 1024**2, self.budget_bytes / 1024**2))
+
+    # raise before allocating nbytes if that would go over the budget
+    def require(self, nbytes, what):
+        if self.budget_bytes is None:
+            return
+        expected = current_rss_bytes() + nbytes
+        if expected > self.budget_bytes:
+            stage = self.open_stages[-1]['stage'] if self.open_stages else 'before first stage'
+            self.print_table()
+            raise MemoryBudgetExceeded('Stage "%s" needs about %.0f MB more for %s, which would reach %.0f MB, over the memory budget of %.0f MB'
+                                       % (stage, nbytes / 1024**2, what, expected / 1024**2, self.budget_bytes / 1024**2))
+
+    # keras callback that records each epoch as a stage and checks the budget after every batch
+    def callback(self):
+        from tensorflow import keras
+
+        tracker = self
+
+        class MemoryTrackerCallback(keras.callbacks.Callback):
+            def on_epoch_begin(self, epoch, logs=None):
+                tracker.start_stage('fit epoch ' + str(epoch + 1))
+            def on_epoch_end(self, epoch, logs=None):
+                tracker.end_stage()
+            def on_train_batch_end(self, batch, logs=None):
+                tracker.check()
+            def on_test_batch_end(self, batch, logs=None):
+                tracker.check()
+            def on_predict_batch_end(self, batch, logs=None):
+                tracker.check()
+
+        return MemoryTrackerCallback()
+
+    def table(self):
+        import pandas as pd
+        return pd.DataFrame(self.rows).round(1)
+
+    def print_table(self):
+        print()
+        if self.rows:
+            print(self.table().to_string(index=False))
+        if self.budget_bytes is not None:
+            print('Memory budget:', round(self.budget_bytes / 1024**2), 'MB')
+
+    def stop(self):
+        self.running = False
+        self.sampler.join()
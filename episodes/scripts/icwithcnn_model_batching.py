@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Model-batched training: train several variants of one architecture (e.g. one
+per dropout rate) side by side in a single Keras model
+
+Every variant is a complete copy of the model with its own weights, fed from
+one shared input and with its own output, loss and metrics. One fit over the
+data trains all of them: the images are read, batched and copied to the device
+once per step instead of once per variant, and the independent branches run
+in the same step. The optimizer (e.g. Adam) updates each weight from its own
+gradient only, and each variant's gradient comes only from its own loss, so
+each variant trains as if it had been fitted on its own.
+
+"""
+
+from tensorflow import keras # data and neural network
+
+#%%
+
+# function to make the name of a variant from the swept setting, e.g. dropout_0_15
+
+def variant_name(prefix, setting):
+
+    return prefix + '_' + str(setting).replace('.', '_').replace('-', 'm')
+
+#%%
+
+# function to build one model holding a variant for every setting
+# create_model(setting, name) returns an (uncompiled) model called name
+# returns the batched model and the variant names in the order of the settings
+
+def create_model_batched(create_model, settings, prefix, input_shape):
+
+    names = [variant_name(prefix, setting) for setting in settings]
+
+    # one input shared by every variant
+    inputs_batched = keras.Input(shape=input_shape)
+    # each variant is a whole model used as a layer, so its output has the variant's name
+    outputs_batched = [create_model(setting, name)(inputs_batched) for setting, name in zip(settings, names)]
+
+    model_batched = keras.Model(inputs = inputs_batched,
+                                outputs = outputs_batched,
+                                name = prefix + "_batched")
+
+    return model_batched, names
+
+#%%
+
+# function to compile a batched model with the same loss and metric on every variant
+
+def compile_batched(model_batched, names):
+
+    model_batched.compile(optimizer = keras.optimizers.Adam(),
+                          loss = {name: keras.losses.CategoricalCrossentropy() for name in names},
+                          metrics = {name: [keras.metrics.CategoricalAccuracy()] for name in names})
+
+#%%
+
+# function to give every variant the same labels without copying them
+
+def batched_labels(labels, names):
+
+    return {name: labels for name in names}
+
+#%%
+
+# function to split the history of a batched fit into one history per variant
+# each has the same keys as history.history of a single fit (loss,
+# categorical_accuracy, val_loss, val_categorical_accuracy)
+
+def split_history(history, names):
+
+    histories = {name: {} for name in names}
+
+    for key, values in history.history.items():
+        for name in names:
+            if key.startswith(name + '_'):
+                histories[name][key[len(name) + 1:]] = list(values)
+            elif key.startswith('val_' + name + '_'):
+                histories[name]['val_' + key[len(name) + 5:]] = list(values)
+
+    return histories
+
+#%%
+
+# function to get the trained model of one variant, which can be saved,
+# evaluated or used for predictions on its own
+
+def get_variant(model_batched, name):
+
+    return model_batched.get_layer(name)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Prediction cache that sits in front of model.predict so repeated images are
+only run through the model once
+
+Images are looked up by a hash of their 32x32x3 uint8 pixels and of the model
+weights, first in an in-memory LRU cache with a byte budget and then,
+optionally, in a folder on disk.
+
+"""
+
+from collections import OrderedDict # least recently used order
+import hashlib # content hashes
+import os # file paths
+import time # model timing
+import numpy as np # arrays
+
+#%%
+
+# function to create an identity for a model from its name and weights
+# two models only share cached predictions if their weights are identical
+
+def model_identity(model):
+
+    digest = hashlib.sha256(model.name.encode())
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+
+    return digest.hexdigest()
+
+#%%
+
+class PredictionCache:
+
+    # model: trained keras model
+    # memory_budget_bytes: most bytes of predictions kept in memory
+    # disk_folder: folder for the on-disk cache, or None for memory only
+    # normalise: divide the uint8 pixels by 255 before predicting; None (the
+    #            default) does so unless the model takes uint8 images
+
+    def __init__(self, model, memory_budget_bytes=64 * 1024**2, disk_folder=None, batch_size=32, normalise=None):
+        self.model = model
+        self.model_id = model_identity(model)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.disk_folder = disk_folder
+        self.batch_size = batch_size
+        self.normalise = model.inputs[0].dtype != 'uint8' if normalise is None else normalise
+
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.model_images = 0
+        self.model_seconds = 0.0
+
+        if disk_folder is not None:
+            os.makedirs(disk_folder, exist_ok=True)
+
+    # hash of the model identity and the image pixels
+    def key(self, image):
+        digest = hashlib.sha256(self.model_id.encode())
+        digest.update(str(image.shape).encode())
+        digest.update(np.ascontiguousarray(image).tobytes())
+        return digest.hexdigest()
+
+    def disk_path(self, key):
+        return os.path.join(self.disk_folder, key[:2], key + '.npy')
+
+    # look a key up in memory and then on disk, returns None on a miss
+    def lookup(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return self.memory[key]
+
+        if self.disk_folder is not None and os.path.exists(self.disk_path(key)):
+            prediction = np.load(self.disk_path(key))
+            self.store_in_memory(key, prediction)
+            self.disk_hits += 1
+            return prediction
+
+        self.misses += 1
+        return None
+
+    # add a prediction to memory, dropping the least recently used ones over budget
+    def store_in_memory(self, key, prediction):
+        if key in self.memory:
+            return
+        self.memory[key] = prediction
+        self.memory_bytes += prediction.nbytes
+        while self.memory_bytes > self.memory_budget_bytes and self.memory:
+            _, dropped = self.memory.popitem(last=False)
+            self.memory_bytes -= dropped.nbytes
+
+    def store(self, key, prediction):
+        self.store_in_memory(key, prediction)
+
+        if self.disk_folder is not None and not os.path.exists(self.disk_path(key)):
+            os.makedirs(os.path.dirname(self.disk_path(key)), exist_ok=True)
+            # write to a temporary file first so readers never see half a file
+            # the name includes the process id, so two processes caching the same
+            # image at once do not write to the same temporary file
+            temp_path = self.disk_path(key) + '.' + str(os.getpid()) + '.tmp'
+            with open(temp_path, 'wb') as prediction_file:
+                np.save(prediction_file, prediction)
+            os.replace(temp_path, self.disk_path(key))
+
+    # predict a batch of uint8 images of shape (N, 32, 32, 3)
+    # only the images not in the cache are run through the model and the
+    # results are returned in the same order as the images
+    def predict(self, images):
+        images = np.asarray(images)
+        if images.dtype != np.uint8:
+            raise ValueError('PredictionCache expects uint8 images, got ' + str(images.dtype))
+
+        keys = [self.key(image) for image in images]
+        predictions = [self.lookup(key) for key in keys]
+
+        # run the model once for each distinct missing image
+        missing = OrderedDict()
+        for position, (key, prediction) in enumerate(zip(keys, predictions)):
+            if prediction is None and key not in missing:
+                missing[key] = position
+
+        if missing:
+            model_inputs = images[list(missing.values())]
+            if self.normalise:
+                model_inputs = model_inputs.astype(np.float32) / 255.0
+
+            model_start = time.perf_counter()
+            model_predictions = self.model.predict(model_inputs, batch_size=self.batch_size, verbose=0)
+            self.model_seconds += time.perf_counter() - model_start
+            self.model_images += len(missing)
+
+            computed = {}
+            for key, prediction in zip(missing, model_predictions):
+                # copy the row, a view would keep the whole batch array alive
+                # while memory_bytes only counts the row
+                computed[key] = prediction.copy()
+                self.store(key, computed[key])
+
+            predictions = [computed[key] if prediction is None else prediction
+                           for key, prediction in zip(keys, predictions)]
+
+        return np.stack(predictions)
+
+    # hit and miss counts and an estimate of the model time the hits saved
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        seconds_per_image = self.model_seconds / self.model_images if self.model_images else 0.0
+        return {'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_bytes,
+                'model_images': self.model_images,
+                'model_seconds': self.model_seconds,
+                'est_seconds_saved': (lookups - self.model_images) * seconds_per_image}
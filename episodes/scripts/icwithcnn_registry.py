@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Local model registry: versioned model files with metadata, and aliases such as
+'latest' and 'best' instead of hard-coded paths in fit_outputs/
+
+fit_outputs/registry/registry.json lists every version of every model with its
+validation accuracy, number of parameters, input shape and a SHA-256 checksum
+of the file. Loaded models are kept in memory, so asking for the same version
+again does not read the file a second time.
+
+"""
+
+from tensorflow import keras # load and save models
+import hashlib # file checksums
+import json # registry index
+import os # file paths and process checks
+import socket # lock owner host
+import time # registration time
+
+# folder the registry and its model files are kept in
+registry_folder = 'fit_outputs/registry'
+
+# models already loaded in this process, keyed by (path, checksum)
+loaded_models = {}
+
+# the registry index and its modification time, read again only when the file changes
+cached_index = {'mtime': None, 'index': None}
+
+#%%
+
+# function to get the path of the registry index
+
+def registry_index_path():
+
+    return os.path.join(registry_folder, 'registry.json')
+
+#%%
+
+# function to read the registry index
+
+def read_registry():
+
+    if not os.path.exists(registry_index_path()):
+        return {'models': {}}
+
+    mtime = os.path.getmtime(registry_index_path())
+    if cached_index['mtime'] != mtime:
+        with open(registry_index_path()) as index_file:
+            cached_index['index'] = json.load(index_file)
+        cached_index['mtime'] = mtime
+
+    return cached_index['index']
+
+#%%
+
+# function to write the registry index in one step, so readers never see half a file
+
+def write_registry(index):
+
+    temp_path = registry_index_path() + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_path, 'w') as index_file:
+        json.dump(index, index_file, indent=2)
+    os.replace(temp_path, registry_index_path())
+
+#%%
+
+# function to check whether a process on this machine is still running
+# returns None when it cannot tell (no psutil on Windows, where os.kill would end the process)
+
+def process_alive(pid):
+
+    try:
+        import psutil
+        return psutil.pid_exists(pid)
+    except ImportError:
+        pass
+
+    if os.name != 'posix':
+        return None
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        return True
+
+    return True
+
+#%%
+
+# function to hold a lock file while the registry index is updated
+# stops two sweep workers registering at the same moment from losing a version
+# the lock file holds the process id, host and time of its owner, so a lock left
+# by a process that was killed is broken once that process is gone, or once the
+# lock is older than stale_seconds
+
+class RegistryLock:
+
+    def __init__(self, timeout=60, stale_seconds=600):
+        self.path = registry_index_path() + '.lock'
+        self.timeout = timeout
+        self.stale_seconds = stale_seconds
+
+    def __enter__(self):
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                self.handle = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self.break_stale_lock():
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError('Registry is locked by another process: ' + self.path +
+                                       ' (' + str(self.read_owner()) + ')')
+                time.sleep(0.1)
+                continue
+
+            self.owner = {'pid': os.getpid(), 'host': socket.gethostname(), 'created': time.time()}
+            os.write(self.handle, json.dumps(self.owner).encode())
+            os.fsync(self.handle)
+            return self
+
+    def __exit__(self, *exc_info):
+        os.close(self.handle)
+        # only remove the lock if it is still ours and was not broken as stale
+        if self.read_owner() == self.owner:
+            os.remove(self.path)
+
+    # the owner written in the lock file, or None if it is gone or not written yet
+    def read_owner(self):
+        try:
+            with open(self.path) as lock_file:
+                return json.loads(lock_file.read())
+        except (OSError, ValueError):
+            return None
+
+    # remove the lock if its owner process has ended or it is older than stale_seconds
+    # returns True when a lock was removed
+    def break_stale_lock(self):
+        owner = self.read_owner()
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+        except OSError:
+            # released in the meantime
+            return True
+
+        if owner is None:
+            # the owner may not have written its details yet, so only the age counts
+            stale = age > self.stale_seconds
+        else:
+            stale = time.time() - owner['created'] > self.stale_seconds
+            if owner['host'] == socket.gethostname() and process_alive(owner['pid']) is False:
+                stale = True
+        if not stale:
+            return False
+
+        # move the lock aside first, so two waiters cannot both break it, and put
+        # it back if another process took the lock after it was read
+        aside_path = self.path + '.' + str(os.getpid()) + '.stale'
+        try:
+            os.rename(self.path, aside_path)
+        except OSError:
+            return True
+        try:
+            with open(aside_path) as lock_file:
+                moved_owner = json.loads(lock_file.read())
+        except ValueError:
+            moved_owner = None
+        if moved_owner != owner:
+            try:
+                os.link(aside_path, self.path)
+            except OSError:
+                pass
+            os.remove(aside_path)
+            return False
+
+        os.remove(aside_path)
+        print('Removed a stale registry lock:', owner)
+        return True
+
+#%%
+
+# function to compute the SHA-256 checksum of a file
+
+def file_checksum(path):
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as model_file:
+        for chunk in iter(lambda: model_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+#%%
+
+# function to save a model as a new version in the registry
+# the model name (e.g. cifar_model_dropout) is used unless another name is given
+# returns the metadata of the new version
+
+def register_model(model, val_accuracy=None, name=None, notes=''):
+
+    name = name or model.name
+    os.makedirs(os.path.join(registry_folder, name), exist_ok=True)
+
+    with RegistryLock():
+        # read the index from disk, not the cached copy, while holding the lock
+        cached_index['mtime'] = None
+        index = read_registry()
+        entry = index['models'].setdefault(name, {'versions': [], 'aliases': {}})
+        version = len(entry['versions']) + 1
+
+        # save the model file first; it is only used once it is in the index
+        path = os.path.join(registry_folder, name, 'v%04d.keras' % version)
+        model.save(path)
+
+        metadata = {'version': version,
+                    'path': path,
+                    'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'val_accuracy': None if val_accuracy is None else float(val_accuracy),
+                    'params': int(model.count_params()),
+                    'input_shape': list(model.input_shape[1:]),
+                    'input_dtype': str(getattr(model.inputs[0].dtype, 'name', model.inputs[0].dtype)),
+                    'sha256': file_checksum(path),
+                    'notes': notes}
+        entry['versions'].append(metadata)
+
+        # 'latest' is the newest version, 'best' the one with the highest validation accuracy
+        entry['aliases']['latest'] = version
+        scored = [item for item in entry['versions'] if item['val_accuracy'] is not None]
+        if scored:
+            entry['aliases']['best'] = max(scored, key=lambda item: item['val_accuracy'])['version']
+
+        write_registry(index)
+
+    print('Registered', name, 'version', version, 'at', path)
+
+    return metadata
+
+#%%
+
+# function to find the metadata of a model version
+# ref is an alias ('best', 'latest') or a version number
+
+def resolve_model(name, ref='best'):
+
+    index = read_registry()
+    if name not in index['models']:
+        raise KeyError('No model called ' + name + ' in the registry ' + registry_index_path())
+
+    entry = index['models'][name]
+    version = entry['aliases'].get(ref) if isinstance(ref, str) else ref
+    if version is None:
+        raise KeyError('Model ' + name + ' has no alias ' + str(ref) + '; aliases are ' + str(entry['aliases']))
+
+    return entry['versions'][version - 1]
+
+#%%
+
+# function to load a model version, reusing it if it has already been loaded
+# the file checksum is checked on first load so a changed or stale file is never used
+
+def load_registered_model(name, ref='best'):
+
+    metadata = resolve_model(name, ref)
+    key = (metadata['path'], metadata['sha256'])
+
+    if key not in loaded_models:
+        if file_checksum(metadata['path']) != metadata['sha256']:
+            raise ValueError(metadata['path'] + ' does not match its registry checksum, it has been changed since it was registered')
+        loaded_models[key] = keras.models.load_model(metadata['path'])
+
+    return loaded_models[key]
+
+#%%
+
+# function to list every version of a model as a dataframe
+
+def list_model_versions(name):
+
+    import pandas as pd
+
+    return pd.DataFrame(read_registry()['models'].get(name, {'versions': []})['versions'])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Helper functions for training and evaluation scripts to hand their results to
+the reporting stage (06d_render_reports.py) instead of plotting them
+
+Nothing here imports matplotlib or seaborn; the figures are drawn by a
+separate background process with a non-interactive backend.
+
+"""
+
+import os # file paths
+import subprocess # background reporting process
+import sys # python executable
+
+# folder the results to plot are saved in
+report_folder = 'fit_outputs/reports'
+
+# script that renders the figures
+renderer_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '06d_render_reports.py')
+
+#%%
+
+# function to save a confusion matrix for the reporting stage
+
+def save_confusion_matrix(conf_matrix, class_names, name):
+
+    import pandas as pd
+
+    os.makedirs(report_folder, exist_ok=True)
+
+    confusion_df = pd.DataFrame(data=conf_matrix, index=class_names, columns=class_names)
+    confusion_path = os.path.join(report_folder, 'confusion_' + name + '.csv')
+    confusion_df.to_csv(confusion_path)
+
+    return confusion_path
+
+#%%
+
+# function to start rendering the figures in a background process
+# returns straight away; the figures appear in fit_outputs/figures and the
+# renderer's output is written to fit_outputs/reports/render.log
+
+def launch_report_rendering():
+
+    os.makedirs(report_folder, exist_ok=True)
+
+    with open(os.path.join(report_folder, 'render.log'), 'a') as log_file:
+        process = subprocess.Popen([sys.executable, renderer_path],
+                                   cwd=os.getcwd(),
+                                   env=dict(os.environ, MPLBACKEND='Agg'),
+                                   stdout=log_file,
+                                   stderr=subprocess.STDOUT,
+                                   # keep rendering if the training process exits first
+                                   start_new_session=(os.name == 'posix'))
+
+    print('Rendering figures in the background (process', str(process.pid) + ') to fit_outputs/figures')
+
+    return process
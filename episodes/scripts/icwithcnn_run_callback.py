@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Keras callback that writes each epoch of model.fit to the run store
+(icwithcnn_run_store.py)
+
+It is kept apart from the run store so the query helpers, used by the
+background reporting process, do not import TensorFlow.
+
+"""
+
+from tensorflow import keras # fit callback
+from icwithcnn_run_store import run_store_path, open_run_store, start_run, add_epoch, finish_run # saved run history
+
+#%%
+
+# callback that writes each epoch of model.fit to the run store
+# only the metric values are kept, so no History object or model has to stay alive
+
+class RunStoreCallback(keras.callbacks.Callback):
+
+    def __init__(self, settings, path=run_store_path, script=''):
+        super().__init__()
+        self.settings = settings
+        self.path = path
+        self.script = script
+        self.run_id = None
+
+    def on_train_begin(self, logs=None):
+        self.connection = open_run_store(self.path)
+        self.run_id = start_run(self.connection, self.model.name, self.settings, self.script)
+
+    def on_epoch_end(self, epoch, logs=None):
+        add_epoch(self.connection, self.run_id, epoch, logs or {})
+
+    def on_train_end(self, logs=None):
+        finish_run(self.connection, self.run_id)
+        self.connection.close()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Run history store: keeps the settings of every fit and its per-epoch metrics
+in a single SQLite file so runs can be compared after the script has finished
+
+Several sweep processes can write to the same file at once; SQLite's
+write-ahead log lets readers continue while a writer holds the lock, and each
+write is a short transaction.
+
+Nothing here imports TensorFlow; the fit callback that writes to the store is
+in icwithcnn_run_callback.py.
+
+"""
+
+import json # run settings
+import os # file paths
+import socket # host name
+import sqlite3 # run store
+import time # run start and end times
+
+# default location of the run store
+run_store_path = 'fit_outputs/runs.sqlite'
+
+#%%
+
+# function to open the run store, creating the tables the first time
+
+def open_run_store(path=run_store_path):
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    # wait up to a minute for other writers instead of failing straight away
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+
+    with connection:
+        connection.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model_name TEXT,
+                script TEXT,
+                host TEXT,
+                started REAL,
+                finished REAL,
+                settings TEXT);
+            CREATE TABLE IF NOT EXISTS run_settings (
+                run_id INTEGER REFERENCES runs(run_id),
+                name TEXT,
+                value,
+                PRIMARY KEY (run_id, name));
+            CREATE TABLE IF NOT EXISTS epochs (
+                run_id INTEGER REFERENCES runs(run_id),
+                epoch INTEGER,
+                metric TEXT,
+                value REAL,
+                PRIMARY KEY (run_id, epoch, metric));
+            CREATE INDEX IF NOT EXISTS run_settings_by_name ON run_settings (name, value);
+            CREATE INDEX IF NOT EXISTS epochs_by_metric ON epochs (metric, value);
+        ''')
+
+    return connection
+
+#%%
+
+# function to add a new run and return its id
+# settings is a dictionary of the hyperparameters (e.g. {'dropout_rate': 0.3})
+
+def start_run(connection, model_name, settings, script=''):
+
+    with connection:
+        cursor = connection.execute(
+            'INSERT INTO runs (model_name, script, host, started, settings) VALUES (?, ?, ?, ?, ?)',
+            (model_name, script, socket.gethostname(), time.time(), json.dumps(settings, default=str)))
+        run_id = cursor.lastrowid
+        connection.executemany(
+            'INSERT INTO run_settings (run_id, name, value) VALUES (?, ?, ?)',
+            [(run_id, name, value if isinstance(value, (int, float, str)) else str(value))
+             for name, value in settings.items()])
+
+    return run_id
+
+#%%
+
+# function to save the metrics of one epoch
+
+def add_epoch(connection, run_id, epoch, logs):
+
+    with connection:
+        connection.executemany(
+            'INSERT OR REPLACE INTO epochs (run_id, epoch, metric, value) VALUES (?, ?, ?, ?)',
+            [(run_id, epoch, metric, float(value)) for metric, value in logs.items()])
+
+#%%
+
+# function to mark a run as finished
+
+def finish_run(connection, run_id):
+
+    with connection:
+        connection.execute('UPDATE runs SET finished = ? WHERE run_id = ?', (time.time(), run_id))
+
+#%%
+
+# function to read the per-epoch metrics of a run as a dataframe
+# with one row per epoch and one column per metric, like history.history;
+# pandas is only imported when a dataframe is asked for
+
+def load_history_df(run_id, path=run_store_path):
+
+    import pandas as pd
+
+    connection = open_run_store(path)
+    long_df = pd.read_sql_query('SELECT epoch, metric, value FROM epochs WHERE run_id = ? ORDER BY epoch',
+                                connection, params=(run_id,))
+    connection.close()
+
+    history_df = long_df.pivot(index='epoch', columns='metric', values='value')
+    history_df.columns.name = None
+
+    return history_df
+
+#%%
+
+# function to find the best value of a metric for each value of a setting
+# e.g. best_by_setting('dropout_rate', 'val_loss') for the lowest val_loss of each dropout rate
+
+def best_by_setting(setting, metric, lowest=True, model_name=None, path=run_store_path):
+
+    import pandas as pd
+
+    best = 'MIN' if lowest else 'MAX'
+    query = ('SELECT s.value AS setting_value, ' + best + '(e.value) AS best_value, COUNT(DISTINCT e.run_id) AS runs '
+             'FROM run_settings s JOIN epochs e ON e.run_id = s.run_id JOIN runs r ON r.run_id = s.run_id '
+             'WHERE s.name = ? AND e.metric = ?' + (' AND r.model_name = ?' if model_name else '') +
+             ' GROUP BY s.value ORDER BY s.value')
+    params = (setting, metric, model_name) if model_name else (setting, metric)
+
+    connection = open_run_store(path)
+    best_df = pd.read_sql_query(query, connection, params=params)
+    connection.close()
+
+    return best_df.rename(columns={'setting_value': setting, 'best_value': metric})
+
+#%%
+
+# function to list the runs in the store
+
+def list_runs(model_name=None, path=run_store_path):
+
+    import pandas as pd
+
+    connection = open_run_store(path)
+    if model_name is None:
+        runs_df = pd.read_sql_query('SELECT * FROM runs ORDER BY run_id', connection)
+    else:
+        runs_df = pd.read_sql_query('SELECT * FROM runs WHERE model_name = ? ORDER BY run_id',
+                                    connection, params=(model_name,))
+    connection.close()
+
+    return runs_df
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Adaptive training schedule: early stopping, learning rate on plateau and
+cheaper validation
+
+Instead of validating on the full validation set after every epoch, the policy
+validates every few epochs on a small stratified subset, lowers the learning
+rate when val_loss stops improving, stops early and restores the best weights.
+The full validation set is only used once, at the end.
+
+The fit scripts build a TrainingSchedule and pass its validation data and
+callbacks to fit. It keeps the fixed schedule (full validation after every
+epoch) unless adaptive=True or the CNN_ADAPTIVE_SCHEDULE environment variable
+is set, e.g. CNN_ADAPTIVE_SCHEDULE=1. 04d_adaptive_training_schedule.py
+compares the two.
+
+"""
+
+from tensorflow import keras # neural network callbacks
+from sklearn.model_selection import train_test_split # stratified subset
+import numpy as np # arrays
+import os # environment variable
+
+#%%
+
+# callback that validates on a subset every validate_every epochs and uses the
+# result for early stopping (with the best weights restored at the end) and for
+# lowering the learning rate when val_loss reaches a plateau
+# patience and lr_patience count validation checks, not epochs
+
+class AdaptiveTrainingPolicy(keras.callbacks.Callback):
+
+    def __init__(self, val_images, val_labels, validate_every=2, patience=2,
+                 lr_patience=1, lr_factor=0.5, min_lr=1e-5, min_delta=1e-3, batch_size=256):
+        super().__init__()
+        self.val_images = val_images
+        self.val_labels = val_labels
+        self.validate_every = validate_every
+        self.patience = patience
+        self.lr_patience = lr_patience
+        self.lr_factor = lr_factor
+        self.min_lr = min_lr
+        self.min_delta = min_delta
+        self.batch_size = batch_size
+
+    def on_train_begin(self, logs=None):
+        self.best_val_loss = np.inf
+        self.best_weights = None
+        self.best_epoch = None
+        self.wait = 0
+        self.lr_wait = 0
+        self.epochs_run = 0
+        self.validations = 0
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epochs_run = epoch + 1
+        if (epoch + 1) % self.validate_every != 0:
+            return
+
+        # evaluate on the validation subset and add the results to the epoch logs
+        val_results = self.model.evaluate(self.val_images, self.val_labels,
+                                          batch_size=self.batch_size, verbose=0, return_dict=True)
+        self.validations += 1
+        if logs is not None:
+            logs.update({'val_' + name: value for name, value in val_results.items()})
+
+        if val_results['loss'] < self.best_val_loss - self.min_delta:
+            self.best_val_loss = val_results['loss']
+            self.best_weights = self.model.get_weights()
+            self.best_epoch = epoch + 1
+            self.wait = 0
+            self.lr_wait = 0
+            return
+
+        self.wait += 1
+        self.lr_wait += 1
+
+        # lower the learning rate on a plateau
+        if self.lr_wait >= self.lr_patience:
+            learning_rate = float(keras.backend.get_value(self.model.optimizer.learning_rate))
+            new_learning_rate = max(learning_rate * self.lr_factor, self.min_lr)
+            if new_learning_rate < learning_rate:
+                keras.backend.set_value(self.model.optimizer.learning_rate, new_learning_rate)
+                print('\nEpoch', epoch + 1, ': learning rate lowered to', new_learning_rate)
+            self.lr_wait = 0
+
+        # stop when val_loss has not improved for patience checks
+        if self.wait >= self.patience:
+            print('\nEpoch', epoch + 1, ': stopping early, best val_loss at epoch', self.best_epoch)
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+#%%
+
+# function to take a small validation subset with the same share of each class
+# as the full validation set; val_labels are one hot encoded
+
+def validation_subset(val_images, val_labels, size=2000, seed=42):
+
+    if size >= len(val_images):
+        return val_images, val_labels
+
+    val_images_subset, _, val_labels_subset, _ = train_test_split(
+        val_images, val_labels, train_size = size, stratify = val_labels.argmax(axis=1), random_state=seed)
+
+    return val_images_subset, val_labels_subset
+
+#%%
+
+class TrainingSchedule:
+
+    # val_images, val_labels: the full validation set
+    # adaptive: True for the adaptive policy, False for full validation after
+    # every epoch, None to read the CNN_ADAPTIVE_SCHEDULE environment variable
+    # subset_size: validation images the policy checks every validate_every epochs
+    # policy_settings: passed on to AdaptiveTrainingPolicy
+
+    def __init__(self, val_images, val_labels, adaptive=None, subset_size=2000, **policy_settings):
+        if adaptive is None:
+            adaptive = os.environ.get('CNN_ADAPTIVE_SCHEDULE', '') not in ('', '0')
+        self.adaptive = adaptive
+        self.name = 'adaptive' if adaptive else 'fixed'
+        self.val_images = val_images
+        self.val_labels = val_labels
+        self.policy = None
+        if adaptive:
+            self.policy = AdaptiveTrainingPolicy(*validation_subset(val_images, val_labels, subset_size),
+                                                 **policy_settings)
+
+    # the validation_data to pass to fit: none for the adaptive policy, which validates itself
+    def validation_data(self):
+        if self.adaptive:
+            return None
+        return (self.val_images, self.val_labels)
+
+    # the callbacks to pass to fit, ahead of any callback that saves the epoch logs
+    # so those see the validation results the policy adds
+    def callbacks(self):
+        return [self.policy] if self.adaptive else []
+
+    # the validation accuracy of the fitted model on the full validation set
+    # the adaptive policy only checked a subset, so the full set is evaluated once here
+    def final_val_accuracy(self, model, history, batch_size=256):
+        if not self.adaptive:
+            return history.history['val_categorical_accuracy'][-1]
+        val_results = model.evaluate(self.val_images, self.val_labels,
+                                     batch_size=batch_size, verbose=0, return_dict=True)
+        return val_results['categorical_accuracy']
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Evaluation of a registered model over a very large test set, split into
+shards that are evaluated in parallel worker processes
+
+The images are kept as uint8 in one raw file, (N, height, width, 3) row after
+row (the layout of images.u8 in icwithcnn_image_cache.py), and the labels in a
+.npy file. Each worker process is started with a fixed number of threads,
+loads the model once and reads its shards straight from the files, so no images
+are sent between processes.
+
+Every shard saves its confusion matrix, image count and summed log loss. These
+add up exactly, so the global accuracy, per-class precision, recall and F1 and
+mean loss are the same as for one process predicting every image. A shard that
+is saved is never evaluated again. The driver hands out one shard at a time,
+so when a worker crashes it knows which shard was lost: a new worker is
+started and only that shard goes back in the queue, while the other workers
+carry on.
+
+"""
+
+import collections # shard queue and failure counts
+import multiprocessing # worker processes
+import multiprocessing.connection # wait for any worker
+import numpy as np # arrays
+import json # shard manifest
+import os # file paths and thread settings
+import time # timing
+
+# the model loaded by this worker process
+worker_state = {}
+
+#%%
+
+# function to write images and labels in the layout the workers read
+# returns the paths of the image file and the label file
+
+def write_eval_set(images, labels, folder):
+
+    os.makedirs(folder, exist_ok=True)
+    images_path = os.path.join(folder, 'images.u8')
+    labels_path = os.path.join(folder, 'labels.npy')
+
+    np.ascontiguousarray(images, dtype=np.uint8).tofile(images_path)
+    np.save(labels_path, np.asarray(labels).ravel())
+
+    return images_path, labels_path
+
+#%%
+
+# function to start a worker process: set its thread budget, then load the model
+# runs once in every worker, before TensorFlow has started in that process
+
+def start_worker(model_name, version, threads):
+
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+    import tensorflow as tf # thread settings
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    from icwithcnn_registry import load_registered_model # versioned models
+    worker_state['model'] = load_registered_model(model_name, version)
+
+#%%
+
+# function to evaluate one shard in a worker and save its counts
+# crash is only used to check recovery: the worker process exits without saving
+
+def evaluate_shard(shard, images_path, labels_path, image_shape, start, stop, num_classes,
+                   output_folder, batch_size=1024, crash=False):
+
+    from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+    if crash:
+        os._exit(1)
+
+    model = worker_state['model']
+    images = np.memmap(images_path, dtype=np.uint8, mode='r', shape=(stop - start,) + tuple(image_shape),
+                       offset=start * int(np.prod(image_shape)))
+    labels = np.load(labels_path, mmap_mode='r')[start:stop]
+
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    loss_sum = 0.0
+    for batch_start in range(0, stop - start, batch_size):
+        batch_labels = np.asarray(labels[batch_start:batch_start + batch_size], dtype=np.int64)
+        predictions = model.predict(model_input(model, np.asarray(images[batch_start:batch_start + batch_size])),
+                                    batch_size=batch_size, verbose=0)
+        confusion += np.bincount(batch_labels * num_classes + predictions.argmax(axis=1),
+                                 minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+        true_probabilities = predictions[np.arange(len(batch_labels)), batch_labels]
+        loss_sum += float(-np.log(np.clip(true_probabilities, 1e-7, 1.0)).sum())
+
+    # write then rename, so a shard file is either complete or missing
+    shard_path = os.path.join(output_folder, 'shard_%06d.npz' % shard)
+    np.savez(shard_path + '.tmp.npz', confusion=confusion, count=stop - start, loss_sum=loss_sum)
+    os.replace(shard_path + '.tmp.npz', shard_path)
+
+    return shard
+
+#%%
+
+# function run by each worker process: start up once, then evaluate the shards
+# the driver sends one at a time until it sends None
+# an error in a shard is reported back and the worker carries on
+
+def worker_loop(connection, model_name, version, threads):
+
+    start_worker(model_name, version, threads)
+
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        try:
+            evaluate_shard(*task)
+            connection.send(('done', ''))
+        except Exception as error:
+            connection.send(('error', repr(error)))
+
+#%%
+
+# function to add up the saved shards and compute the global metrics from the sums
+
+def merge_shards(output_folder, num_shards, num_classes):
+
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    count = 0
+    loss_sum = 0.0
+    for shard in range(num_shards):
+        with np.load(os.path.join(output_folder, 'shard_%06d.npz' % shard)) as saved:
+            confusion += saved['confusion']
+            count += int(saved['count'])
+            loss_sum += float(saved['loss_sum'])
+
+    metrics = metrics_from_confusion(confusion)
+    metrics['count'] = count
+    metrics['loss'] = loss_sum / count if count else float('nan')
+
+    return confusion, metrics
+
+#%%
+
+# function to compute accuracy and per-class precision, recall and F1 from a
+# confusion matrix (rows are true classes, columns predicted classes)
+
+def metrics_from_confusion(confusion):
+
+    correct = np.diag(confusion).astype(np.float64)
+    predicted = confusion.sum(axis=0)
+    actual = confusion.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, correct / predicted, 0.0)
+        recall = np.where(actual > 0, correct / actual, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    return {'accuracy': correct.sum() / max(confusion.sum(), 1),
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'macro_f1': float(f1.mean())}
+
+#%%
+
+# function to evaluate a registered model over an image file with parallel workers
+# images_path, labels_path: written by write_eval_set (or an image cache and its labels)
+# shards that are already saved in output_folder for the same model and data are not evaluated again
+# returns the merged confusion matrix, the metrics and a summary of the run
+
+def evaluate_sharded(model_name, images_path, labels_path, output_folder, ref='best', image_shape=(32, 32, 3),
+                     num_classes=10, shard_size=50000, num_workers=4, threads_per_worker=None,
+                     batch_size=1024, max_retries=2, crash_shards=()):
+
+    from icwithcnn_registry import resolve_model # versioned models
+
+    metadata = resolve_model(model_name, ref)
+    num_images = os.path.getsize(images_path) // int(np.prod(image_shape))
+    threads_per_worker = threads_per_worker or max(1, os.cpu_count() // num_workers)
+    shards = [(shard, start, min(start + shard_size, num_images))
+              for shard, start in enumerate(range(0, num_images, shard_size))]
+
+    # saved shards only count if they are for this model version, data and sharding
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = {'model': model_name, 'version': metadata['version'], 'sha256': metadata['sha256'],
+                'images_path': os.path.abspath(images_path), 'images_mtime': os.path.getmtime(images_path),
+                'labels_path': os.path.abspath(labels_path), 'labels_mtime': os.path.getmtime(labels_path),
+                'num_images': num_images, 'shard_size': shard_size, 'num_classes': num_classes}
+    manifest_path = os.path.join(output_folder, 'manifest.json')
+    saved_manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            saved_manifest = json.load(file)
+    if saved_manifest != manifest:
+        for name in os.listdir(output_folder):
+            if name.startswith('shard_'):
+                os.remove(os.path.join(output_folder, name))
+        with open(manifest_path, 'w') as file:
+            json.dump(manifest, file)
+
+    def saved(shard):
+        return os.path.exists(os.path.join(output_folder, 'shard_%06d.npz' % shard))
+
+    summary = {'images': num_images, 'shards': len(shards), 'workers': num_workers,
+               'threads_per_worker': threads_per_worker, 'already_saved': sum(saved(shard) for shard, _, _ in shards),
+               'worker_crashes': 0, 'rerun_shards': []}
+    evaluate_start = time.perf_counter()
+
+    queue = collections.deque(item for item in shards if not saved(item[0]))
+    evaluated_images = sum(stop - start for _, start, stop in queue)
+    failures = collections.Counter()
+
+    # spawn fresh processes so each worker starts its own TensorFlow runtime
+    context = multiprocessing.get_context('spawn')
+
+    def launch_worker():
+        connection, worker_connection = context.Pipe()
+        process = context.Process(target=worker_loop, daemon=True,
+                                  args=(worker_connection, model_name, metadata['version'], threads_per_worker))
+        process.start()
+        worker_connection.close()
+        return {'process': process, 'connection': connection, 'item': None}
+
+    # the worker process died: replace it, the other workers carry on
+    # returns the message for the shard it held
+    def replace_worker(worker):
+        worker['connection'].close()
+        if worker['process'].is_alive():
+            worker['process'].terminate()
+        worker['process'].join()
+        summary['worker_crashes'] += 1
+        workers[workers.index(worker)] = launch_worker()
+        return 'worker exited with code ' + str(worker['process'].exitcode)
+
+    # put only this shard back in the queue, unless it has failed too often
+    def requeue(item, message):
+        shard = item[0]
+        failures[shard] += 1
+        summary['rerun_shards'].append(shard)
+        if failures[shard] > max_retries:
+            raise RuntimeError('Shard ' + str(shard) + ' failed ' + str(failures[shard]) + ' times: ' + message)
+        queue.appendleft(item)
+
+    workers = [launch_worker() for _ in range(min(num_workers, len(queue)))]
+    try:
+        while queue or any(worker['item'] for worker in workers):
+            # give every idle worker its next shard
+            # (a copy of the list, as a worker that died while idle is replaced in it)
+            for worker in list(workers):
+                if worker['item'] is None and queue:
+                    worker['item'] = queue.popleft()
+                    shard, start, stop = worker['item']
+                    try:
+                        worker['connection'].send((shard, images_path, labels_path, image_shape, start, stop, num_classes,
+                                                   output_folder, batch_size, shard in crash_shards and not failures[shard]))
+                    except OSError:
+                        # the pipe is closed because the worker process died
+                        requeue(worker['item'], replace_worker(worker))
+                        worker['item'] = None
+
+            busy = [worker for worker in workers if worker['item']]
+            if not busy:
+                continue
+            for connection in multiprocessing.connection.wait([worker['connection'] for worker in busy]):
+                worker = next(worker for worker in busy if worker['connection'] is connection)
+                try:
+                    status, message = connection.recv()
+                except EOFError:
+                    status, message = 'crashed', replace_worker(worker)
+
+                if status != 'done':
+                    requeue(worker['item'], message)
+                worker['item'] = None
+    finally:
+        for worker in workers:
+            if worker['process'].is_alive():
+                try:
+                    worker['connection'].send(None)
+                except OSError:
+                    pass
+            worker['process'].join(timeout=10)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+
+    summary['seconds'] = time.perf_counter() - evaluate_start
+    confusion, metrics = merge_shards(output_folder, len(shards), num_classes)
+    summary['images_per_second'] = evaluated_images / summary['seconds']
+
+    return confusion, metrics, summary
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Small, class-balanced subsets of the training images for fast iteration on a
+model before a full fit
+
+Three ways of choosing the subset:
+    stratified         the same number of images from every class, at random
+    kcenter            k-center greedy within every class: each new image is the
+                       one furthest from those already chosen, so the subset
+                       covers the spread of each class; distances are between
+                       8x8 average pooled pixels
+    kcenter_embedding  k-center greedy on the embeddings of the best registered
+                       dropout model
+
+The chosen positions are cached in fit_outputs/subsets, keyed by the method,
+size, seed and a fingerprint of the images, so a subset is only chosen once.
+
+Every fit script calls apply_subset on its training split, after the
+validation set has been split off, so the validation set is the same whole
+set as in a full-data run. It does nothing unless a size is given or the
+CNN_SUBSET environment variable is set, e.g. CNN_SUBSET=5000 or
+CNN_SUBSET=5000:kcenter. The images may be uint8 or normalised to between 0
+and 1, and the labels class numbers or one hot encoded.
+
+"""
+
+import numpy as np # arrays
+import hashlib # image fingerprint
+import os # file paths and environment variables
+
+# folder the chosen positions are cached in
+subset_folder = 'fit_outputs/subsets'
+
+# subset methods
+subset_methods = ('stratified', 'kcenter', 'kcenter_embedding')
+
+#%%
+
+# function to read the subset switch
+# returns (size, method), or None to use every image
+
+def subset_settings(size=None, method=None):
+
+    if size is None and os.environ.get('CNN_SUBSET'):
+        setting = os.environ['CNN_SUBSET'].split(':')
+        size = int(setting[0])
+        method = method or (setting[1] if len(setting) > 1 else None)
+
+    if size is None:
+        return None
+
+    method = method or 'stratified'
+    if method not in subset_methods:
+        raise ValueError('Unknown subset method ' + method + ', use one of ' + str(subset_methods))
+
+    return size, method
+
+#%%
+
+# function to get class numbers from class number or one hot encoded labels
+
+def class_numbers(labels):
+
+    labels = np.asarray(labels)
+    if labels.ndim == 2 and labels.shape[1] > 1:
+        return labels.argmax(axis=1).astype(np.int64)
+
+    return labels.ravel().astype(np.int64)
+
+# function to get uint8 pixels from uint8 images or images normalised to between 0 and 1
+
+def pixel_values(images):
+
+    images = np.asarray(images)
+    if images.dtype == np.uint8:
+        return images
+
+    return np.rint(images * 255).clip(0, 255).astype(np.uint8)
+
+#%%
+
+# function to split a subset size between the classes as evenly as possible
+# classes with too few images give all they have
+# returns {class number: number of images}
+
+def class_quotas(labels, size):
+
+    classes, available = np.unique(labels, return_counts=True)
+    quotas = np.zeros(len(classes), dtype=np.int64)
+    total = min(size, len(labels))
+
+    # hand out one round at a time so small classes leave their share to the others
+    while quotas.sum() < total:
+        open_classes = np.flatnonzero(quotas < available)
+        share, extra = divmod(total - quotas.sum(), len(open_classes))
+        wanted = quotas[open_classes] + share + (np.arange(len(open_classes)) < extra)
+        quotas[open_classes] = np.minimum(available[open_classes], wanted)
+
+    return dict(zip(classes.tolist(), quotas.tolist()))
+
+#%%
+
+# function to choose a class-balanced random subset
+# returns positions into labels
+
+def stratified_indices(labels, size, seed=42):
+
+    labels = np.asarray(labels).ravel()
+    rng = np.random.default_rng(seed)
+
+    chosen = [rng.choice(np.flatnonzero(labels == label), size=quota, replace=False)
+              for label, quota in class_quotas(labels, size).items()]
+
+    return np.sort(np.concatenate(chosen))
+
+#%%
+
+# function to pick count rows of features with k-center greedy, starting from a random row
+# returns positions into features
+
+def kcenter_greedy(features, count, seed=42):
+
+    # a class with a quota of 0 (a size smaller than the number of classes) gives no rows
+    if count <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    rng = np.random.default_rng(seed)
+    norms = (features * features).sum(axis=1)
+
+    chosen = [int(rng.integers(len(features)))]
+    # squared distance from every row to its nearest chosen row
+    distances = norms - 2 * features @ features[chosen[0]] + norms[chosen[0]]
+    for _ in range(count - 1):
+        chosen.append(int(distances.argmax()))
+        distances = np.minimum(distances, norms - 2 * features @ features[chosen[-1]] + norms[chosen[-1]])
+
+    return np.array(chosen)
+
+#%%
+
+# function to make small features for k-center: 8x8 average pooled pixels between 0 and 1
+
+def pixel_features(images):
+
+    images = np.asarray(images)
+    height, width = images.shape[1] // 8, images.shape[2] // 8
+    pooled = images[:, :height * 8, :width * 8].reshape(len(images), 8, height, 8, width, -1).mean(axis=(2, 4), dtype=np.float32)
+
+    # normalised images are already between 0 and 1
+    if images.dtype == np.uint8:
+        pooled /= 255.0
+
+    return pooled.reshape(len(images), -1)
+
+#%%
+
+# function to make the embeddings of the best registered dropout model:
+# the output of its Flatten layer
+
+def embedding_features(images, batch_size=1024):
+
+    from tensorflow import keras # data and neural network
+    from icwithcnn_registry import load_registered_model # versioned models
+    from icwithcnn_uint8_input import model_input # uint8 or normalised input
+
+    model = load_registered_model('cifar_model_dropout', 'best')
+    flatten = [layer for layer in model.layers if isinstance(layer, keras.layers.Flatten)][-1]
+    model_embedding = keras.Model(inputs = model.inputs, outputs = flatten.output)
+
+    return model_embedding.predict(model_input(model, pixel_values(images)), batch_size=batch_size, verbose=0)
+
+#%%
+
+# function to choose a class-balanced subset with k-center greedy within each class
+# returns positions into labels
+
+def kcenter_indices(features, labels, size, seed=42):
+
+    labels = np.asarray(labels).ravel()
+    chosen = []
+    for label, quota in class_quotas(labels, size).items():
+        members = np.flatnonzero(labels == label)
+        chosen.append(members[kcenter_greedy(features[members], quota, seed=seed)])
+
+    return np.sort(np.concatenate(chosen))
+
+#%%
+
+# function to fingerprint a set of images and labels for the cache key
+# uses the shapes, every label and a sample of the images, so it is quick
+# labels are class numbers; the sample is taken as uint8 pixels, so prepared
+# and raw copies of the same images share their cached subsets
+
+def data_fingerprint(images, labels):
+
+    digest = hashlib.sha256()
+    digest.update(str((np.shape(images), np.shape(labels))).encode())
+    digest.update(np.ascontiguousarray(labels).tobytes())
+    digest.update(np.ascontiguousarray(pixel_values(images[::max(1, len(images) // 256)])).tobytes())
+
+    return digest.hexdigest()[:16]
+
+#%%
+
+# function to choose a subset, or load it from the cache if it has been chosen before
+# images are (N, height, width, 3), uint8 or normalised; labels are class numbers or one hot encoded
+# returns positions into images
+
+def select_subset(images, labels, size, method='stratified', seed=42):
+
+    labels = class_numbers(labels)
+    key = method + '_' + str(size) + '_' + str(seed) + '_' + data_fingerprint(images, labels)
+    if method == 'kcenter_embedding':
+        # a new best model gives new embeddings
+        from icwithcnn_registry import resolve_model # versioned models
+        key += '_' + resolve_model('cifar_model_dropout', 'best')['sha256'][:8]
+    cache_path = os.path.join(subset_folder, key + '.npy')
+
+    if os.path.exists(cache_path):
+        return np.load(cache_path)
+
+    if method == 'stratified':
+        indices = stratified_indices(labels, size, seed=seed)
+    elif method == 'kcenter':
+        indices = kcenter_indices(pixel_features(images), labels, size, seed=seed)
+    elif method == 'kcenter_embedding':
+        indices = kcenter_indices(embedding_features(images), labels, size, seed=seed)
+    else:
+        raise ValueError('Unknown subset method ' + method + ', use one of ' + str(subset_methods))
+
+    os.makedirs(subset_folder, exist_ok=True)
+    np.save(cache_path, indices)
+
+    return indices
+
+#%%
+
+# function to swap the training images for a subset when the switch is on
+# call it on the training split only, after the validation set is split off
+# returns the images and labels unchanged when it is off
+
+def apply_subset(images, labels, size=None, method=None, seed=42):
+
+    settings = subset_settings(size, method)
+    if settings is None:
+        return images, labels
+
+    size, method = settings
+    indices = select_subset(images, labels, size, method, seed=seed)
+    print('Using a', method, 'subset of', len(indices), 'of', len(images), 'images')
+
+    return images[indices], labels[indices]
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Sweep trial lifecycle: run hyperparameter trials one after another without
+memory or build time growing from trial to trial
+
+A History object holds on to its model, and Keras keeps every model, layer
+name and traced function made in the session. A sweep that keeps the History
+of each trial therefore keeps every model it has trained. Here each trial
+returns only its metrics as plain lists of floats, and everything else is
+released after the trial.
+
+When trials only differ in a value that can live in a variable (such as the
+dropout rate), one model is built and compiled once and reset between trials,
+so the traced train and test functions are reused instead of traced again.
+
+"""
+
+from tensorflow import keras # data and neural network
+import tensorflow as tf # variables and dropout
+import gc # free released models straight away
+import time # build and fit timing
+from icwithcnn_memory import current_rss_bytes # process memory
+
+#%%
+
+# function to copy a History into plain lists of floats, so the History and
+# the model it refers to can be freed
+
+def compact_history(history):
+
+    return {metric: [float(value) for value in values] for metric, values in history.history.items()}
+
+#%%
+
+# function to run one trial and keep only its metrics
+# create_model is called with no arguments and returns a compiled model
+# fit_kwargs are passed to model.fit, evaluate_data is a (images, labels) tuple
+# the Keras session is cleared before the model is built and the model is
+# dropped after it has been evaluated
+
+def run_trial(create_model, fit_kwargs, evaluate_data):
+
+    # forget the models, layer names and traced functions of earlier trials
+    keras.backend.clear_session()
+
+    build_start = time.perf_counter()
+    model = create_model()
+    build_seconds = time.perf_counter() - build_start
+
+    fit_start = time.perf_counter()
+    history = model.fit(**fit_kwargs)
+    fit_seconds = time.perf_counter() - fit_start
+
+    val_loss, val_acc = model.evaluate(*evaluate_data, verbose=0)
+
+    trial = {'history': compact_history(history),
+             'val_loss': float(val_loss),
+             'val_acc': float(val_acc),
+             'build_seconds': build_seconds,
+             'fit_seconds': fit_seconds}
+
+    # release the model, its optimizer state and the History before the next trial
+    # the callbacks passed in still refer to the model through callback.model,
+    # so detach them first or the model is not freed
+    for callback in fit_kwargs.get('callbacks') or []:
+        callback.model = None
+    del model, history
+    gc.collect()
+    trial['rss_mb'] = current_rss_bytes() / 1024**2
+
+    return trial
+
+#%%
+
+# dropout layer whose rate is a variable, so the rate can change between
+# trials without building a new model or tracing new train and test functions
+
+class VariableRateDropout(keras.layers.Layer):
+
+    def __init__(self, rate, **kwargs):
+        super().__init__(**kwargs)
+        self.initial_rate = rate
+
+    def build(self, input_shape):
+        self.rate = self.add_weight(name='rate', shape=(), trainable=False,
+                                    initializer=keras.initializers.Constant(self.initial_rate))
+
+    def call(self, inputs, training=None):
+        if training:
+            return tf.nn.dropout(inputs, rate=self.rate)
+        return inputs
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'rate': self.initial_rate})
+        return config
+
+#%%
+
+# functions to save and restore the weights and optimizer state of a compiled
+# model, so one model can start each trial from the same untrained state
+
+def snapshot_state(model):
+
+    # the optimizer creates its slot variables on first use, so build it now
+    if hasattr(model.optimizer, 'build'):
+        model.optimizer.build(model.trainable_variables)
+
+    return {'weights': model.get_weights(),
+            'optimizer': [variable.numpy() for variable in model.optimizer.variables]}
+
+def restore_state(model, state):
+
+    model.set_weights(state['weights'])
+    for variable, value in zip(model.optimizer.variables, state['optimizer']):
+        variable.assign(value)
+
+#%%
+
+# function to run one trial on a model that is reused between trials
+# set_setting(model) changes the setting being swept (e.g. assigns the dropout
+# rate); the model is reset to the snapshot state first
+
+def run_reused_trial(model, state, set_setting, fit_kwargs, evaluate_data):
+
+    build_start = time.perf_counter()
+    restore_state(model, state)
+    set_setting(model)
+    build_seconds = time.perf_counter() - build_start
+
+    fit_start = time.perf_counter()
+    history = model.fit(**fit_kwargs)
+    fit_seconds = time.perf_counter() - fit_start
+
+    val_loss, val_acc = model.evaluate(*evaluate_data, verbose=0)
+
+    trial = {'history': compact_history(history),
+             'val_loss': float(val_loss),
+             'val_acc': float(val_acc),
+             'build_seconds': build_seconds,
+             'fit_seconds': fit_seconds}
+
+    del history
+    gc.collect()
+    trial['rss_mb'] = current_rss_bytes() / 1024**2
+
+    return trial
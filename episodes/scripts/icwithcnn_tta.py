@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+Test-time augmentation (TTA) in a single forward pass
+
+Each test image is shown to the model several times (flipped and shifted) and
+the predictions are averaged or voted on. All views of a batch are stacked into
+one larger batch inside the model, so predict runs the network once per batch
+instead of once per view.
+
+"""
+
+import tensorflow as tf # tensor operations inside the model
+from tensorflow import keras # data and neural network
+
+# flip and (dy, dx) pixel shift of each view, in the order views are added
+view_specs = [(False, 0, 0), (True, 0, 0),
+              (False, -2, -2), (False, 2, 2),
+              (True, -2, 2), (True, 2, -2),
+              (False, -2, 2), (False, 2, -2)]
+
+#%%
+
+# layer that turns a batch of N images into a batch of num_views * N images
+# the shifted crops are cut from a reflection padded copy of each image
+
+class TestTimeViews(keras.layers.Layer):
+
+    def __init__(self, num_views, max_shift=2, **kwargs):
+        super().__init__(**kwargs)
+        self.num_views = num_views
+        self.max_shift = max_shift
+
+    def call(self, images):
+        pad = self.max_shift
+        height, width = images.shape[1], images.shape[2]
+        padded = tf.pad(images, [[0, 0], [pad, pad], [pad, pad], [0, 0]], mode='REFLECT')
+
+        views = []
+        for flip, dy, dx in view_specs[:self.num_views]:
+            view = padded[:, pad + dy:pad + dy + height, pad + dx:pad + dx + width, :]
+            if flip:
+                view = tf.image.flip_left_right(view)
+            views.append(view)
+
+        return tf.concat(views, axis=0)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'num_views': self.num_views, 'max_shift': self.max_shift})
+        return config
+
+#%%
+
+# layer that combines the num_views * N predictions back into N predictions
+# 'mean' averages the probabilities, 'vote' takes the share of views that
+# picked each class and breaks ties with the mean probability
+
+class ReduceViews(keras.layers.Layer):
+
+    def __init__(self, num_views, reduction='mean', **kwargs):
+        super().__init__(**kwargs)
+        self.num_views = num_views
+        self.reduction = reduction
+
+    def call(self, probabilities):
+        num_classes = probabilities.shape[-1]
+        per_view = tf.reshape(probabilities, [self.num_views, -1, num_classes])
+        mean_probabilities = tf.reduce_mean(per_view, axis=0)
+
+        if self.reduction == 'mean':
+            return mean_probabilities
+
+        votes = tf.reduce_mean(tf.one_hot(tf.argmax(per_view, axis=-1), num_classes), axis=0)
+        scores = votes + 1e-3 * mean_probabilities
+        return scores / tf.reduce_sum(scores, axis=-1, keepdims=True)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'num_views': self.num_views, 'reduction': self.reduction})
+        return config
+
+#%%
+
+# function to wrap a trained model so predict uses test-time augmentation
+
+def create_model_tta(model, num_views, reduction='mean'):
+
+    # same input as the trained model
+    inputs_tta = keras.Input(shape=model.input_shape[1:])
+    # stack all views into one batch
+    x_tta = TestTimeViews(num_views)(inputs_tta)
+    # a single forward pass over every view
+    x_tta = model(x_tta)
+    # combine the views of each image
+    outputs_tta = ReduceViews(num_views, reduction)(x_tta)
+
+    model_tta = keras.Model(inputs = inputs_tta,
+                            outputs = outputs_tta,
+                            name = model.name + "_tta" + str(num_views))
+
+    return model_tta
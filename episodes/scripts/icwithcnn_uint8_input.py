@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Image Classification with Convolutional Neural Networks
+
+In-graph input preprocessing, so models take uint8 images directly
+
+A model whose first layers are Rescaling (and optionally Resizing) takes the
+raw uint8 pixels of shape (N, 32, 32, 3). Callers no longer make a float64 copy
+with `images / 255.0` before every predict, send 8 times fewer bytes to the
+model, and cannot get wrong predictions by forgetting to normalise.
+
+"""
+
+from tensorflow import keras # data and neural network
+import numpy as np # arrays
+
+#%%
+
+# function to add the preprocessing layers to a uint8 input tensor
+# a model builder can use this straight after keras.Input(..., dtype='uint8')
+# image_size: (height, width) to resize to, or None if the images are already that size
+
+def uint8_front_end(inputs, image_size=None):
+
+    x = inputs
+    # resize any image size to the size the model was trained on
+    if image_size is not None:
+        x = keras.layers.Resizing(height=image_size[0], width=image_size[1], name='resize')(x)
+    # scale the RGB values to be between 0 and 1, casting to float inside the model
+    x = keras.layers.Rescaling(scale=1.0 / 255, name='rescale')(x)
+
+    return x
+
+#%%
+
+# function to wrap a trained model that expects normalised float images so it
+# takes uint8 images instead
+# with resize=True the wrapped model accepts any image height and width
+
+def create_model_uint8(model, resize=False):
+
+    image_shape = model.input_shape[1:]
+
+    # uint8 input, with free height and width if the model resizes
+    if resize:
+        inputs_uint8 = keras.Input(shape=(None, None, image_shape[-1]), dtype='uint8')
+        x_uint8 = uint8_front_end(inputs_uint8, image_size=image_shape[:2])
+    else:
+        inputs_uint8 = keras.Input(shape=image_shape, dtype='uint8')
+        x_uint8 = uint8_front_end(inputs_uint8)
+
+    # the trained model unchanged
+    outputs_uint8 = model(x_uint8)
+
+    model_uint8 = keras.Model(inputs = inputs_uint8,
+                              outputs = outputs_uint8,
+                              name = model.name + "_uint8")
+
+    return model_uint8
+
+#%%
+
+# function to check whether a model takes uint8 images
+
+def takes_uint8(model):
+
+    return model.inputs[0].dtype == 'uint8'
+
+#%%
+
+# function to get the input a model expects from uint8 images
+# uint8 models get the images unchanged, other models get float32 images
+# between 0 and 1 (float32 rather than the float64 of images / 255.0)
+
+def model_input(model, images):
+
+    if takes_uint8(model):
+        return np.asarray(images, dtype=np.uint8)
+
+    return np.asarray(images, dtype=np.float32) / 255.0
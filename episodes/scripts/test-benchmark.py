@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Probe this machine and run short micro-benchmarks (GEMM, Conv2D forward and
+backward at CIFAR-10 shapes, intro model training steps)
+
+The full report is saved as fit_outputs/hardware_<host>.json and the score
+is printed as json on the last line, for a scheduler to read.
+"""
+
+import json
+from icwithcnn_hardware import hardware_report
+
+report = hardware_report()
+
+# the benchmark results
+for name, value in report['benchmarks'].items():
+    print(name, value)
+
+# machine-readable score
+print(json.dumps(report['score']))
@@ -9,4 +9,12 @@ import tensorflow as tf
 
 tf.test.gpu_device_name()
 
-#print(tf.test.gpu_device_name())
\ No newline at end of file
+#print(tf.test.gpu_device_name())
+
+# list every accelerator TensorFlow can see, not just the first GPU
+for device in tf.config.list_physical_devices():
+    if device.device_type != 'CPU':
+        print(device.name, tf.config.experimental.get_device_details(device))
+
+if not [device for device in tf.config.list_physical_devices() if device.device_type != 'CPU']:
+    print('No GPU or other accelerator found, TensorFlow will run on the CPU')
@@ -16,3 +16,11 @@ print('pandas version: ', pandas.__version__)
 
 import tensorflow
 print('Tensorflow version: ', tensorflow.__version__)
+
+
+# describe the machine: CPU, cores, NUMA nodes, SIMD features, oneDNN,
+# TensorFlow threading and accelerators
+# run test-benchmark.py to also measure how fast it trains
+import json
+from icwithcnn_hardware import probe_environment
+print(json.dumps(probe_environment(), indent=2))